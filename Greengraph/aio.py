@@ -0,0 +1,315 @@
+"""
+This module defines the AsyncGreengraph class, an asyncio counterpart of Greengraph for
+use inside event loops, such as those of web services.
+
+Nothing in it blocks the event loop:
+- Map images are fetched with aiohttp through an AsyncMapSession, which shares the
+  RetryPolicy of MapSession: the same retries, backoff, Retry-After limit and rate
+  limiting, waiting with asyncio.sleep. At most a bounded number are fetched at once.
+  Without aiohttp, which is an optional dependency, Map.fetch runs in the executor instead.
+- Geocoding, tile cache access, decoding and classification run in the executor.
+
+Locations, sampling and counting are those of Greengraph and Map, so the results are
+the same as those of the synchronous API.
+
+Example:
+    async with AsyncGreengraph('London', 'Cambridge', concurrency = 8) as graph:
+        counts = await graph.green_between(20)
+"""
+
+import asyncio
+from Greengraph.graph import Greengraph
+from Greengraph.map import Map
+from Greengraph.session import MAX_RETRY_AFTER, RetryPolicy
+from Greengraph import profiling
+from concurrent.futures import Executor
+from typing import AsyncIterator, Optional, Tuple
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+class AsyncMapSession(RetryPolicy):
+    """
+    A pooled aiohttp session with the retries, backoff, rate limiting and timeouts of
+    MapSession, for use from one event loop.
+
+    Attributes:
+        retries (int): The number of times a failed request is retried.
+        backoff (float): The delay before the first retry in seconds, doubled for each further retry.
+        timeout (Tuple[float, float]): The connect and read timeouts of each request in seconds.
+        limiter (TokenBucket): The rate limiter, or None if requests are not rate limited.
+        max_retry_after (float): The longest Retry-After delay in seconds that is waited for.
+    """
+
+    def __init__(self, pool_size: int = 16, retries: int = 3, backoff: float = 0.5, rate: Optional[float] = None,
+                 burst: Optional[float] = None, timeout: Tuple[float, float] = (5.0, 30.0),
+                 max_retry_after: float = MAX_RETRY_AFTER):
+        """
+        Initialize an AsyncMapSession object. The connections are opened on the first request.
+
+        Args:
+            pool_size (int): The maximum number of open connections. Default is 16.
+            retries (int): The number of times a failed request is retried. Default is 3.
+            backoff (float): The delay before the first retry in seconds. Default is 0.5.
+            rate (float): Optional maximum number of requests per second. Default is None, meaning unlimited.
+            burst (float): The number of requests allowed in a burst when rate limited. Defaults to the rate.
+            timeout (Tuple[float, float]): The connect and read timeouts in seconds. Default is (5, 30).
+            max_retry_after (float): The longest Retry-After delay in seconds that is waited for. A response
+                asking for a longer delay fails the request. Default is MAX_RETRY_AFTER.
+
+        Raises:
+            ImportError: If aiohttp is not installed.
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncMapSession needs aiohttp, which is not installed")
+        super().__init__(retries, backoff, rate, burst, max_retry_after)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session = None
+
+    async def get(self, url: str, params: dict) -> bytes:
+        """
+        Fetch the content of a URL, retrying transient failures.
+
+        Args:
+            url (str): The URL to fetch.
+            params (dict): The query parameters of the request.
+
+        Returns:
+            bytes: The content of the response.
+
+        Raises:
+            FetchError: If the request fails with a non-retryable status, returns no content,
+                asks to be retried after more than max_retry_after seconds, or still fails after every retry.
+        """
+        if self._session is None:
+            connect, read = self.timeout
+            self._session = aiohttp.ClientSession(
+                connector = aiohttp.TCPConnector(limit = self.pool_size),
+                timeout = aiohttp.ClientTimeout(sock_connect = connect, sock_read = read))
+
+        for attempt in range(self.retries + 1):
+            # Wait for the rate limiter without blocking the event loop
+            wait = self.start(attempt)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            try:
+                async with self._session.get(url, params = params) as response:
+                    content = await response.read()
+                    status, headers = response.status, response.headers
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                failure, delay = f"{type(error).__name__}: {error}", self.delay(attempt)
+            else:
+                failure, delay = self.check(url, attempt, status, content, headers)
+                if failure is None:
+                    return content
+
+            if attempt < self.retries:
+                await asyncio.sleep(delay)
+
+        raise self.exhausted(url, failure)
+
+    async def close(self) -> None:
+        """
+        Close the pooled connections.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+class AsyncGreengraph(object):
+    """
+    An asyncio counterpart of Greengraph, giving the same results without blocking the event loop.
+
+    A session created by the AsyncGreengraph itself is closed when green_between or
+    iter_green_between finishes, so a plain `await graph.green_between(steps)` leaves no
+    connections open. Images fetched with count_location directly are released by close,
+    which `async with` calls on exit.
+
+    Attributes:
+        graph (Greengraph): The synchronous Greengraph whose geocoding and sampling are used.
+        concurrency (int): The maximum number of map images fetched at once.
+        executor (Executor): The executor running the blocking work, or None for the loop's default.
+        session: The AsyncMapSession fetching the images, or None to run Map.fetch in the executor.
+    """
+
+    def __init__(self, start: str, end: str, geocoder=None, geocache=None, concurrency: int = 8,
+                 executor: Optional[Executor] = None, session=None):
+        """
+        Instantiate an AsyncGreengraph object with the specified start and end locations.
+
+        Args:
+            start (str): The starting location for the analysis.
+            end (str): The ending location for the analysis.
+            geocoder (object): An optional geocoder instance for geolocation. Defaults to GoogleV3 geocoder.
+            geocache (GeocodeCache): An optional cache of geocoding results. Defaults to None, meaning no caching.
+            concurrency (int): The maximum number of map images fetched at once. Default is 8.
+            executor (Executor): An optional executor for geocoding, cache access, decoding and
+                classification. Defaults to the default executor of the event loop.
+            session: An optional session with an async get(url, params) method. Defaults to a new
+                AsyncMapSession when aiohttp is installed, and otherwise to fetching in the executor.
+        """
+        self.graph = Greengraph(start, end, geocoder, geocache = geocache)
+        self.concurrency = concurrency
+        self.executor = executor
+        self.session = session if session is not None or aiohttp is None else AsyncMapSession(pool_size = concurrency)
+        self._owns_session = session is None and self.session is not None
+        self._runs = 0
+
+    @property
+    def start(self) -> str:
+        """
+        str: The starting location for the analysis.
+        """
+        return self.graph.start
+
+    @property
+    def end(self) -> str:
+        """
+        str: The ending location for the analysis.
+        """
+        return self.graph.end
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exception):
+        await self.close()
+
+    async def close(self) -> None:
+        """
+        Close the session, if it was created by this AsyncGreengraph. It is opened again by the next request.
+        """
+        if self._owns_session:
+            await self.session.close()
+
+    async def geolocate(self, place: str) -> Optional[tuple]:
+        """
+        Return the latitude and longitude of the specified location, as Greengraph.geolocate does.
+
+        Args:
+            place (str): The location to geolocate.
+
+        Returns:
+            tuple: A tuple containing the latitude and longitude of the location, or None if not found.
+        """
+        return await self._run(self.graph.geolocate, place)
+
+    async def endpoints(self) -> tuple:
+        """
+        Return the coordinates of the start and end locations, looked up concurrently.
+
+        New results are saved to the geocode cache once both are known, as Greengraph.endpoints does.
+
+        Returns:
+            tuple: The (latitude, longitude) of the start and of the end, each None if not found.
+        """
+        coordinates = tuple(await asyncio.gather(self.geolocate(self.start), self.geolocate(self.end)))
+        if self.graph.geocache is not None:
+            await self._run(self.graph.geocache.save)
+        return coordinates
+
+    async def count_location(self, location: tuple) -> int:
+        """
+        Fetch the map centred on a location and count its green pixels.
+
+        Args:
+            location: A (latitude, longitude) pair.
+
+        Returns:
+            int: The number of green pixels in the map image.
+
+        Raises:
+            FetchError: If the map image cannot be fetched or decoded.
+        """
+        tile = Map(*location, keep_image = False)
+        image, cached = await self._fetch(tile)
+        return await self._run(_count_image, tile, image, cached)
+
+    async def iter_green_between(self, steps: int, sampling: str = 'linear') -> AsyncIterator[tuple]:
+        """
+        Yield the number of green pixels at each interval as soon as it is known.
+
+        The intervals are yielded in the order their map images are counted, so callers
+        should use the index to place them.
+
+        Args:
+            steps (int): The number of intervals between the start and end locations.
+            sampling (str): How the intervals are placed, as for Greengraph.location_sequence. Default is 'linear'.
+
+        Yields:
+            tuple: An (index, latitude, longitude, green pixel count) tuple for each interval.
+                Nothing is yielded if the locations are invalid.
+        """
+        start_coords, end_coords = await self.endpoints()
+        if start_coords is None or end_coords is None:
+            return
+
+        locations = self.graph.location_sequence(start_coords, end_coords, steps, sampling)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def count(index: int, location) -> tuple:
+            async with semaphore:
+                green_count = await self.count_location(location)
+            return (index, float(location[0]), float(location[1]), int(green_count))
+
+        self._runs += 1
+        tasks = [asyncio.ensure_future(count(index, location)) for index, location in enumerate(locations)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # Do not leave images being fetched if the caller stops early
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions = True)
+            # Close a session of our own once no run is using it, so that none is left open
+            self._runs -= 1
+            if not self._runs:
+                await self.close()
+
+    async def green_between(self, steps: int, sampling: str = 'linear') -> list:
+        """
+        Calculate the number of green pixels at each interval between two locations, as Greengraph.green_between does.
+
+        Args:
+            steps (int): The number of intervals between the start and end locations.
+            sampling (str): How the intervals are placed, as for Greengraph.location_sequence. Default is 'linear'.
+
+        Returns:
+            list: A list of the number of green pixels at each interval, or an empty list if locations are invalid.
+        """
+        results = sorted([result async for result in self.iter_green_between(steps, sampling)])
+        return [green_count for _, _, _, green_count in results]
+
+    async def _fetch(self, tile: Map) -> Tuple[bytes, bool]:
+        # Archived images are recorded and replayed by Map.fetch
+        if self.session is None or tile.archive is not None:
+            return await self._run(tile.fetch)
+
+        # Reuse the cached image for a previously made request
+        if tile.cache:
+            image = await self._run(tile.cache.get, tile.base, tile.params)
+            if image is not None:
+                profiling.count('tile.cache_hits')
+                return image, True
+            profiling.count('tile.cache_misses')
+
+        with profiling.stage('fetch'):
+            return await self.session.get(tile.base, tile.params), False
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+def _count_image(tile: Map, image: bytes, cached: bool) -> int:
+    # Runs in the executor: decode and classify the image, caching it only once it is known to be valid
+    try:
+        tile.load(image)
+        if tile.cache and not cached:
+            tile.cache.put(tile.base, tile.params, image)
+        return tile.count_green()
+    finally:
+        tile.release()
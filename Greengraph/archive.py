@@ -0,0 +1,270 @@
+"""
+This module defines the Archive class, a single-file record of the map images and
+geocoding results of a run, from which the run can be replayed without any network I/O.
+
+While recording, every image fetched by a Map and every place looked up by the
+archive's geocoder is appended to the archive as it arrives, so an interrupted run
+keeps everything fetched so far. When replaying, images and places are served from
+the archive and anything missing is an error rather than a request, so that a run
+is reproduced exactly, offline, and at disk speed.
+
+The archive is a short header followed by records, each a small fixed-size header,
+the key and the payload. The file is memory-mapped, and an in-memory index of the
+record offsets is built on opening by stepping from one record header to the next,
+so payloads are only read when they are served.
+
+Example:
+    with Archive('run.gga', record = True) as archive:
+        Map.archive = archive
+        Greengraph('London', 'Cambridge', archive.geocoder(geocoder)).green_between(20)
+
+    with Archive('run.gga') as archive:
+        Map.archive = archive
+        Greengraph('London', 'Cambridge', archive.geocoder()).green_between(20)
+"""
+
+import os
+import json
+import mmap
+import struct
+import threading
+from Greengraph.geocode import GeocodeCache
+from Greengraph.session import FetchError
+from Greengraph import profiling
+from typing import Optional
+
+# The first bytes of every archive
+MAGIC = b'GGARCHIV'
+VERSION = 1
+
+# The header holds the magic bytes, the format version and reserved space
+HEADER = struct.Struct('<8sH6x')
+
+# Each record starts with its kind, the length of its key and the length of its payload
+RECORD = struct.Struct('<cHI')
+
+# The kinds of record
+TILE = b'T'
+GEOCODE = b'G'
+
+class Archive(object):
+    """
+    An appendable, memory-mapped archive of map images and geocoding results.
+
+    Attributes:
+        path (str): The archive file.
+        recording (bool): Whether missing images and places are fetched and appended,
+            rather than raising an error.
+    """
+
+    def __init__(self, path: str, record: bool = False):
+        """
+        Open an Archive.
+
+        Args:
+            path (str): The archive file. It is created when recording if it does not exist.
+            record (bool): Whether to record, fetching and appending anything missing. Default is
+                False, meaning replay only.
+
+        Raises:
+            FileNotFoundError: If the file does not exist and the archive is not recording.
+            ValueError: If the file is not an archive of this version.
+        """
+        self.path = path
+        self.recording = record
+        self._index = {}
+        self._lock = threading.Lock()
+        self._map = None
+
+        if record and (not os.path.exists(path) or os.path.getsize(path) == 0):
+            with open(path, 'wb') as archive:
+                archive.write(HEADER.pack(MAGIC, VERSION))
+        self._file = open(path, 'r+b' if record else 'rb')
+
+        header = self._file.read(HEADER.size)
+        if len(header) != HEADER.size or HEADER.unpack(header) != (MAGIC, VERSION):
+            self._file.close()
+            raise ValueError(f"{path} is not a version {VERSION} archive")
+
+        end = self._scan()
+        if record and end < os.path.getsize(path):
+            # Drop a partially written last record left by an interrupted recording
+            self._file.truncate(end)
+            self._remap()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def tile(self, key: str) -> Optional[bytes]:
+        """
+        Return an archived map image.
+
+        Args:
+            key (str): The request key of the image, as given by Map.request_key.
+
+        Returns:
+            bytes: The encoded image, or None if it is not in the archive.
+        """
+        return self._read(TILE, key)
+
+    def put_tile(self, key: str, image: bytes) -> None:
+        """
+        Append a map image to the archive, unless it is already archived.
+
+        Args:
+            key (str): The request key of the image, as given by Map.request_key.
+            image (bytes): The encoded image.
+        """
+        self._append(TILE, key, image)
+
+    def geocode(self, place: str):
+        """
+        Return the archived geocoding result of a place.
+
+        Args:
+            place (str): The place name. Names are normalized as by GeocodeCache.
+
+        Returns:
+            The (address, (latitude, longitude)) result of the geocoder, or None if the geocoder found nothing.
+
+        Raises:
+            KeyError: If the place is not in the archive.
+        """
+        payload = self._read(GEOCODE, GeocodeCache.normalize(place))
+        if payload is None:
+            raise KeyError(place)
+        result = json.loads(payload)
+        return (result[0], tuple(result[1])) if result is not None else None
+
+    def put_geocode(self, place: str, result) -> None:
+        """
+        Append the geocoding result of a place to the archive, unless it is already archived.
+
+        Args:
+            place (str): The place name.
+            result: The (address, (latitude, longitude)) result of the geocoder, or None if nothing was found.
+        """
+        if result is not None:
+            result = [str(result[0]), [float(coordinate) for coordinate in result[1]]]
+        self._append(GEOCODE, GeocodeCache.normalize(place), json.dumps(result).encode('utf-8'))
+
+    def geocoder(self, geocoder = None) -> 'ArchiveGeocoder':
+        """
+        Return a geocoder that serves places from the archive, recording those it looks up.
+
+        Args:
+            geocoder (object): The geocoder for places missing from a recording archive. Default is None.
+
+        Returns:
+            ArchiveGeocoder: A geocoder to pass to Greengraph.
+        """
+        return ArchiveGeocoder(self, geocoder)
+
+    def close(self) -> None:
+        """
+        Close the archive file.
+        """
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+
+    def _scan(self) -> int:
+        # Index every complete record, returning the end of the last one
+        self._remap()
+        size = len(self._map) if self._map is not None else HEADER.size
+        offset = HEADER.size
+        while offset + RECORD.size <= size:
+            kind, key_length, length = RECORD.unpack_from(self._map, offset)
+            start = offset + RECORD.size + key_length
+            if start + length > size:
+                break
+            key = bytes(self._map[offset + RECORD.size:start]).decode('utf-8')
+            self._index[(kind, key)] = (start, length)
+            offset = start + length
+        return offset
+
+    def _remap(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        self._map = mmap.mmap(self._file.fileno(), size, access = mmap.ACCESS_READ) if size else None
+
+    def _read(self, kind: bytes, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._index.get((kind, key))
+            if entry is None:
+                return None
+            start, length = entry
+            # Records appended since the file was mapped need a larger mapping
+            if start + length > len(self._map):
+                self._remap()
+            return self._map[start:start + length]
+
+    def _append(self, kind: bytes, key: str, payload: bytes) -> None:
+        if not self.recording:
+            raise ValueError(f"{self.path} is open for replay only")
+        encoded = key.encode('utf-8')
+        with self._lock:
+            if (kind, key) in self._index:
+                return
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(RECORD.pack(kind, len(encoded), len(payload)) + encoded + payload)
+            self._file.flush()
+            self._index[(kind, key)] = (offset + RECORD.size + len(encoded), len(payload))
+
+class ArchiveGeocoder(object):
+    """
+    A geocoder serving places from an Archive, and recording the places it looks up.
+
+    Attributes:
+        archive (Archive): The archive of geocoding results.
+        geocoder (object): The geocoder for places missing from a recording archive, or None.
+    """
+
+    def __init__(self, archive: Archive, geocoder = None):
+        """
+        Initialize an ArchiveGeocoder object.
+
+        Args:
+            archive (Archive): The archive of geocoding results.
+            geocoder (object): The geocoder for places missing from a recording archive. Default is None.
+        """
+        self.archive = archive
+        self.geocoder = geocoder
+
+    def geocode(self, place: str, exactly_one: bool = True):
+        """
+        Look up a place in the archive, or through the geocoder when recording.
+
+        Args:
+            place (str): The place name.
+            exactly_one (bool): Whether to return only the best match. Only True is supported. Default is True.
+
+        Returns:
+            The (address, (latitude, longitude)) result, or None if the place was not found.
+
+        Raises:
+            FetchError: If the place is not archived and cannot be looked up.
+        """
+        try:
+            result = self.archive.geocode(place)
+        except KeyError:
+            if not self.archive.recording or self.geocoder is None:
+                raise FetchError(f"No archived geocoding result for {place!r}")
+        else:
+            profiling.count('geocode.archive_hits')
+            return result
+
+        result = self.geocoder.geocode(place, exactly_one = exactly_one)
+        self.archive.put_geocode(place, result)
+        return result
@@ -0,0 +1,225 @@
+"""
+This module runs the Greengraph analysis over many origin/destination pairs at once.
+
+Routes are read from a CSV or JSONL file and one result row per route is streamed to
+a CSV or JSONL output file as soon as that route is complete. Work is shared across
+the whole batch rather than repeated per route:
+- Each distinct place name is geocoded only once, and the lookups run concurrently.
+- Each distinct sample point is fetched and counted only once, even when it lies on several routes.
+- Optionally, sample points within a few pixels of each other share one image through a TileIndex.
+- Map images for every route are scheduled on one shared thread pool, in route order, with a
+  bounded number in flight so that memory does not grow with the size of the batch.
+- Optionally, decoding and classification are fanned out to a pool of processes.
+- Optionally, every step result is also appended to a ResultStore.
+
+A route whose places cannot be geocoded, or whose map images cannot be fetched, is not
+dropped: its row has no green counts and an 'error' field describing the failure.
+"""
+
+import csv
+import json
+from Greengraph.graph import Greengraph, count_locations
+from Greengraph.session import FetchError
+from Greengraph.results import ResultStore, route_key
+from Greengraph.spatial import TileIndex
+from typing import Iterator, Optional
+
+# Field names accepted for the start and end of a route
+START_FIELDS = ('from', 'start', 'first_location')
+END_FIELDS = ('to', 'end', 'second_location')
+
+# Field names of the result rows
+RESULT_FIELDS = ['id', 'from', 'to', 'steps', 'green', 'error']
+
+def read_routes(path: str, steps: int = 10) -> list:
+    """
+    Read the routes of a batch from a CSV or JSONL file.
+
+    Each route names its start and end, in 'from' and 'to' fields, and may give its
+    own 'steps' and 'id'. Routes without an id are numbered from zero.
+
+    Args:
+        path (str): The route file. Files ending in .csv are read as CSV, anything else as JSONL.
+        steps (int): The number of steps for routes that do not give their own. Default is 10.
+
+    Returns:
+        list: A list of route dictionaries with 'id', 'from', 'to' and 'steps' keys.
+    """
+    with open(path, newline = '') as source:
+        if path.lower().endswith('.csv'):
+            records = list(csv.DictReader(source))
+        else:
+            records = [json.loads(line) for line in source if line.strip()]
+
+    routes = []
+    for number, record in enumerate(records):
+        record = {str(field).strip().lower(): value for field, value in record.items()}
+        routes.append({
+            'id': record.get('id') or str(number),
+            'from': _field(record, START_FIELDS),
+            'to': _field(record, END_FIELDS),
+            'steps': int(record.get('steps') or steps),
+        })
+    return routes
+
+def iter_batch(routes: list, geocoder=None, geocache=None, workers: int = 8, sampling: str = 'linear',
+               processes: int = 0, with_locations: bool = False,
+               tile_index: Optional[TileIndex] = None) -> Iterator[dict]:
+    """
+    Analyse the green space along many routes, yielding each result in route order.
+
+    Args:
+        routes (list): Route dictionaries as returned by read_routes.
+        geocoder (object): An optional geocoder instance. Defaults to the Greengraph default.
+        geocache (GeocodeCache): An optional cache of geocoding results.
+        workers (int): The maximum number of map images fetched at once. Default is 8.
+        sampling (str): How the steps of each route are placed, as for Greengraph.location_sequence. Default is 'linear'.
+        processes (int): The number of processes decoding and classifying the images. Default is 0,
+            meaning the fetching threads also decode and classify.
+        with_locations (bool): Whether to add the (latitude, longitude) of every step to each
+            row as 'locations'. Default is False.
+        tile_index (TileIndex): An optional index of the tiles already counted. Sample points within
+            its tolerance of an indexed tile share that tile's image and count, and the counts of this
+            batch are added to it for later batches. Default is None, meaning exact centres only.
+
+    Yields:
+        dict: A result row with the route 'id', 'from', 'to', 'steps', the list of 'green' counts,
+            and an 'error' message. The error is None unless a place of the route could not be
+            geocoded or a map image could not be fetched, in which case the counts are None.
+    """
+    graph = Greengraph(None, None, geocoder, geocache = geocache)
+
+    # Geocode each distinct place name once for the whole batch, several at a time. A failed
+    # lookup fails only the routes using that place.
+    coordinates = graph.geolocate_many([place for route in routes for place in (route['from'], route['to'])],
+                                       workers, return_exceptions = True)
+
+    # Sample each route, numbering each distinct sample point in the order the routes need them.
+    # With a tile index, sample points near an indexed tile are snapped to its centre first.
+    distinct = {}
+    snapped = {}
+    sequences = []
+    for route in routes:
+        error = _geocode_error(route, coordinates)
+        if error is not None:
+            sequences.append(error)
+            continue
+
+        start, end = coordinates[route['from']], coordinates[route['to']]
+
+        sequence = [tuple(map(float, location))
+                    for location in graph.location_sequence(start, end, route['steps'], sampling)]
+        for location in sequence:
+            centre = snapped[location] = tile_index.snap(location) if tile_index is not None else location
+            distinct.setdefault(centre, len(distinct))
+        sequences.append(sequence)
+
+    # Count each distinct sample point once, in the order the routes need them, unless the
+    # tile index already knows its count. Only a bounded number are fetched ahead of the
+    # routes being written, so memory stays flat.
+    counts = {}
+    if tile_index is not None:
+        for centre, number in distinct.items():
+            count = tile_index.get(centre)
+            if count is not None:
+                counts[number] = count
+    pending = ((number, centre) for centre, number in distinct.items() if number not in counts)
+    arriving = count_locations(pending, workers, processes, return_exceptions = True)
+
+    def result(location):
+        number = distinct[snapped[location]]
+        while number not in counts:
+            index, lat, long, count = next(arriving)
+            counts[index] = count
+            if tile_index is not None and not isinstance(count, FetchError):
+                tile_index.put((lat, long), count)
+        count = counts[number]
+        if isinstance(count, FetchError):
+            raise count
+        return count
+
+    try:
+        yield from _rows(routes, sequences, result, with_locations)
+    finally:
+        arriving.close()
+
+def _geocode_error(route: dict, coordinates: dict) -> Optional[str]:
+    # Describe why a place of the route has no coordinates, or return None if both have
+    for place in (route['from'], route['to']):
+        found = coordinates[place]
+        if isinstance(found, Exception):
+            return f"Could not geocode '{place}': {type(found).__name__}: {found}"
+        if found is None:
+            return f"Could not geocode '{place}'"
+    return None
+
+def _rows(routes: list, sequences: list, result, with_locations: bool) -> Iterator[dict]:
+    for route, sequence in zip(routes, sequences):
+        # A route that could not be geocoded has the error in place of its sample points
+        if isinstance(sequence, str):
+            row = dict(route, green = None, error = sequence)
+            if with_locations:
+                row['locations'] = []
+            yield row
+            continue
+
+        try:
+            row = dict(route, green = [int(result(location)) for location in sequence], error = None)
+        except FetchError as error:
+            row = dict(route, green = None, error = str(error))
+        if with_locations:
+            row['locations'] = sequence
+        yield row
+
+def run_batch(routes: list, output: str, geocoder=None, geocache=None, workers: int = 8, sampling: str = 'linear',
+              processes: int = 0, store: Optional[ResultStore] = None, tile_index: Optional[TileIndex] = None) -> int:
+    """
+    Analyse the green space along many routes, streaming one result row per route to a file.
+
+    Args:
+        routes (list): Route dictionaries as returned by read_routes.
+        output (str): The result file. Files ending in .csv are written as CSV, anything else as JSONL.
+        geocoder (object): An optional geocoder instance. Defaults to the Greengraph default.
+        geocache (GeocodeCache): An optional cache of geocoding results.
+        workers (int): The maximum number of map images fetched at once. Default is 8.
+        sampling (str): How the steps of each route are placed, as for Greengraph.location_sequence. Default is 'linear'.
+        processes (int): The number of processes decoding and classifying the images. Default is 0,
+            meaning the fetching threads also decode and classify.
+        store (ResultStore): An optional store to which the result of every step is also appended.
+        tile_index (TileIndex): An optional index through which nearby sample points share one tile.
+
+    Returns:
+        int: The number of result rows written.
+    """
+    rows = 0
+    with open(output, 'w', newline = '') as destination:
+        as_csv = output.lower().endswith('.csv')
+        if as_csv:
+            writer = csv.DictWriter(destination, fieldnames = RESULT_FIELDS)
+            writer.writeheader()
+
+        for result in iter_batch(routes, geocoder, geocache, workers, sampling, processes,
+                                 with_locations = store is not None, tile_index = tile_index):
+            if store is not None:
+                locations = result.pop('locations')
+                if result['green']:
+                    number = store.add_route(route_key(result['from'], result['to'], result['steps'], sampling),
+                                             id = result['id'], start = result['from'], end = result['to'],
+                                             steps = result['steps'], sampling = sampling)
+                    store.append(number, [(step, lat, long, green) for step, ((lat, long), green)
+                                          in enumerate(zip(locations, result['green']))])
+
+            if as_csv:
+                writer.writerow(dict(result, green = " ".join(map(str, result['green'] or []))))
+            else:
+                destination.write(json.dumps(result) + "\n")
+            # Flush every row so that results are available while the batch runs
+            destination.flush()
+            rows += 1
+    return rows
+
+def _field(record: dict, names: tuple) -> str:
+    for name in names:
+        if record.get(name):
+            return record[name]
+    raise KeyError(f'Route record has none of the fields {names}')
@@ -0,0 +1,244 @@
+"""
+This module defines the TileCache class, a persistent content-addressed cache for the
+static map images downloaded by the Map class.
+
+Images are stored on disk under a key derived from the normalized request URL and
+parameters, so that byte-identical requests made by later runs are served locally
+instead of going back to the Google Maps API.
+
+The TileCache class provides:
+- An on-disk store with a size-bounded least-recently-used eviction policy. Once the
+  bound is exceeded, images are evicted down to a low-water mark below it, so that the
+  directory is rescanned only after a batch of new images rather than on every store.
+- An optional time-to-live after which cached images are fetched again.
+- A bounded in-memory front layer for images requested repeatedly within one process.
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Environment variable naming the directory of the default tile cache
+CACHE_DIR_VARIABLE = "GREENGRAPH_CACHE_DIR"
+
+# Fraction of max_bytes the cache is evicted down to once it exceeds max_bytes
+LOW_WATER = 0.9
+
+# Age in seconds after which a temporary file is taken to be left by an interrupted write
+STALE_TEMPORARY_AGE = 3600.0
+
+class TileCache(object):
+    """
+    A persistent cache of static map images keyed on their request parameters.
+
+    Access times of the cached files record their last use for the LRU policy,
+    while modification times record when they were stored for the TTL policy.
+    Temporary files left by interrupted writes are deleted when the cache is opened
+    and on eviction.
+
+    Attributes:
+        directory (str): The directory in which cached images are stored.
+        max_bytes (int): The maximum total size of the images kept on disk.
+        low_water (float): The fraction of max_bytes the cache is evicted down to.
+        ttl (float): Optional number of seconds after which a cached image expires.
+        memory_items (int): The number of images kept in the in-memory front layer.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 2**20, ttl: Optional[float] = None, memory_items: int = 64,
+                 low_water: float = LOW_WATER):
+        """
+        Initialize a TileCache object, creating its directory if required.
+
+        Args:
+            directory (str): The directory in which cached images are stored.
+            max_bytes (int): The maximum total size of the images kept on disk. Default is 256 MiB.
+            ttl (float): Optional number of seconds after which a cached image expires. Default is None.
+            memory_items (int): The number of images kept in memory. Default is 64.
+            low_water (float): The fraction of max_bytes the cache is evicted down to once it
+                exceeds max_bytes. Default is LOW_WATER.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.low_water = low_water
+
+        os.makedirs(directory, exist_ok = True)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._remove_stale_temporaries()
+        self._size = sum(os.path.getsize(path) for path in self._paths())
+
+    @classmethod
+    def from_environment(cls) -> Optional["TileCache"]:
+        """
+        Create the default tile cache from the GREENGRAPH_CACHE_DIR environment variable.
+
+        Returns:
+            TileCache: A cache in the named directory, or None if the variable is not set.
+        """
+        directory = os.environ.get(CACHE_DIR_VARIABLE)
+        return cls(directory) if directory else None
+
+    @staticmethod
+    def key(url: str, params: dict) -> str:
+        """
+        Return the content address of a request.
+
+        Parameter values are converted to strings and sorted by name, so that requests
+        which are sent identically to the API share the same key.
+
+        Args:
+            url (str): The base URL of the request.
+            params (dict): The query parameters of the request.
+
+        Returns:
+            str: The hexadecimal SHA-256 digest of the normalized request.
+        """
+        normalized = json.dumps([url, sorted((str(name), str(value)) for name, value in params.items())])
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, url: str, params: dict) -> Optional[bytes]:
+        """
+        Return the cached image for a request.
+
+        Args:
+            url (str): The base URL of the request.
+            params (dict): The query parameters of the request.
+
+        Returns:
+            bytes: The cached image data, or None if the request is not cached or has expired.
+        """
+        key = self.key(url, params)
+        now = time.time()
+
+        with self._lock:
+            if key in self._memory:
+                data, stored = self._memory[key]
+                if not self._expired(stored, now):
+                    self._memory.move_to_end(key)
+                    return data
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            status = os.stat(path)
+            stored = status.st_mtime
+            if self._expired(stored, now):
+                self._remove(path)
+                with self._lock:
+                    self._size -= status.st_size
+                return None
+            with open(path, "rb") as cached:
+                data = cached.read()
+            # Record the access for the LRU policy without changing the storage time
+            os.utime(path, (now, stored))
+        except OSError:
+            return None
+
+        self._remember(key, data, stored)
+        return data
+
+    def put(self, url: str, params: dict, data: bytes) -> None:
+        """
+        Store the image returned for a request, evicting old images if the cache is full.
+
+        Args:
+            url (str): The base URL of the request.
+            params (dict): The query parameters of the request.
+            data (bytes): The image data returned for the request.
+        """
+        key = self.key(url, params)
+        path = self._path(key)
+
+        # Write to a temporary file first so that readers never see a partial image
+        handle, temporary = tempfile.mkstemp(dir = self.directory, suffix = ".tmp")
+        try:
+            with os.fdopen(handle, "wb") as cached:
+                cached.write(data)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temporary, path)
+        except BaseException:
+            self._remove(temporary)
+            raise
+
+        self._remember(key, data, time.time())
+        with self._lock:
+            self._size += len(data) - previous
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def clear(self) -> None:
+        """
+        Remove every image from the cache.
+        """
+        with self._lock:
+            self._memory.clear()
+            for path in self._paths():
+                self._remove(path)
+            self._size = 0
+
+    def _expired(self, stored: float, now: float) -> bool:
+        return self.ttl is not None and now - stored > self.ttl
+
+    def _remember(self, key: str, data: bytes, stored: float) -> None:
+        with self._lock:
+            self._memory[key] = (data, stored)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last = False)
+
+    def _evict(self) -> None:
+        # Rescan the directory, since other processes may share the cache
+        self._remove_stale_temporaries()
+        entries = []
+        for path in self._paths():
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            entries.append((status.st_atime, status.st_size, path))
+
+        self._size = sum(size for _, size, _ in entries)
+        if self._size <= self.max_bytes:
+            return
+
+        # Evict below the bound, so that the next rescan waits for a batch of new images
+        target = self.max_bytes * self.low_water
+        for _, size, path in sorted(entries):
+            if self._size <= target:
+                break
+            self._remove(path)
+            self._size -= size
+            # An evicted image must not be served from memory either
+            self._memory.pop(os.path.splitext(os.path.basename(path))[0], None)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".png")
+
+    def _paths(self) -> list:
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".png")]
+
+    def _remove_stale_temporaries(self) -> None:
+        # Temporary files of other processes may still be being written, so only old ones are removed
+        cutoff = time.time() - STALE_TEMPORARY_AGE
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                path = os.path.join(self.directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,471 @@
+"""
+This module contains the green pixel classification kernels used by the Map class.
+
+A pixel is green when its green channel exceeds both its red and its blue channel
+multiplied by a threshold. The kernels in this module evaluate that test without
+allocating full-size temporaries for every operation:
+- Work buffers are allocated once per image shape and reused through `out=` arguments.
+- uint8 and uint16 images are classified through a lookup table of the float comparison,
+  without float copies, giving exactly the result of comparing in float64.
+- Stacks of images are counted in one call, and several thresholds are answered from
+  a single pass over a uint8 image, with the same counts as each threshold separately.
+- A GreenIndex, the summed-area table of a green mask, answers the count of any
+  rectangular window in constant time once built.
+- A histogram of the greenness ratios summarizes an image compactly, so that the
+  count for any threshold can be read off without the pixels.
+- An approximate count classifies interleaved sub-grids of the pixels only until
+  its error bound is small enough, for screening many images quickly.
+"""
+
+import math
+import numpy as np
+from typing import Optional, Tuple
+
+# Number of image rows classified at a time while building a GreenIndex
+INDEX_ROWS = 256
+
+# Default bin edges of greenness ratio histograms
+RATIO_EDGES = np.linspace(0.0, 3.0, 61)
+
+# Spacing in rows and columns of the pixels of one sub-grid of an approximate count
+SAMPLE_STRIDE = 4
+
+# Number of standard errors spanned by the error bound of an approximate count, for 95% confidence
+CONFIDENCE = 1.96
+
+class GreenKernel(object):
+    """
+    Reusable work buffers for classifying images of one shape.
+
+    Attributes:
+        shape (tuple): The (height, width) of the images the buffers fit.
+    """
+
+    def __init__(self, shape: tuple):
+        """
+        Allocate the work buffers for images of the given shape.
+
+        Args:
+            shape (tuple): The (height, width) of the images.
+        """
+        self.shape = tuple(shape)
+        self._mask = np.empty(self.shape, dtype = bool)
+        self._other = np.empty(self.shape, dtype = bool)
+        self._buffers = {}
+        self._limits = {}
+
+    def mask(self, pixels: np.ndarray, threshold: float, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Determine which pixels of an image are green.
+
+        Args:
+            pixels (np.ndarray): An image of shape (height, width, channels) with at least three channels.
+            threshold (float): Threshold to determine greenness of a pixel.
+            out (np.ndarray): Optional boolean array receiving the result. Defaults to an internal buffer.
+
+        Returns:
+            np.ndarray: A 2D array of boolean values indicating whether each pixel is green.
+        """
+        mask = self._mask if out is None else out
+        red, green, blue = pixels[:, :, 0], pixels[:, :, 1], pixels[:, :, 2]
+
+        if pixels.dtype in (np.uint8, np.uint16) and threshold >= 0:
+            # Look up the largest green value that is not green for the larger of red and blue
+            larger = self._larger(pixels)
+            limit = self._buffer(pixels.dtype, 1)
+            np.take(self._limit_table(pixels.dtype, threshold), larger, out = limit, mode = 'clip')
+            return np.greater(green, limit, out = mask)
+
+        # Other images are compared in float64, unless they are float already, as integers would overflow
+        product = self._buffer(pixels.dtype if np.issubdtype(pixels.dtype, np.floating) else np.float64, 2)
+        np.multiply(red, threshold, out = product)
+        np.greater(green, product, out = mask)
+        np.multiply(blue, threshold, out = product)
+        np.greater(green, product, out = self._other)
+        return np.logical_and(mask, self._other, out = mask)
+
+    def count(self, pixels: np.ndarray, threshold: float) -> int:
+        """
+        Count the green pixels of an image.
+
+        Args:
+            pixels (np.ndarray): An image of shape (height, width, channels).
+            threshold (float): Threshold to determine greenness of a pixel.
+
+        Returns:
+            int: Total number of green pixels.
+        """
+        return int(np.count_nonzero(self.mask(pixels, threshold)))
+
+    def ratio(self, pixels: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Compute the greenness ratio of every pixel, min(green / red, green / blue).
+
+        A pixel is green for a threshold when its ratio is greater than the threshold,
+        except that the rounded ratio of a pixel lying on the threshold can fall on either
+        side of it. A zero red or blue channel gives an infinite ratio when the green
+        channel is positive, and a negative infinite ratio otherwise.
+
+        Args:
+            pixels (np.ndarray): An image of shape (height, width, channels).
+            out (np.ndarray): Optional float64 array receiving the result. Defaults to a new array.
+
+        Returns:
+            np.ndarray: A 2D float64 array of greenness ratios.
+        """
+        ratio = np.empty(self.shape) if out is None else out
+        other = self._buffer(np.float64, 3)
+        green = self._buffer(np.float64, 4)
+        np.copyto(green, pixels[:, :, 1])
+
+        for channel, result in ((0, ratio), (2, other)):
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                np.divide(green, pixels[:, :, channel], out = result)
+            # 0 / 0 has no ratio; such pixels are never green
+            result[np.isnan(result)] = -np.inf
+
+        return np.minimum(ratio, other, out = ratio)
+
+    def counts(self, pixels: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+        """
+        Count the green pixels of an image for several thresholds.
+
+        A uint8 image is counted for every non-negative threshold from one pass over its
+        pixels, through a histogram of its green values against the larger of its red and
+        blue values. Each count is exactly that of the count method, as the histogram is
+        read with the same lookup tables. Other images are classified once per threshold.
+
+        Args:
+            pixels (np.ndarray): An image of shape (height, width, channels).
+            thresholds (np.ndarray): A 1D array of thresholds.
+
+        Returns:
+            np.ndarray: The number of green pixels for each threshold.
+        """
+        thresholds = np.asarray(thresholds, dtype = np.float64)
+        if pixels.dtype != np.uint8 or not np.all(thresholds >= 0):
+            return np.array([self.count(pixels, threshold) for threshold in thresholds], dtype = np.int64)
+
+        # Entry (larger, green) counts the pixels with those values, and above[larger, green + 1]
+        # the pixels of that row with a greater green value, so each count sums one entry per row
+        codes = self._buffer(np.uint16, 5)
+        np.left_shift(self._larger(pixels), 8, out = codes, dtype = np.uint16)
+        np.bitwise_or(codes, pixels[:, :, 1], out = codes)
+        histogram = np.bincount(codes.ravel(), minlength = 256 * 256).reshape(256, 256)
+        above = np.zeros((256, 257), dtype = np.int64)
+        np.cumsum(histogram[:, ::-1], axis = 1, out = above[:, 255::-1])
+
+        limits = np.array([self._limit_table(np.uint8, threshold) for threshold in thresholds], dtype = np.intp)
+        return above[np.arange(256), limits + 1].sum(axis = 1)
+
+    def _larger(self, pixels: np.ndarray) -> np.ndarray:
+        return np.maximum(pixels[:, :, 0], pixels[:, :, 2], out = self._buffer(pixels.dtype, 0))
+
+    def _limit_table(self, dtype, threshold: float) -> np.ndarray:
+        # For an integer green value g and any x, g > x exactly when g > floor(x), so the
+        # float64 products of every channel value with a non-negative threshold, rounded
+        # down, give a table that reproduces the float comparison bit for bit. The products
+        # increase with the channel value, so the larger of red and blue decides the comparison
+        key = (np.dtype(dtype), threshold)
+        if key not in self._limits:
+            top = np.iinfo(dtype).max
+            limits = np.floor(np.arange(top + 1, dtype = np.float64) * threshold)
+            self._limits[key] = np.minimum(limits, top).astype(dtype)
+        return self._limits[key]
+
+    def _buffer(self, dtype, slot: int) -> np.ndarray:
+        key = (np.dtype(dtype), slot)
+        if key not in self._buffers:
+            self._buffers[key] = np.empty(self.shape, dtype = dtype)
+        return self._buffers[key]
+
+def green_mask(pixels: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Determine which pixels of an image are green.
+
+    Args:
+        pixels (np.ndarray): An image of shape (height, width, channels).
+        threshold (float): Threshold to determine greenness of a pixel.
+
+    Returns:
+        np.ndarray: A new 2D array of boolean values indicating whether each pixel is green.
+    """
+    return GreenKernel(pixels.shape[:2]).mask(pixels, threshold, out = np.empty(pixels.shape[:2], dtype = bool))
+
+def count_green_batch(images, thresholds = 1.1) -> np.ndarray:
+    """
+    Count the green pixels of many images, for one or several thresholds, in one call.
+
+    The work buffers are shared by every image of the same shape, and a sequence of
+    thresholds is answered from a single pass over each image.
+
+    Args:
+        images: A stacked array of shape (N, height, width, channels), or a sequence of images.
+        thresholds: A threshold, or a sequence of thresholds. Default is 1.1.
+
+    Returns:
+        np.ndarray: An array of N counts for a single threshold, or of shape (N, T) for T thresholds.
+    """
+    sweep = np.ndim(thresholds) > 0
+    thresholds = np.asarray(thresholds, dtype = np.float64)
+
+    kernels = {}
+    results = []
+    for pixels in images:
+        shape = pixels.shape[:2]
+        if shape not in kernels:
+            kernels[shape] = GreenKernel(shape)
+        kernel = kernels[shape]
+
+        if sweep:
+            results.append(kernel.counts(pixels, thresholds))
+        else:
+            results.append(kernel.count(pixels, float(thresholds)))
+
+    if not results:
+        return np.zeros((0, thresholds.size) if sweep else 0, dtype = np.int64)
+    return np.array(results, dtype = np.int64)
+
+def estimate_green(pixels: np.ndarray, threshold: float = 1.1, tolerance: float = 0.02,
+                   stride: int = SAMPLE_STRIDE) -> Tuple[int, int]:
+    """
+    Estimate the number of green pixels of an image from a sample of its pixels.
+
+    The image is split into the stride x stride interleaved sub-grids pixels[i::stride, j::stride],
+    which are classified one at a time in a fixed scattered order. Counting stops as soon as
+    the 95% error bound of the estimate is within the tolerance, so an image that is mostly
+    green or mostly not needs a single sub-grid, 1/16 of its pixels with the default stride.
+    Once every sub-grid has been classified the count is exact.
+
+    The bound treats the sampled pixels as a random sample. Green space that is patterned
+    on the scale of the stride can be estimated with a larger error.
+
+    Args:
+        pixels (np.ndarray): An image of shape (height, width, channels).
+        threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+        tolerance (float): The largest acceptable error bound, as a fraction of the pixels of the image. Default is 0.02.
+        stride (int): The spacing of the pixels of one sub-grid. Default is SAMPLE_STRIDE.
+
+    Returns:
+        Tuple[int, int]: The estimated number of green pixels, and the bound on its error in pixels.
+    """
+    height, width = pixels.shape[:2]
+    total = height * width
+    offsets = [(row, column) for row in range(stride) for column in range(stride)]
+    order = np.random.default_rng(stride).permutation(len(offsets))
+
+    kernels = {}
+    green = sampled = 0
+    for offset in order:
+        row, column = offsets[offset]
+        grid = pixels[row::stride, column::stride]
+        shape = grid.shape[:2]
+        if shape not in kernels:
+            kernels[shape] = GreenKernel(shape)
+        green += kernels[shape].count(grid, threshold)
+        sampled += shape[0] * shape[1]
+
+        if sampled >= total:
+            return green, 0
+        error = _error_bound(green, sampled, total)
+        if error <= tolerance * total:
+            break
+
+    return int(round(green * total / sampled)), int(math.ceil(error))
+
+def ratio_histogram(pixels: np.ndarray, edges: np.ndarray = RATIO_EDGES) -> np.ndarray:
+    """
+    Count the pixels of an image in each bin of greenness ratio, min(green / red, green / blue).
+
+    Ratios below the first edge are counted in the first bin and ratios above the last edge
+    in the last bin, so that every pixel is counted. The number of green pixels for a
+    threshold equal to a bin edge is, to within the pixels lying exactly on that edge, the
+    sum of the bins above it.
+
+    Args:
+        pixels (np.ndarray): An image of shape (height, width, channels).
+        edges (np.ndarray): The increasing bin edges. Default is RATIO_EDGES, 60 bins from 0 to 3.
+
+    Returns:
+        np.ndarray: The number of pixels in each bin.
+    """
+    ratio = GreenKernel(pixels.shape[:2]).ratio(pixels)
+    np.clip(ratio, edges[0], edges[-1], out = ratio)
+    return np.histogram(ratio, bins = edges)[0]
+
+class GreenIndex(object):
+    """
+    The summed-area table of a green mask, answering the number of green pixels in any
+    rectangular window in constant time.
+
+    Entry (row, column) of the table holds the number of green pixels above and to the
+    left of that position, so that the count of a window is read from its four corners.
+
+    Attributes:
+        table (np.ndarray): The summed-area table, of shape (height + 1, width + 1).
+        threshold (float): The threshold of the indexed mask, or None if unknown.
+        key (str): The request key of the indexed image, or None if unknown.
+    """
+
+    def __init__(self, table: np.ndarray, threshold: Optional[float] = None, key: Optional[str] = None):
+        """
+        Initialize a GreenIndex from a summed-area table.
+
+        Args:
+            table (np.ndarray): The summed-area table, with a leading row and column of zeros.
+            threshold (float): The threshold of the indexed mask. Default is None.
+            key (str): The request key of the indexed image, as given by Map.request_key. Default is None.
+        """
+        self.table = table
+        self.threshold = threshold
+        self.key = key
+
+    @classmethod
+    def from_pixels(cls, pixels: np.ndarray, threshold: float = 1.1) -> 'GreenIndex':
+        """
+        Classify an image and index its green mask.
+
+        The image is classified a block of rows at a time, so that a large memory-mapped
+        mosaic is never classified into one full-size mask.
+
+        Args:
+            pixels (np.ndarray): An image of shape (height, width, channels).
+            threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+
+        Returns:
+            GreenIndex: The index of the image's green pixels.
+        """
+        height, width = pixels.shape[:2]
+        table = np.zeros((height + 1, width + 1), dtype = _table_dtype(height * width))
+        kernel = GreenKernel((min(height, INDEX_ROWS), width))
+        for top in range(0, height, INDEX_ROWS):
+            block = pixels[top:top + INDEX_ROWS]
+            if len(block) != kernel.shape[0]:
+                kernel = GreenKernel((len(block), width))
+            _accumulate(table, top, kernel.mask(block, threshold))
+        return cls(table, threshold)
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray, threshold: Optional[float] = None) -> 'GreenIndex':
+        """
+        Index a green mask.
+
+        Args:
+            mask (np.ndarray): A 2D array of boolean values indicating whether each pixel is green.
+            threshold (float): The threshold of the mask. Default is None.
+
+        Returns:
+            GreenIndex: The index of the mask.
+        """
+        height, width = mask.shape
+        table = np.zeros((height + 1, width + 1), dtype = _table_dtype(height * width))
+        _accumulate(table, 0, mask)
+        return cls(table, threshold)
+
+    @classmethod
+    def load(cls, path: str) -> 'GreenIndex':
+        """
+        Load an index saved by the save method.
+
+        Args:
+            path (str): The .npz file holding the index.
+
+        Returns:
+            GreenIndex: The loaded index.
+        """
+        with np.load(path) as data:
+            threshold = float(data['threshold'])
+            key = str(data['key']) if 'key' in data else ''
+            return cls(data['table'], None if np.isnan(threshold) else threshold, key or None)
+
+    def save(self, path: str) -> None:
+        """
+        Save the index, so that it can be reused without the image.
+
+        Args:
+            path (str): The .npz file to write.
+        """
+        threshold = np.nan if self.threshold is None else self.threshold
+        with open(path, 'wb') as destination:
+            np.savez(destination, table = self.table, threshold = threshold, key = self.key or '')
+
+    @property
+    def shape(self) -> tuple:
+        """
+        tuple: The (height, width) of the indexed mask.
+        """
+        return self.table.shape[0] - 1, self.table.shape[1] - 1
+
+    @property
+    def total(self) -> int:
+        """
+        int: The number of green pixels in the whole mask.
+        """
+        return int(self.table[-1, -1])
+
+    def count(self, top: int = 0, left: int = 0, height: Optional[int] = None, width: Optional[int] = None) -> int:
+        """
+        Count the green pixels in a window. Parts of the window outside the mask count as not green.
+
+        Args:
+            top (int): The first row of the window. Default is 0.
+            left (int): The first column of the window. Default is 0.
+            height (int): The number of rows of the window. Defaults to the rest of the mask.
+            width (int): The number of columns of the window. Defaults to the rest of the mask.
+
+        Returns:
+            int: The number of green pixels in the window.
+        """
+        rows, columns = self.shape
+        bottom = rows if height is None else min(rows, max(0, top + height))
+        right = columns if width is None else min(columns, max(0, left + width))
+        top, left = min(rows, max(0, top)), min(columns, max(0, left))
+        if bottom <= top or right <= left:
+            return 0
+
+        table = self.table
+        return int(table[bottom, right]) - int(table[top, right]) - int(table[bottom, left]) + int(table[top, left])
+
+    def counts(self, tops, lefts, height: int, width: int) -> np.ndarray:
+        """
+        Count the green pixels in many windows of the same size at once.
+
+        Args:
+            tops: The first row of each window.
+            lefts: The first column of each window.
+            height (int): The number of rows of every window.
+            width (int): The number of columns of every window.
+
+        Returns:
+            np.ndarray: The number of green pixels in each window.
+        """
+        rows, columns = self.shape
+        tops, lefts = np.asarray(tops, dtype = np.int64), np.asarray(lefts, dtype = np.int64)
+        bottoms, rights = np.clip(tops + height, 0, rows), np.clip(lefts + width, 0, columns)
+        tops, lefts = np.clip(tops, 0, rows), np.clip(lefts, 0, columns)
+
+        # Only the corners of each window are read from the table, and summed in int64
+        corners = [self.table[rows, columns].astype(np.int64)
+                   for rows, columns in ((bottoms, rights), (tops, rights), (bottoms, lefts), (tops, lefts))]
+        counts = corners[0] - corners[1] - corners[2] + corners[3]
+        # Windows entirely outside the mask are clipped to an empty or inverted rectangle
+        return np.where((bottoms > tops) & (rights > lefts), counts, 0)
+
+def _error_bound(green: int, sampled: int, total: int) -> float:
+    # The Agresti-Coull interval, which stays informative when no or every sampled pixel is green,
+    # with the correction for sampling without replacement from the pixels of the image
+    z = CONFIDENCE
+    fraction = (green + z * z / 2) / (sampled + z * z)
+    spread = z * math.sqrt(fraction * (1 - fraction) / (sampled + z * z))
+    return spread * math.sqrt((total - sampled) / max(1, total - 1)) * total
+
+def _table_dtype(pixels: int):
+    return np.int32 if pixels < 2 ** 31 else np.int64
+
+def _accumulate(table: np.ndarray, top: int, mask: np.ndarray) -> None:
+    # Running sums along each row, then down the columns from the row above the block
+    rows = len(mask)
+    block = table[top + 1:top + rows + 1, 1:]
+    np.cumsum(mask, axis = 1, dtype = table.dtype, out = block)
+    np.cumsum(block, axis = 0, out = block)
+    block += table[top, 1:]
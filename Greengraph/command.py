@@ -2,13 +2,33 @@
 This module handles the command-line interface (CLI) for the Greengraph project.
 It allows users to input two locations and the number of steps between them, 
 and generates a plot representing the green space between the two points.
-The output is saved as a .png image.
+The output is saved as a .png image, and the green pixel counts can also be written
+as CSV or JSON. matplotlib is only imported when a plot is needed, so that --headless
+runs writing numeric output start quickly and need no display.
+
+With --batch, a CSV or JSONL file of routes is analysed instead, and one result row
+per route is streamed to a CSV or JSONL output file.
 """
 
-from matplotlib import pyplot as plt
-from Greengraph.graph import Greengraph
+from Greengraph.graph import Greengraph, SAMPLINGS, default_geocoder
+from Greengraph.archive import Archive
+from Greengraph.map import Map
+from Greengraph.cache import TileCache
+from Greengraph.geocode import GeocodeCache
+from Greengraph.session import MapSession, MAX_RETRY_AFTER
+from Greengraph.results import ResultStore, route_key
+from Greengraph.spatial import TileIndex
+from Greengraph import batch, geo, profiling
+import os
+import csv
+import sys
+import json
+import math
 from argparse import ArgumentParser
 
+# matplotlib's pyplot, imported by the pyplot function when a plot is first needed
+plt = None
+
 # Initialize ArgumentParser for handling CLI inputs
 parser = ArgumentParser(description = "Explore how green space varies between two locations.")
 
@@ -27,40 +47,406 @@ parser.add_argument('-s', '--steps', dest='steps', type=int, default=10,
 # Command-line argument for specifying the output file name
 parser.add_argument('-o', '--out', dest='output', default='output', 
                     help='Enter the name of the output file. The file will be saved as a .png.')
+
+# Command-line arguments for the output formats and for running without a display
+parser.add_argument('--format', dest='formats', nargs='+', choices=['png', 'csv', 'json'], default=['png'],
+                    help='Enter one or more output formats: "png" for the plot, and "csv" or "json" for the green '
+                         'pixel count of every step. Optional, default set to "png".')
+parser.add_argument('--headless', dest='headless', action='store_true',
+                    help='Do not show the plot window. matplotlib is only imported if a .png is written, and then '
+                         'with a non-interactive backend, so no display is needed.')
+
+# Command-line argument for the number of map images fetched concurrently
+parser.add_argument('-w', '--workers', dest='workers', type=int, default=1,
+                    help='Enter the number of map images to fetch concurrently. Optional, default set to 1.')
+
+# Command-line argument for the number of processes decoding and classifying map images
+parser.add_argument('--processes', dest='processes', type=int, default=0,
+                    help='Enter the number of processes that decode and classify map images, to use several cores '
+                         'on large runs. Optional, default set to 0, meaning the fetching threads do this work.')
+
+# Command-line argument for how the steps are placed along the route
+parser.add_argument('--sampling', dest='sampling', choices=SAMPLINGS, default='linear',
+                    help='Enter how the steps are placed: "linear" in latitude and longitude, "geodesic" evenly on '
+                         'the ground along the great circle, or "tile" along the great circle one map image apart, '
+                         'so that neighbouring images overlap by half, with at most the given number of steps. '
+                         'Optional, default set to "linear".')
+
+# Command-line argument for deriving every step from one mosaic of the route
+parser.add_argument('-m', '--mosaic', dest='mosaic', action='store_true',
+                    help='Fetch a fixed grid of map images covering the route once and count each step from it, '
+                         'so that dense routes need far fewer requests.')
+
+# Command-line argument for comparing several greenness thresholds in one run
+parser.add_argument('--thresholds', dest='thresholds', type=float, nargs='+', default=None,
+                    help='Enter several greenness thresholds to plot one line per threshold. Each map image is '
+                         'fetched and classified once for all of them. Optional.')
+
+# Command-line argument for the directory of the persistent tile cache
+parser.add_argument('--cache-dir', dest='cache_dir', default=None,
+                    help='Enter a directory in which downloaded map images are cached between runs. Optional.')
+
+# Command-line arguments for the HTTP session through which map images are fetched
+parser.add_argument('--retries', dest='retries', type=int, default=3,
+                    help='Enter the number of times a failed map request is retried. Optional, default set to 3.')
+parser.add_argument('--rate', dest='rate', type=float, default=None,
+                    help='Enter the maximum number of map requests per second. Optional, default unlimited.')
+parser.add_argument('--timeout', dest='timeout', type=float, default=30.0,
+                    help='Enter the read timeout of each map request in seconds. Optional, default set to 30.')
+parser.add_argument('--max-retry-after', dest='max_retry_after', type=float, default=MAX_RETRY_AFTER,
+                    help='Enter the longest Retry-After delay in seconds to wait for before a map request fails '
+                         f'instead. Optional, default set to {MAX_RETRY_AFTER:g}.')
+
+# Command-line argument for the file of the persistent geocode cache
+parser.add_argument('--geocache', dest='geocache', default=None,
+                    help='Enter a JSON file in which geocoding results are cached between runs. Optional.')
+
+# Command-line argument for a gazetteer used to pre-seed the geocode cache
+parser.add_argument('--gazetteer', dest='gazetteer', default=None,
+                    help='Enter a CSV or JSON gazetteer of known place coordinates. Optional.')
+
+# Command-line argument for a file of routes analysed as one batch
+parser.add_argument('-b', '--batch', dest='batch', default=None,
+                    help='Enter a CSV or JSONL file of routes with "from" and "to" fields. '
+                         'One result row per route is written to the output file, as .jsonl unless it ends in .csv.')
+
+# Command-line argument for sharing one tile between nearby sample points of a batch
+parser.add_argument('--snap', dest='snap', type=float, default=None,
+                    help='Enter a distance in pixels within which sample points of a batch share one map image '
+                         'and green pixel count, so that routes through the same area fetch it once. Optional.')
+
+# Command-line argument for a checkpoint file from which an interrupted run resumes
+parser.add_argument('-c', '--checkpoint', dest='checkpoint', default=None,
+                    help='Enter a file in which results are recorded as they arrive. '
+                         'Running again with the same file resumes an interrupted run. Optional.')
+
+# Command-line argument for a binary store to which every step result is appended
+parser.add_argument('--store', dest='store', default=None,
+                    help='Enter a result store file to which the route, step, coordinates, zoom, threshold and '
+                         'green pixel count of every step are appended. Optional.')
+
+# Command-line argument for approximate green pixel counts
+parser.add_argument('--approximate', dest='approximate', nargs='?', const=0.02, type=float, default=None,
+                    help='Estimate each green pixel count from a sample of the pixels, stopping once the 95%% error '
+                         'bound is within the given fraction of the image. Much less CPU time per map image for '
+                         'screening runs. Optional, "--approximate" alone uses 0.02.')
+
+# Command-line arguments for recording a run to an archive, or replaying one without network I/O
+archive_group = parser.add_mutually_exclusive_group()
+archive_group.add_argument('--record', dest='record', default=None,
+                           help='Enter an archive file to which every map image and geocoding result of the run is '
+                                'appended. Anything already in the archive is served from it. Optional.')
+archive_group.add_argument('--replay', dest='replay', default=None,
+                           help='Enter an archive file recorded with --record, from which every map image and geocoding '
+                                'result is served without network I/O. Anything missing from it is an error. Optional.')
+
+# Command-line argument for reporting where the time of the run went
+parser.add_argument('--profile', dest='profile', nargs='?', const='text', choices=['text', 'json'], default=None,
+                    help='Print the time spent geocoding, fetching, decoding and classifying, with counters for '
+                         'bytes transferred, cache hit rates and retries. Use "--profile json" for JSON output.')
+
+# Command-line argument for updating the plot as each result arrives
+parser.add_argument('-p', '--progressive', dest='progressive', action='store_true',
+                    help='Update the plot as each result arrives instead of once at the end.')
     
+def configure_fetching(arguments):
+    """
+    Set up the HTTP session and the tile and geocode caches requested on the command line.
+
+    Args:
+        arguments: Parsed command-line arguments including workers, retries, rate, timeout,
+            max_retry_after, cache_dir, geocache, gazetteer, approximate, record and replay.
+
+    Returns:
+        GeocodeCache: The geocode cache to use, or None if no geocode cache was requested.
+    """
+    # Count every map approximately when requested
+    Map.approximate = arguments.approximate
+
+    # Record every image to an archive, or replay them from one without network I/O
+    Map.archive = None
+    if arguments.record or arguments.replay:
+        Map.archive = Archive(arguments.record or arguments.replay, record = bool(arguments.record))
+
+    # Share one pooled session, large enough for every worker, between all maps
+    Map.session = MapSession(pool_size = max(16, arguments.workers), retries = arguments.retries,
+                             rate = arguments.rate, timeout = (5.0, arguments.timeout),
+                             max_retry_after = arguments.max_retry_after)
+
+    # Share a persistent tile cache between every map fetched by this run
+    if arguments.cache_dir:
+        Map.cache = TileCache(arguments.cache_dir)
+
+    # Geocode through a cache when one is requested, seeding it from the gazetteer
+    geocache = None
+    if arguments.geocache or arguments.gazetteer:
+        geocache = GeocodeCache(arguments.geocache)
+        if arguments.gazetteer:
+            geocache.seed(arguments.gazetteer)
+    return geocache
+
+def pyplot(show: bool = True):
+    """
+    Import matplotlib's pyplot on first use.
+
+    Without a plot window, the non-interactive Agg backend is used, so that no display is needed.
+
+    Args:
+        show (bool): Whether a plot window will be shown. Default is True.
+
+    Returns:
+        The matplotlib.pyplot module.
+    """
+    global plt
+    if plt is None:
+        import matplotlib
+        if not show:
+            matplotlib.use('Agg')
+        from matplotlib import pyplot as plt
+    return plt
+
+def archive_geocoder():
+    """
+    Return the geocoder for the archive assigned to Map.archive, if any.
+
+    Returns:
+        ArchiveGeocoder: A geocoder serving places from the archive, and recording the places looked up
+            by the default geocoder when the archive is recording. None if there is no archive.
+    """
+    if Map.archive is None:
+        return None
+    return Map.archive.geocoder(default_geocoder() if Map.archive.recording else None)
+
 def green_plotter(arguments):
     """
-    Generates a plot showing the green space between two locations.
+    Generates a plot showing the green space between two locations, and writes the
+    green pixel counts in each requested output format.
     
     Args:
         arguments: Parsed command-line arguments including:
             - first_location: The starting location.
             - second_location: The ending location.
             - steps: The number of steps between the two locations.
-            - output: The output file name for the .png plot.
+            - output: The output file name, without extension.
+            - formats: The output formats among 'png', 'csv' and 'json'.
+            - headless: Whether to run without showing the plot window.
+            - workers: The number of map images fetched concurrently.
+            - processes: The number of processes decoding and classifying map images.
+            - sampling: How the steps are placed along the route.
+            - mosaic: Whether to count every step from one mosaic of the route.
+            - thresholds: Optional greenness thresholds, each plotted as its own line.
+            - cache_dir: An optional directory for the persistent tile cache.
+            - geocache: An optional file for the persistent geocode cache.
+            - gazetteer: An optional gazetteer used to pre-seed the geocode cache.
+            - checkpoint: An optional checkpoint file from which an interrupted run resumes.
+            - progressive: Whether to update the plot as each result arrives.
+            - store: An optional result store to which every step result is appended.
     """
+    geocache = configure_fetching(arguments)
+
     # Create an instance of the Greengraph class
-    graph = Greengraph(arguments.first_location, arguments.second_location)# create an instance of the Greengraph class object.
-    
-    # Get the green pixel count between locations
-    green_count = graph.green_between(arguments.steps)
-    
-    # Plot green pixel counts between locations
-    plt.plot(green_count)
-    plt.title(f'Number of green pixels between {arguments.first_location} and {arguments.second_location}')
-    plt.xlabel('Steps')
-    plt.ylabel('Green pixels')
+    graph = Greengraph(arguments.first_location, arguments.second_location, geocoder = archive_geocoder(),
+                       geocache = geocache)# create an instance of the Greengraph class object.
+
+    # The counts are plotted and written against the location of each step and its distance along the route,
+    # as tile sampling can place fewer steps than requested
+    locations = graph.sample_locations(arguments.steps, arguments.sampling)
+    distances = geo.route_distances(locations) / 1000
     
-    # Save plot to a .png file
-    plt.savefig(f'{arguments.output}.png')
-    plt.show()
+    # Only the streaming branch can have plotted the counts already, as they arrived
+    plotted = False
+    if arguments.mosaic:
+        # Count every step from one mosaic of the grid images covering the route
+        green_count = graph.green_between_mosaic(arguments.steps, workers = arguments.workers,
+                                                 sampling = arguments.sampling)
+    elif arguments.thresholds:
+        # Count every threshold from a single fetch and pass over each map image
+        green_count = graph.green_sweep(arguments.steps, arguments.thresholds, workers = arguments.workers,
+                                        sampling = arguments.sampling)
+    elif arguments.checkpoint or arguments.progressive or arguments.store:
+        # Collect, and optionally plot, the green pixel counts as they arrive
+        green_count = stream_plotter(graph, arguments, distances)
+        plotted = arguments.progressive
+    else:
+        # Get the green pixel count between locations
+        green_count = graph.green_between(arguments.steps, workers = arguments.workers, sampling = arguments.sampling,
+                                          processes = arguments.processes)
+
+    # Plot green pixel counts between locations, unless only numeric output is wanted
+    if 'png' in arguments.formats or not arguments.headless:
+        plt = pyplot(show = not arguments.headless)
+        if arguments.thresholds:
+            for column, threshold in enumerate(arguments.thresholds):
+                plt.plot(distances, green_count[:, column], label = f'Threshold {threshold:g}')
+            plt.legend()
+        elif not plotted:
+            plt.plot(distances, green_count)
+
+        plt.title(f'Number of green pixels between {arguments.first_location} and {arguments.second_location}')
+        plt.xlabel('Distance from start (km)')
+        plt.ylabel('Green pixels')
+
+        # Save plot to a .png file
+        if 'png' in arguments.formats:
+            plt.savefig(f'{arguments.output}.png')
+        if not arguments.headless:
+            plt.show()
+
+    write_counts(arguments, green_count, locations, distances)
+
+def write_counts(arguments, green_count, locations, distances) -> None:
+    """
+    Writes the location and green pixel count of every step to a .csv and/or .json file, if requested.
+
+    Args:
+        arguments: Parsed command-line arguments including first_location, second_location,
+            steps, sampling, thresholds, output and formats.
+        green_count: The count at each step or, with thresholds, an array with a column per threshold.
+            Steps without a count are NaN.
+        locations: The (latitude, longitude) of each step.
+        distances: The distance of each step from the start of the route in kilometres.
+    """
+    thresholds = arguments.thresholds or []
+    rows = [[_count(value) for value in (counts if thresholds else [counts])] for counts in green_count]
+    places = [[float(lat), float(long), round(float(distance), 3)]
+              for (lat, long), distance in zip(locations, distances)]
+
+    if 'csv' in arguments.formats:
+        with open(f'{arguments.output}.csv', 'w', newline = '') as destination:
+            writer = csv.writer(destination)
+            writer.writerow(['step', 'latitude', 'longitude', 'distance_km'] +
+                            ([f'green_{threshold:g}' for threshold in thresholds] or ['green']))
+            for step, (place, row) in enumerate(zip(places, rows)):
+                writer.writerow([step] + place + ['' if value is None else value for value in row])
+
+    if 'json' in arguments.formats:
+        # Tile sampling can place fewer steps than requested, so the steps sampled are given as well
+        document = {'from': arguments.first_location, 'to': arguments.second_location,
+                    'steps': arguments.steps, 'sampled': len(places), 'sampling': arguments.sampling,
+                    'locations': [place[:2] for place in places], 'distance_km': [place[2] for place in places]}
+        if thresholds:
+            document.update(thresholds = thresholds, green = rows)
+        else:
+            document.update(green = [row[0] for row in rows])
+        with open(f'{arguments.output}.json', 'w') as destination:
+            json.dump(document, destination, indent = 2)
+
+def _count(value):
+    # Counts are written as plain integers, and steps without a count as empty values
+    value = float(value)
+    return None if math.isnan(value) else int(value)
+
+def stream_plotter(graph, arguments, distances) -> list:
+    """
+    Collects the green pixel counts of a route as they arrive, recording them in the
+    checkpoint file and the result store if they are given, and plotting each one
+    as it arrives when the plot is progressive.
+
+    Args:
+        graph (Greengraph): The route being analysed.
+        arguments: Parsed command-line arguments including steps, workers, processes, sampling,
+            checkpoint, store, headless and progressive.
+        distances: The distance of each step from the start of the route, against which counts are plotted.
+
+    Returns:
+        list: The green pixel count at each step.
+    """
+    # Steps that have not arrived yet are left as gaps in the plot
+    green_count = [float('nan')] * len(distances)
+    if arguments.progressive:
+        plt = pyplot(show = not arguments.headless)
+        line, = plt.plot(distances, green_count)
+        plt.ion()
+
+    store = route = None
+    if arguments.store:
+        store = ResultStore(arguments.store)
+        route = store.add_route(route_key(graph.start, graph.end, arguments.steps, arguments.sampling),
+                                start = graph.start, end = graph.end, steps = arguments.steps,
+                                sampling = arguments.sampling)
+
+    for index, lat, long, count in graph.iter_green_between(arguments.steps, workers = arguments.workers,
+                                                             checkpoint = arguments.checkpoint,
+                                                             sampling = arguments.sampling,
+                                                             processes = arguments.processes):
+        green_count[index] = count
+        if store is not None:
+            store.append(route, [(index, lat, long, count)])
+        if arguments.progressive:
+            line.set_ydata(green_count)
+            plt.gca().relim()
+            plt.gca().autoscale_view()
+            plt.pause(0.001)
+
+    if arguments.progressive:
+        plt.ioff()
+        line.set_ydata(green_count)
+    return green_count
+
+def batch_processor(arguments):
+    """
+    Analyses every route in a batch file and streams the results to the output file.
+
+    Args:
+        arguments: Parsed command-line arguments including:
+            - batch: The CSV or JSONL file of routes.
+            - steps: The number of steps for routes that do not give their own.
+            - output: The result file name. A .jsonl extension is added if none is given.
+            - workers: The number of map images fetched concurrently.
+            - processes: The number of processes decoding and classifying map images.
+            - sampling: How the steps of each route are placed.
+            - store: An optional result store to which every step result is appended.
+            - snap: An optional distance in pixels within which sample points share one tile.
+    """
+    geocache = configure_fetching(arguments)
+
+    output = arguments.output
+    if not os.path.splitext(output)[1]:
+        output += '.jsonl'
+
+    routes = batch.read_routes(arguments.batch, arguments.steps)
+    batch.run_batch(routes, output, geocoder = archive_geocoder(), geocache = geocache, workers = arguments.workers,
+                    sampling = arguments.sampling, processes = arguments.processes,
+                    store = ResultStore(arguments.store) if arguments.store else None,
+                    tile_index = TileIndex(tolerance = arguments.snap) if arguments.snap else None)
+
+def report_profile(profiler, style: str = 'text') -> None:
+    """
+    Prints the per-stage breakdown collected during the run.
+
+    Args:
+        profiler (Profiler): The profiler that was active during the run.
+        style (str): 'text' for a table on standard error, or 'json' for JSON on standard output.
+    """
+    if style == 'json':
+        json.dump(profiler.report(), sys.stdout, indent = 2)
+        print()
+    else:
+        print(profiler.format(), file = sys.stderr)
 
 def process() -> None:
     """
-    Parses the command-line arguments and invokes the green_plotter function.
+    Parses the command-line arguments and invokes the batch_processor function for a
+    batch of routes, or the green_plotter function otherwise.
     """
     arguments = parser.parse_args()
-    green_plotter(arguments)
+    if arguments.progressive and (arguments.mosaic or arguments.thresholds):
+        parser.error('--progressive cannot be used with --mosaic or --thresholds, which plot once at the end')
+
+    # Instrumentation is only enabled when a profile is requested
+    profiler = profiling.enable() if arguments.profile else None
+    try:
+        if arguments.batch:
+            batch_processor(arguments)
+        else:
+            green_plotter(arguments)
+    finally:
+        if Map.archive is not None:
+            Map.archive.close()
+            Map.archive = None
+        if profiler:
+            profiling.disable()
+            report_profile(profiler, arguments.profile)
     
 if __name__ == "__main__":
     process()
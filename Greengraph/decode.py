@@ -0,0 +1,174 @@
+"""
+This module decodes and encodes the images handled by the Map class without matplotlib.
+
+Images are decoded to uint8 RGB arrays, a quarter of the memory of the float32 RGBA
+arrays returned by matplotlib.image.imread, which the classification kernels in
+classify.py work on directly.
+
+Decoding uses Pillow when it is installed, which handles every format the Google Maps
+API returns. Otherwise a built-in decoder handles non-interlaced 8-bit PNG images,
+which covers the API's default png8 and png32 formats. Encoding always uses a small
+built-in PNG writer.
+"""
+
+import zlib
+import struct
+import numpy as np
+from io import BytesIO
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional
+    Image = None
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Number of samples per pixel for each PNG colour type
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+def decode_image(data: bytes) -> np.ndarray:
+    """
+    Decode an image to a uint8 RGB array.
+
+    Args:
+        data (bytes): The encoded image.
+
+    Returns:
+        np.ndarray: An array of shape (height, width, 3) and dtype uint8.
+
+    Raises:
+        ValueError: If the data is not an image that can be decoded.
+    """
+    if Image is not None:
+        try:
+            with Image.open(BytesIO(data)) as image:
+                return np.asarray(image.convert("RGB"))
+        except Exception as error:
+            raise ValueError(f"Invalid image data: {error}") from error
+    return decode_png(data)
+
+def decode_png(data: bytes) -> np.ndarray:
+    """
+    Decode a non-interlaced 8-bit PNG image to a uint8 RGB array using only zlib and numpy.
+
+    Args:
+        data (bytes): The encoded PNG image.
+
+    Returns:
+        np.ndarray: An array of shape (height, width, 3) and dtype uint8.
+
+    Raises:
+        ValueError: If the data is not a PNG image or uses an unsupported format.
+    """
+    if not data or data[:8] != PNG_SIGNATURE:
+        raise ValueError("Invalid image data: not a PNG image")
+
+    header, palette, compressed = None, None, []
+    position = 8
+    while position + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        position += length + 12
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif kind == b"PLTE":
+            palette = np.frombuffer(chunk, dtype = np.uint8).reshape(-1, 3)
+        elif kind == b"IDAT":
+            compressed.append(chunk)
+        elif kind == b"IEND":
+            break
+
+    if header is None:
+        raise ValueError("Invalid image data: missing PNG header")
+    width, height, depth, colour, _, _, interlace = header
+    if depth != 8 or interlace or colour not in PNG_CHANNELS:
+        raise ValueError("Unsupported PNG format: only non-interlaced 8-bit images are decoded")
+
+    channels = PNG_CHANNELS[colour]
+    try:
+        raw = zlib.decompress(b"".join(compressed))
+    except zlib.error as error:
+        raise ValueError(f"Invalid image data: {error}") from error
+    if len(raw) != height * (width * channels + 1):
+        raise ValueError("Invalid image data: truncated PNG image")
+
+    samples = _unfilter(np.frombuffer(raw, dtype = np.uint8).reshape(height, -1), channels)
+    samples = samples.reshape(height, width, channels)
+
+    if colour == 3:
+        if palette is None:
+            raise ValueError("Invalid image data: missing PNG palette")
+        return palette[samples[:, :, 0]]
+    if colour in (0, 4):
+        return np.repeat(samples[:, :, :1], 3, axis = 2)
+    return np.ascontiguousarray(samples[:, :, :3])
+
+def encode_png(pixels: np.ndarray) -> bytes:
+    """
+    Encode a uint8 RGB array as a PNG image.
+
+    Args:
+        pixels (np.ndarray): An array of shape (height, width, 3) and dtype uint8.
+
+    Returns:
+        bytes: The encoded PNG image.
+    """
+    height, width = pixels.shape[:2]
+    # Prefix every row with filter type 0 (none)
+    rows = np.zeros((height, width * 3 + 1), dtype = np.uint8)
+    rows[:, 1:] = np.asarray(pixels, dtype = np.uint8).reshape(height, width * 3)
+
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+    return (PNG_SIGNATURE
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows.tobytes()))
+            + chunk(b"IEND", b""))
+
+def _unfilter(rows: np.ndarray, channels: int) -> np.ndarray:
+    """
+    Reverse the per-row PNG filters. Sub and Up rows are vectorized; Average and Paeth
+    rows depend on the previous pixel and are reconstructed byte by byte.
+    """
+    height, stride = rows.shape[0], rows.shape[1] - 1
+    output = np.empty((height, stride), dtype = np.uint8)
+    previous = np.zeros(stride, dtype = np.uint8)
+
+    for y in range(height):
+        kind, line = rows[y, 0], rows[y, 1:]
+        if kind == 0:
+            current = line
+        elif kind == 1:
+            current = np.cumsum(line.reshape(-1, channels), axis = 0, dtype = np.uint8).reshape(-1)
+        elif kind == 2:
+            current = line + previous
+        elif kind in (3, 4):
+            current = np.frombuffer(_unfilter_sequential(kind, line.tobytes(), previous.tobytes(), channels),
+                                    dtype = np.uint8)
+        else:
+            raise ValueError(f"Invalid image data: unknown PNG filter {kind}")
+        output[y] = current
+        previous = output[y]
+
+    return output
+
+def _unfilter_sequential(kind: int, line: bytes, previous: bytes, channels: int) -> bytearray:
+    current = bytearray(line)
+    for i in range(len(current)):
+        left = current[i - channels] if i >= channels else 0
+        up = previous[i]
+        if kind == 3:
+            current[i] = (current[i] + ((left + up) >> 1)) & 0xFF
+        else:
+            upper_left = previous[i - channels] if i >= channels else 0
+            estimate = left + up - upper_left
+            distance_left, distance_up, distance_upper_left = abs(estimate - left), abs(estimate - up), abs(estimate - upper_left)
+            if distance_left <= distance_up and distance_left <= distance_upper_left:
+                predictor = left
+            elif distance_up <= distance_upper_left:
+                predictor = up
+            else:
+                predictor = upper_left
+            current[i] = (current[i] + predictor) & 0xFF
+    return current
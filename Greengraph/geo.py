@@ -0,0 +1,212 @@
+"""
+This module contains the geographic calculations used to sample routes and place tiles.
+
+It provides:
+- Great-circle distances and interpolation, so that samples follow the geodesic and are
+  evenly spaced on the ground rather than in latitude and longitude.
+- Web Mercator projection to the global pixel coordinates used by the static map API,
+  from which the ground footprint of an image and the overlap of two images follow.
+- Route samplers that space samples evenly on the ground or by image footprint, so that
+  the imagery of neighbouring samples overlaps by no more than a given fraction.
+- The ground distance along a route of samples, against which counts are plotted.
+"""
+
+import math
+import numpy as np
+from typing import Tuple
+
+# Mean radius of the Earth in metres
+EARTH_RADIUS = 6371008.8
+
+# Width in pixels of the whole world at zoom level 0 in Web Mercator
+WORLD_SIZE = 256
+
+# Ground resolution in metres per pixel at the equator at zoom level 0
+EQUATOR_RESOLUTION = 2 * math.pi * 6378137 / WORLD_SIZE
+
+def _unit_vectors(points: np.ndarray) -> np.ndarray:
+    lats, longs = np.radians(points[:, 0]), np.radians(points[:, 1])
+    return np.stack([np.cos(lats) * np.cos(longs), np.cos(lats) * np.sin(longs), np.sin(lats)], axis = 1)
+
+def haversine(start: tuple, end: tuple) -> float:
+    """
+    Return the great-circle distance between two points.
+
+    Args:
+        start (tuple): The first point (latitude, longitude) in degrees.
+        end (tuple): The second point (latitude, longitude) in degrees.
+
+    Returns:
+        float: The distance in metres.
+    """
+    lat1, long1, lat2, long2 = map(math.radians, (start[0], start[1], end[0], end[1]))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+def great_circle(start: tuple, end: tuple, fractions) -> np.ndarray:
+    """
+    Interpolate points along the great circle between two points.
+
+    Args:
+        start (tuple): The first point (latitude, longitude) in degrees.
+        end (tuple): The second point (latitude, longitude) in degrees.
+        fractions: The fractions of the distance from start to end at which to place points.
+
+    Returns:
+        np.ndarray: An array of (latitude, longitude) pairs, one per fraction.
+    """
+    fractions = np.asarray(fractions, dtype = np.float64)
+    a, b = _unit_vectors(np.array([start, end], dtype = np.float64))
+    angle = math.acos(min(1.0, max(-1.0, float(np.dot(a, b)))))
+
+    if angle < 1e-12:
+        # Coincident points; fall back to linear interpolation
+        return np.outer(1 - fractions, start) + np.outer(fractions, end)
+
+    vectors = (np.outer(np.sin((1 - fractions) * angle), a) + np.outer(np.sin(fractions * angle), b)) / math.sin(angle)
+    lats = np.degrees(np.arctan2(vectors[:, 2], np.hypot(vectors[:, 0], vectors[:, 1])))
+    longs = np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0]))
+    return np.vstack([lats, longs]).transpose()
+
+def geodesic_sequence(start: tuple, end: tuple, steps: int) -> np.ndarray:
+    """
+    Generate points evenly spaced on the ground along the great circle between two points.
+
+    Args:
+        start (tuple): The starting coordinates (latitude, longitude).
+        end (tuple): The ending coordinates (latitude, longitude).
+        steps (int): The number of points, including both ends.
+
+    Returns:
+        np.ndarray: An array of (latitude, longitude) pairs.
+    """
+    return great_circle(start, end, np.linspace(0, 1, steps))
+
+def route_distances(points) -> np.ndarray:
+    """
+    Return the ground distance from the first point of a route to each of its points.
+
+    Args:
+        points: An array of (latitude, longitude) pairs in route order.
+
+    Returns:
+        np.ndarray: The cumulative great-circle distance to each point in metres, starting at 0.
+    """
+    points = np.asarray(points, dtype = np.float64).reshape(-1, 2)
+    steps = [haversine(first, second) for first, second in zip(points, points[1:])]
+    return np.concatenate([np.zeros(min(1, len(points))), np.cumsum(steps)])
+
+def meters_per_pixel(lat: float, zoom: int) -> float:
+    """
+    Return the ground resolution of a Web Mercator image.
+
+    Args:
+        lat (float): The latitude in degrees.
+        zoom (int): The zoom level.
+
+    Returns:
+        float: The number of metres covered by one pixel.
+    """
+    return EQUATOR_RESOLUTION * math.cos(math.radians(lat)) / 2 ** zoom
+
+def footprint(lat: float, zoom: int = 10, size: Tuple[int, int] = (400, 400)) -> Tuple[float, float]:
+    """
+    Return the ground area covered by a map image.
+
+    Args:
+        lat (float): The latitude of the image centre in degrees.
+        zoom (int): The zoom level. Default is 10, as for Map.
+        size (Tuple[int, int]): The (width, height) of the image in pixels. Default is (400, 400).
+
+    Returns:
+        Tuple[float, float]: The width and height of the covered area in metres.
+    """
+    resolution = meters_per_pixel(lat, zoom)
+    return size[0] * resolution, size[1] * resolution
+
+def to_pixels(lat, long, zoom: int):
+    """
+    Project coordinates to global Web Mercator pixel coordinates.
+
+    Args:
+        lat: Latitude in degrees, a number or an array.
+        long: Longitude in degrees, a number or an array.
+        zoom (int): The zoom level.
+
+    Returns:
+        tuple: The x and y pixel coordinates, with y increasing southwards.
+    """
+    scale = WORLD_SIZE * 2 ** zoom
+    sin_lat = np.clip(np.sin(np.radians(lat)), -0.9999, 0.9999)
+    x = (np.asarray(long) + 180.0) / 360.0 * scale
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+    return x, y
+
+def from_pixels(x, y, zoom: int):
+    """
+    Convert global Web Mercator pixel coordinates back to coordinates.
+
+    Args:
+        x: The x pixel coordinate, a number or an array.
+        y: The y pixel coordinate, a number or an array.
+        zoom (int): The zoom level.
+
+    Returns:
+        tuple: The latitude and longitude in degrees.
+    """
+    scale = WORLD_SIZE * 2 ** zoom
+    long = np.asarray(x) / scale * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * np.asarray(y) / scale))))
+    return lat, long
+
+def overlap(first: tuple, second: tuple, zoom: int = 10, size: Tuple[int, int] = (400, 400)) -> float:
+    """
+    Return the fraction of a map image's area also covered by another image of the same size.
+
+    Args:
+        first (tuple): The centre (latitude, longitude) of the first image.
+        second (tuple): The centre (latitude, longitude) of the second image.
+        zoom (int): The zoom level of both images. Default is 10.
+        size (Tuple[int, int]): The (width, height) of both images in pixels. Default is (400, 400).
+
+    Returns:
+        float: The overlapping fraction, between 0 and 1.
+    """
+    x1, y1 = to_pixels(first[0], first[1], zoom)
+    x2, y2 = to_pixels(second[0], second[1], zoom)
+    width = max(0.0, size[0] - abs(float(x1 - x2)))
+    height = max(0.0, size[1] - abs(float(y1 - y2)))
+    return width * height / (size[0] * size[1])
+
+def tile_sequence(start: tuple, end: tuple, zoom: int = 10, size: Tuple[int, int] = (400, 400), max_overlap: float = 0.0) -> np.ndarray:
+    """
+    Generate points along the great circle between two points, spaced by the ground
+    footprint of a map image, so that consecutive images just meet.
+
+    The spacing follows the latitude, as the footprint of an image shrinks away from the equator.
+
+    Args:
+        start (tuple): The starting coordinates (latitude, longitude).
+        end (tuple): The ending coordinates (latitude, longitude).
+        zoom (int): The zoom level of the images. Default is 10.
+        size (Tuple[int, int]): The (width, height) of the images in pixels. Default is (400, 400).
+        max_overlap (float): The fraction by which consecutive images overlap along the route. Default is 0.
+
+    Returns:
+        np.ndarray: An array of (latitude, longitude) pairs, including both ends.
+    """
+    total = haversine(start, end)
+    if total == 0:
+        return np.array([start, end], dtype = np.float64)
+
+    distances = [0.0]
+    lat = start[0]
+    while True:
+        spacing = min(footprint(lat, zoom, size)) * (1 - max_overlap)
+        if distances[-1] + spacing >= total:
+            break
+        distances.append(distances[-1] + spacing)
+        lat = great_circle(start, end, [distances[-1] / total])[0, 0]
+    distances.append(total)
+
+    return great_circle(start, end, np.array(distances) / total)
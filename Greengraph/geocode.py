@@ -0,0 +1,313 @@
+"""
+This module defines the GeocodeCache class, a persistent memoization layer for the
+geocoding performed by Greengraph.geolocate.
+
+Place names are normalized before lookup, so that differently spaced or capitalized
+spellings of the same place share one entry. Places the geocoder could not find are
+remembered as well, but expire after a shorter time-to-live than found places.
+
+The cache is stored as a JSON file and can be pre-seeded from a CSV or JSON gazetteer,
+so that batch runs over known places make no geocoder calls at all. New entries are
+kept in memory until the cache is saved, which Greengraph.geolocate_many does once per
+batch of places, and which happens at the latest when the interpreter exits.
+
+The module also defines the BulkGeocoder class, a front end to a geocoder that looks
+up many place names concurrently within a rate limit, and collapses lookups of a place
+that is already being looked up into the one request in flight.
+"""
+
+import os
+import csv
+import json
+import time
+import atexit
+import weakref
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from Greengraph import profiling
+from Greengraph.session import TokenBucket
+from typing import Iterable, Optional
+
+# Column names accepted for each field of a gazetteer
+NAME_FIELDS = ('name', 'place', 'location')
+LAT_FIELDS = ('lat', 'latitude')
+LONG_FIELDS = ('long', 'lng', 'lon', 'longitude')
+
+class GeocodeCache(object):
+    """
+    A persistent cache of geocoding results keyed on normalized place names.
+
+    Entries are dictionary-like: indexing with a place name returns its coordinates,
+    or None for a place the geocoder could not find, and raises KeyError when the
+    place is not cached or its entry has expired. Stored entries are written to the
+    file by save, or by close, which also happens when the interpreter exits.
+
+    Attributes:
+        path (str): The JSON file in which the cache is stored. None keeps the cache in memory.
+        ttl (float): Optional number of seconds after which found places expire.
+        negative_ttl (float): Number of seconds after which places that were not found expire.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None, negative_ttl: float = 24 * 3600):
+        """
+        Initialize a GeocodeCache object, loading any entries already stored at the path.
+
+        Args:
+            path (str): The JSON file in which the cache is stored. Default is None, meaning in memory only.
+            ttl (float): Optional number of seconds after which found places expire. Default is None.
+            negative_ttl (float): Number of seconds after which places that were not found expire. Default is one day.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self._dirty = set()
+        if path is not None:
+            atexit.register(_save_at_exit, weakref.ref(self))
+
+    @staticmethod
+    def normalize(place: str) -> str:
+        """
+        Return the normalized form of a place name.
+
+        Args:
+            place (str): The place name.
+
+        Returns:
+            str: The name with surrounding and repeated whitespace removed, case-folded.
+        """
+        return " ".join(str(place).split()).casefold()
+
+    def __getitem__(self, place: str) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(self.normalize(place))
+        if entry is None or self._expired(entry):
+            raise KeyError(place)
+        coordinates = entry['coordinates']
+        return tuple(coordinates) if coordinates is not None else None
+
+    def __setitem__(self, place: str, coordinates: Optional[tuple]) -> None:
+        self.store({place: coordinates})
+
+    def __contains__(self, place: str) -> bool:
+        try:
+            self[place]
+        except KeyError:
+            return False
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def dirty(self) -> bool:
+        """
+        bool: Whether entries have been stored since the cache was last saved.
+        """
+        return bool(self._dirty)
+
+    def store(self, places: dict, permanent: bool = False) -> None:
+        """
+        Store the coordinates of several places. They are written to the file by the next save.
+
+        Args:
+            places (dict): A mapping from place names to (latitude, longitude) pairs, or None if not found.
+            permanent (bool): Whether the entries never expire, as for a gazetteer. Default is False.
+        """
+        stored = None if permanent else time.time()
+        with self._lock:
+            for place, coordinates in places.items():
+                name = self.normalize(place)
+                self._entries[name] = dict(
+                    coordinates = list(coordinates) if coordinates is not None else None,
+                    stored = stored)
+                self._dirty.add(name)
+
+    def seed(self, gazetteer: str) -> int:
+        """
+        Pre-seed the cache with permanent entries from a CSV or JSON gazetteer.
+
+        A CSV gazetteer needs a header row naming the place, latitude and longitude columns.
+        A JSON gazetteer is either an object mapping names to [latitude, longitude] pairs,
+        or a list of objects with name, latitude and longitude fields.
+
+        Args:
+            gazetteer (str): The path of the gazetteer file.
+
+        Returns:
+            int: The number of places added to the cache.
+        """
+        with open(gazetteer, newline = '') as source:
+            if gazetteer.lower().endswith('.csv'):
+                records = list(csv.DictReader(source))
+            else:
+                records = json.load(source)
+
+        if isinstance(records, dict):
+            places = {name: tuple(map(float, coordinates)) for name, coordinates in records.items()}
+        else:
+            places = {}
+            for record in records:
+                record = {str(field).strip().lower(): value for field, value in record.items()}
+                name = _field(record, NAME_FIELDS)
+                places[name] = (float(_field(record, LAT_FIELDS)), float(_field(record, LONG_FIELDS)))
+
+        self.store(places, permanent = True)
+        self.save()
+        return len(places)
+
+    def save(self) -> None:
+        """
+        Write the entries stored since the last save to the file, merging in entries
+        saved by other processes in the meantime. Nothing is written if no entry was stored.
+        """
+        if self.path is None:
+            return
+
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = self._load()
+            for name in self._dirty:
+                entry = self._entries[name]
+                if name not in entries or _newer(entry, entries[name]):
+                    entries[name] = entry
+            self._entries = entries
+            self._dirty = set()
+
+            # Write to a temporary file first so that readers never see a partial cache
+            directory = os.path.dirname(os.path.abspath(self.path))
+            handle, temporary = tempfile.mkstemp(dir = directory, suffix = ".tmp")
+            with os.fdopen(handle, "w") as cache:
+                json.dump(entries, cache)
+            os.replace(temporary, self.path)
+
+    def close(self) -> None:
+        """
+        Save any entries stored since the last save.
+        """
+        self.save()
+
+    def _load(self) -> dict:
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        with open(self.path) as cache:
+            return json.load(cache)
+
+    def _expired(self, entry: dict) -> bool:
+        if entry['stored'] is None:
+            return False
+        ttl = self.ttl if entry['coordinates'] is not None else self.negative_ttl
+        return ttl is not None and time.time() - entry['stored'] > ttl
+
+class BulkGeocoder(object):
+    """
+    A geocoder front end that looks up many place names at once.
+
+    Lookups run concurrently within an optional rate limit. A lookup of a place whose
+    normalized name is already being looked up, by any thread, waits for that request
+    instead of issuing its own. A BulkGeocoder has the geocode method of the geocoder
+    it wraps, so it can be passed to Greengraph in place of that geocoder.
+
+    Attributes:
+        geocoder (object): The wrapped geocoder, such as a geopy geocoder.
+        workers (int): The maximum number of lookups run at once by geocode_many.
+        limiter (TokenBucket): The rate limiter, or None if lookups are not rate limited.
+    """
+
+    def __init__(self, geocoder, workers: int = 4, rate: Optional[float] = None, burst: Optional[float] = None):
+        """
+        Initialize a BulkGeocoder object.
+
+        Args:
+            geocoder (object): The geocoder to wrap, with a geocode(place, exactly_one) method.
+            workers (int): The maximum number of lookups run at once by geocode_many. Default is 4.
+            rate (float): Optional maximum number of lookups per second. Default is None, meaning unlimited.
+            burst (float): The number of lookups allowed in a burst when rate limited. Defaults to the rate.
+        """
+        self.geocoder = geocoder
+        self.workers = workers
+        self.limiter = TokenBucket(rate, burst) if rate else None
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def geocode(self, place: str, exactly_one: bool = True):
+        """
+        Look up a place through the wrapped geocoder, sharing any lookup already in flight.
+
+        Args:
+            place (str): The place name.
+            exactly_one (bool): Whether to return only the best match. Default is True.
+
+        Returns:
+            The result of the wrapped geocoder.
+        """
+        key = (GeocodeCache.normalize(place), exactly_one)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+
+        if not leader:
+            profiling.count('geocode.coalesced')
+            return future.result()
+
+        try:
+            if self.limiter is not None:
+                profiling.count('geocode.rate_limit_wait', self.limiter.acquire())
+            result = self.geocoder.geocode(place, exactly_one = exactly_one)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def geocode_many(self, places: Iterable[str], exactly_one: bool = True) -> dict:
+        """
+        Look up many places concurrently, once per normalized name.
+
+        Args:
+            places (Iterable[str]): The place names. Repeated names are looked up once.
+            exactly_one (bool): Whether to return only the best match of each place. Default is True.
+
+        Returns:
+            dict: A mapping from each given place name to the result of the wrapped geocoder.
+        """
+        names = {}
+        places = list(places)
+        for place in places:
+            names.setdefault(GeocodeCache.normalize(place), place)
+
+        with ThreadPoolExecutor(max_workers = max(1, min(self.workers, len(names)))) as executor:
+            results = dict(zip(names, executor.map(lambda place: self.geocode(place, exactly_one), names.values())))
+        return {place: results[GeocodeCache.normalize(place)] for place in places}
+
+def _save_at_exit(reference: weakref.ref) -> None:
+    # Caches that are still alive when the interpreter exits save their unsaved entries
+    cache = reference()
+    if cache is not None:
+        cache.save()
+
+def _field(record: dict, names: tuple):
+    for name in names:
+        if name in record:
+            return record[name]
+    raise KeyError(f'Gazetteer record has none of the fields {names}')
+
+def _newer(entry: dict, other: dict) -> bool:
+    # Permanent entries, stored without a time, take precedence over any other entry
+    if entry['stored'] is None or other['stored'] is None:
+        return entry['stored'] is None
+    return entry['stored'] >= other['stored']
@@ -3,10 +3,29 @@ This module contains the Greengraph class, which includes methods for geolocatio
 generating location sequences, and analyzing green space between two specified locations.
 """
 
+import os
+import json
+import heapq
+import tempfile
+import itertools
 import numpy as np
-import geopy
-from Greengraph.map import Map
-from typing import Optional
+from Greengraph.map import Map, prefetch
+from Greengraph.mosaic import Mosaic
+from Greengraph.classify import RATIO_EDGES, count_green_batch
+from Greengraph.geocode import GeocodeCache
+from Greengraph.session import FetchError
+from Greengraph import geo, parallel, profiling
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterable, Iterator, Optional
+
+# The ways of placing samples along a route accepted by Greengraph.location_sequence
+SAMPLINGS = ('linear', 'geodesic', 'tile')
+
+# The largest fraction of a map image that may overlap its neighbour under tile sampling
+MAX_OVERLAP = 0.5
+
+# The number of locations each worker may have in flight before fetching waits for results to be read
+IN_FLIGHT_PER_WORKER = 2
 
 class Greengraph(object):
     """
@@ -16,9 +35,12 @@ class Greengraph(object):
         start (str): The starting location for the analysis.
         end (str): The ending location for the analysis.
         geocoder (object): Optional geocoder instance. Defaults to GoogleV3 geocoder if not provided.
+        geocache (GeocodeCache): Optional cache of geocoding results shared between runs.
+        tiles (dict): The maps retained by the green_sweep, ratio_histograms and show_green
+            methods, keyed by their (latitude, longitude), so that they are fetched only once.
     """
     
-    def __init__(self, start: str, end: str, geocoder=None):
+    def __init__(self, start: str, end: str, geocoder=None, geocache=None):
         """
         Instantiate a Greengraph object with the specified start and end locations.
         
@@ -26,57 +48,574 @@ class Greengraph(object):
             start (str): The starting location for the analysis.
             end (str): The ending location for the analysis.
             geocoder (object): An optional geocoder instance for geolocation. Defaults to GoogleV3 geocoder.
+            geocache (GeocodeCache): An optional cache of geocoding results. Defaults to None, meaning no caching.
         """
         self.start = start
         self.end = end
-        self.geocoder = geocoder or geopy.geocoders.GoogleV3(domain = "maps.google.co.uk")
+        self.geocoder = geocoder if geocoder is not None else default_geocoder()
+        self.geocache = geocache
+        self.tiles = {}
+        self._endpoints = {}
     
     def geolocate(self, place:str) -> Optional[tuple]:
         """
         Return the latitude and longitude of the specified location.
 
+        Results, including places that could not be found, are memoized in the geocode
+        cache when one is provided.
+
         Args:
             place (str): The location to geolocate.
 
         Returns:
             tuple: A tuple containing the latitude and longitude of the location, or None if not found.
         """
+        if self.geocache is not None:
+            try:
+                coordinates = self.geocache[place]
+            except KeyError:
+                profiling.count('geocode.cache_misses')
+            else:
+                profiling.count('geocode.cache_hits')
+                return coordinates
 
-        geocode_result = self.geocoder.geocode(place, exactly_one=False)
-        return geocode_result[0][1] if geocode_result else None
-        
-    def location_sequence(self, start:tuple, end:tuple, steps:int) -> np.ndarray:
+        # Only the best match is used, so there is no need to request every candidate
+        with profiling.stage('geolocate'):
+            geocode_result = self.geocoder.geocode(place, exactly_one=True)
+        profiling.count('geocode.requests')
+        coordinates = tuple(geocode_result[1]) if geocode_result else None
+
+        if self.geocache is not None:
+            self.geocache[place] = coordinates
+        return coordinates
+
+    def geolocate_many(self, places, workers:int = 4, return_exceptions:bool = False) -> dict:
+        """
+        Return the latitude and longitude of many locations, looked up concurrently.
+
+        Each normalized place name is geolocated once, however many spellings of it are
+        given. Lookups go through geolocate, so the geocode cache is used, and new
+        results are saved to it once for the whole batch. To share lookups in flight
+        across calls, or to limit their rate, use a BulkGeocoder as the geocoder.
+
+        Args:
+            places (Iterable[str]): The locations to geolocate.
+            workers (int): The maximum number of lookups run at once. Default is 4.
+            return_exceptions (bool): Whether to return the exception raised by the lookup of a
+                location in place of its coordinates, instead of raising it. Default is False.
+
+        Returns:
+            dict: A mapping from each location to its (latitude, longitude), or None if not found.
+        """
+        names = {}
+        places = list(places)
+        for place in places:
+            names.setdefault(GeocodeCache.normalize(place), place)
+
+        lookup = self.geolocate
+        if return_exceptions:
+            def lookup(place: str):
+                try:
+                    return self.geolocate(place)
+                except Exception as error:
+                    return error
+
+        if workers <= 1 or len(names) <= 1:
+            coordinates = {name: lookup(place) for name, place in names.items()}
+        else:
+            with ThreadPoolExecutor(max_workers = min(workers, len(names))) as executor:
+                coordinates = dict(zip(names, executor.map(lookup, names.values())))
+        if self.geocache is not None:
+            self.geocache.save()
+        return {place: coordinates[GeocodeCache.normalize(place)] for place in places}
+
+    def endpoints(self) -> tuple:
+        """
+        Return the coordinates of the start and end locations, looked up concurrently.
+
+        Both locations are looked up once per pair of start and end, so that the methods
+        analysing the route can be called in turn without geocoding it again.
+
+        Returns:
+            tuple: The (latitude, longitude) of the start and of the end, each None if not found.
+        """
+        key = (self.start, self.end)
+        if key not in self._endpoints:
+            coordinates = self.geolocate_many([self.start, self.end], workers = 2)
+            if coordinates[self.start] is None or coordinates[self.end] is None:
+                return coordinates[self.start], coordinates[self.end]
+            self._endpoints[key] = coordinates[self.start], coordinates[self.end]
+        return self._endpoints[key]
+
+    def location_sequence(self, start:tuple, end:tuple, steps:int, sampling:str = 'linear') -> np.ndarray:
         """
-        Generate evenly spaced coordinates between the start and end locations.
+        Generate coordinates between the start and end locations.
+
+        The sampling selects how the coordinates are placed:
+        - 'linear' spaces them evenly in latitude and longitude.
+        - 'geodesic' spaces them evenly on the ground along the great circle.
+        - 'tile' spaces them along the great circle by the ground footprint of a map image,
+          so that neighbouring images overlap by MAX_OVERLAP. The steps are then the most
+          coordinates returned: a route needing fewer images gets fewer coordinates, and a
+          route needing more is sampled as 'geodesic', whose images overlap less.
 
         Args:
             start (tuple): The starting coordinates (latitude, longitude).
             end (tuple): The ending coordinates (latitude, longitude).
             steps (int): The number of intervals between the start and end locations.
+            sampling (str): One of SAMPLINGS. Default is 'linear'.
+
+        Returns:
+            np.ndarray: An array of coordinates between the start and end locations. There are
+                as many as steps, except under 'tile' sampling, where there can be fewer.
+
+        Raises:
+            ValueError: If the sampling is not one of SAMPLINGS.
+        """
+        if sampling == 'linear':
+            lats = np.linspace(start[0], end[0], steps)
+            longs = np.linspace(start[1], end[1], steps)
+            return np.vstack([lats, longs]).transpose()
+        if sampling == 'geodesic':
+            return geo.geodesic_sequence(start, end, steps)
+        if sampling == 'tile':
+            # The footprint is that of a Map at its default zoom and size
+            locations = geo.tile_sequence(start, end, max_overlap = MAX_OVERLAP)
+            return locations if len(locations) <= steps else geo.geodesic_sequence(start, end, steps)
+        raise ValueError(f"Unknown sampling {sampling!r}, expected one of {', '.join(SAMPLINGS)}")
+
+    def sample_locations(self, steps:int, sampling:str = 'linear') -> np.ndarray:
+        """
+        Return the coordinates of the intervals between the start and end locations.
+
+        These are the locations whose counts green_between and its variants return, one
+        per count, in route order.
+
+        Args:
+            steps (int): The number of intervals between the start and end locations.
+            sampling (str): How the intervals are placed, as for location_sequence. Default is 'linear'.
 
         Returns:
-            np.ndarray: An array of coordinates between the start and end locations.
+            np.ndarray: An array of (latitude, longitude) pairs, empty if the locations are invalid.
         """
-        lats = np.linspace(start[0], end[0], steps)
-        longs = np.linspace(start[1], end[1], steps)
-        return np.vstack([lats, longs]).transpose()
+        start_coords, end_coords = self.endpoints()
+        if start_coords is None or end_coords is None:
+            return np.empty((0, 2))
+        return self.location_sequence(start_coords, end_coords, steps, sampling)
     
-    def green_between(self, steps:int) -> list:
+    def green_between(self, steps:int, workers:int = 1, sampling:str = 'linear', processes:int = 0) -> list:
         """
         Calculate the number of green pixels at each interval between two locations.
 
+        When more than one worker is requested, the map images are fetched concurrently
+        through a thread pool. The results are always returned in route order, one for
+        each location given by sample_locations.
+
         Args:
             steps (int): The number of intervals between the start and end locations.
+            workers (int): The maximum number of map images fetched at once. Default is 1.
+            sampling (str): How the intervals are placed, as for location_sequence. Default is 'linear'.
+            processes (int): The number of processes decoding and classifying the images. Default is 0,
+                meaning the fetching threads also decode and classify.
 
         Returns:
             list: A list of the number of green pixels at each interval, or an empty list if locations are invalid.
         """
-        start_coords = self.geolocate(self.start)
-        end_coords = self.geolocate(self.end)
+        results = sorted(self.iter_green_between(steps, workers = workers, sampling = sampling, processes = processes))
+        return [green_count for _, _, _, green_count in results]
 
-        # Error handling for the case when the geolocate method returns None.
+    def green_between_adaptive(self, coarse_steps:int, tolerance:float, max_tiles:int, workers:int = 1,
+                               sampling:str = 'linear') -> list:
+        """
+        Calculate the number of green pixels along the route, sampling densely only where it changes.
+
+        A coarse pass of evenly spaced intervals is counted first. Then each segment between
+        neighbouring samples whose counts differ by more than the tolerance is bisected, the
+        segments with the largest differences first, until no segment differs by more than
+        the tolerance or max_tiles map images have been counted. The midpoints of each round
+        are fetched together, so several workers can fetch them concurrently.
+
+        Args:
+            coarse_steps (int): The number of evenly spaced intervals of the coarse pass, at least 2.
+            tolerance (float): The largest difference in green pixels left between neighbouring samples.
+            max_tiles (int): The maximum number of map images counted, including the coarse pass.
+            workers (int): The maximum number of map images fetched at once. Default is 1.
+            sampling (str): How positions along the route are placed, 'linear' or 'geodesic'. Default is 'linear'.
+
+        Returns:
+            list: A (position, latitude, longitude, green pixel count) tuple for each sample in route
+                order, where position is the fraction of the route from the start, or an empty list
+                if locations are invalid.
+
+        Raises:
+            ValueError: If the sampling is not 'linear' or 'geodesic', or coarse_steps is not between 2 and max_tiles.
+        """
+        if sampling not in ('linear', 'geodesic'):
+            raise ValueError(f"Adaptive sampling needs 'linear' or 'geodesic' positions, not {sampling!r}")
+        if not 2 <= coarse_steps <= max_tiles:
+            raise ValueError(f"coarse_steps must be between 2 and max_tiles ({max_tiles}), not {coarse_steps}")
+
+        start_coords, end_coords = self.endpoints()
         if start_coords is None or end_coords is None:
             return []
-        
-        return [Map(*location).count_green()
-            for location in self.location_sequence(start_coords, end_coords, steps)]
\ No newline at end of file
+
+        samples = {}
+        def count(positions) -> None:
+            locations = self.locations_at(start_coords, end_coords, positions, sampling)
+            for index, lat, long, green_count in count_locations(enumerate(locations), workers):
+                samples[positions[index]] = (positions[index], lat, long, green_count)
+
+        def difference(first:float, second:float) -> float:
+            return abs(samples[second][3] - samples[first][3])
+
+        count(list(np.linspace(0, 1, coarse_steps)))
+        positions = sorted(samples)
+        # Segments are kept in a heap with the largest difference in counts first
+        segments = [(-difference(first, second), first, second) for first, second in zip(positions, positions[1:])]
+        heapq.heapify(segments)
+
+        while segments and -segments[0][0] > tolerance and len(samples) < max_tiles:
+            bisected = []
+            while segments and -segments[0][0] > tolerance and len(samples) + len(bisected) < max_tiles:
+                bisected.append(heapq.heappop(segments)[1:])
+
+            count([(first + second) / 2 for first, second in bisected])
+            for first, second in bisected:
+                middle = (first + second) / 2
+                heapq.heappush(segments, (-difference(first, middle), first, middle))
+                heapq.heappush(segments, (-difference(middle, second), middle, second))
+
+        return [samples[position] for position in sorted(samples)]
+
+    def locations_at(self, start:tuple, end:tuple, positions, sampling:str = 'linear') -> np.ndarray:
+        """
+        Return the coordinates at fractions of the way from the start to the end location.
+
+        Args:
+            start (tuple): The starting coordinates (latitude, longitude).
+            end (tuple): The ending coordinates (latitude, longitude).
+            positions: The fractions of the route, from 0 at the start to 1 at the end.
+            sampling (str): 'linear' to interpolate latitude and longitude, or 'geodesic' to follow
+                the great circle. Default is 'linear'.
+
+        Returns:
+            np.ndarray: An array of (latitude, longitude) pairs, one per position.
+        """
+        positions = np.asarray(positions, dtype = np.float64)
+        if sampling == 'geodesic':
+            return geo.great_circle(start, end, positions)
+        return np.outer(1 - positions, start) + np.outer(positions, end)
+
+    def green_between_mosaic(self, steps:int, workers:int = 1, sampling:str = 'linear',
+                             path:Optional[str] = None) -> list:
+        """
+        Calculate the number of green pixels at each interval from a mosaic of the route.
+
+        Rather than one map image per interval, the images of a fixed grid covering the
+        route are fetched once each and stitched together, and the count of each interval
+        is taken from the window its own image would have covered. Dense routes therefore
+        cost one request per grid cell instead of one per interval.
+
+        Args:
+            steps (int): The number of intervals between the start and end locations.
+            workers (int): The maximum number of map images fetched at once. Default is 1.
+            sampling (str): How the intervals are placed, as for location_sequence. Default is 'linear'.
+            path (str): Optional file backing the mosaic. Defaults to a temporary file.
+
+        Returns:
+            list: A list of the number of green pixels at each interval, or an empty list if locations are invalid.
+        """
+        start_coords, end_coords = self.endpoints()
+        if start_coords is None or end_coords is None:
+            return []
+
+        locations = self.location_sequence(start_coords, end_coords, steps, sampling)
+        with Mosaic(locations, path = path) as mosaic:
+            mosaic.fetch(workers)
+            return mosaic.counts(locations)
+
+    def retained_maps(self, steps:int, workers:int = 1, sampling:str = 'linear') -> list:
+        """
+        Return the maps at each interval, fetching and decoding only those not already retained.
+
+        The maps are kept in the tiles attribute, so that any number of thresholds and
+        metrics can be computed from them without fetching or decoding again.
+
+        Args:
+            steps (int): The number of intervals between the start and end locations.
+            workers (int): The maximum number of map images fetched at once. Default is 1.
+            sampling (str): How the intervals are placed, as for location_sequence. Default is 'linear'.
+
+        Returns:
+            list: The loaded Map at each interval, or an empty list if locations are invalid.
+        """
+        start_coords, end_coords = self.endpoints()
+        if start_coords is None or end_coords is None:
+            return []
+
+        maps = []
+        for location in self.location_sequence(start_coords, end_coords, steps, sampling):
+            location = (float(location[0]), float(location[1]))
+            if location not in self.tiles:
+                self.tiles[location] = Map(*location, keep_image = False)
+            maps.append(self.tiles[location])
+
+        prefetch(maps, workers)
+        return maps
+
+    def green_sweep(self, steps:int, thresholds, workers:int = 1, sampling:str = 'linear') -> np.ndarray:
+        """
+        Calculate the number of green pixels at each interval for several thresholds at once.
+
+        Each map is fetched and decoded once, and retained for later calls, and all
+        thresholds are answered from a single pass over its pixels.
+
+        Args:
+            steps (int): The number of intervals between the start and end locations.
+            thresholds: A sequence of thresholds.
+            workers (int): The maximum number of map images fetched at once. Default is 1.
+            sampling (str): How the intervals are placed, as for location_sequence. Default is 'linear'.
+
+        Returns:
+            np.ndarray: An array of shape (intervals, thresholds) of green pixel counts.
+        """
+        maps = self.retained_maps(steps, workers, sampling)
+        with profiling.stage('classify'):
+            counts = count_green_batch([my_map.pixels for my_map in maps], list(thresholds))
+        return counts.reshape(len(maps), len(thresholds))
+
+    def ratio_histograms(self, steps:int, edges:np.ndarray = RATIO_EDGES, workers:int = 1,
+                         sampling:str = 'linear') -> np.ndarray:
+        """
+        Count the pixels at each interval in each bin of greenness ratio.
+
+        The histograms summarize the retained maps compactly: the number of green pixels
+        for any threshold at a bin edge can be read off as the sum of the bins above it.
+
+        Args:
+            steps (int): The number of intervals between the start and end locations.
+            edges (np.ndarray): The increasing bin edges. Default is 60 bins from 0 to 3.
+            workers (int): The maximum number of map images fetched at once. Default is 1.
+            sampling (str): How the intervals are placed, as for location_sequence. Default is 'linear'.
+
+        Returns:
+            np.ndarray: An array of shape (intervals, bins) of pixel counts.
+        """
+        maps = self.retained_maps(steps, workers, sampling)
+        return np.array([my_map.ratio_histogram(edges) for my_map in maps], dtype = np.int64).reshape(len(maps), len(edges) - 1)
+
+    def show_green(self, steps:int, threshold:float = 1.1, workers:int = 1, sampling:str = 'linear') -> list:
+        """
+        Generate an image highlighting the green pixels at each interval, from the retained maps.
+
+        Args:
+            steps (int): The number of intervals between the start and end locations.
+            threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+            workers (int): The maximum number of map images fetched at once. Default is 1.
+            sampling (str): How the intervals are placed, as for location_sequence. Default is 'linear'.
+
+        Returns:
+            list: The PNG image of each interval, as bytes.
+        """
+        return [my_map.show_green(threshold) for my_map in self.retained_maps(steps, workers, sampling)]
+
+    def iter_green_between(self, steps:int, workers:int = 1, checkpoint:Optional[str] = None,
+                           sampling:str = 'linear', processes:int = 0) -> Iterator[tuple]:
+        """
+        Yield the number of green pixels at each interval as soon as it is known.
+
+        With a single worker, or with worker processes, the intervals are yielded in route
+        order. With several workers they are yielded in the order their map images arrive,
+        so callers should use the index to place them.
+
+        When a checkpoint file is given, every result is appended to it as it is yielded.
+        A later call for the same route resumes from the file, yielding the recorded results
+        first and only fetching the intervals that are missing.
+
+        Args:
+            steps (int): The number of intervals between the start and end locations.
+            workers (int): The maximum number of map images fetched at once. Default is 1.
+            checkpoint (str): An optional JSON lines file recording the results. Default is None.
+            sampling (str): How the intervals are placed, as for location_sequence. Default is 'linear'.
+            processes (int): The number of processes decoding and classifying the images. Default is 0.
+
+        Yields:
+            tuple: An (index, latitude, longitude, green pixel count) tuple for each interval.
+                Nothing is yielded if the locations are invalid.
+        """
+        start_coords, end_coords = self.endpoints()
+
+        # Error handling for the case when the geolocate method returns None.
+        if start_coords is None or end_coords is None:
+            return
+
+        header = dict(start = self.start, end = self.end, steps = steps, sampling = sampling)
+        recorded = read_checkpoint(checkpoint, header) if checkpoint else {}
+        for index in sorted(recorded):
+            yield recorded[index]
+
+        pending = [(index, location)
+                   for index, location in enumerate(self.location_sequence(start_coords, end_coords, steps, sampling))
+                   if index not in recorded]
+
+        record = None
+        if checkpoint:
+            # Rewrite the checkpoint file, dropping any partially written line before appending.
+            # The new file replaces the old one only once complete, so an interruption while
+            # rewriting leaves the recorded results in place.
+            handle, temporary = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(checkpoint)), suffix = ".tmp")
+            try:
+                with os.fdopen(handle, 'w') as rewritten:
+                    for line in [header] + [recorded[index] for index in sorted(recorded)]:
+                        rewritten.write(json.dumps(line) + "\n")
+                os.replace(temporary, checkpoint)
+            except BaseException:
+                os.remove(temporary)
+                raise
+            record = open(checkpoint, 'a')
+        try:
+            for result in count_locations(pending, workers, processes):
+                if record:
+                    record.write(json.dumps(result) + "\n")
+                    record.flush()
+                yield result
+        finally:
+            if record:
+                record.close()
+
+def default_geocoder():
+    """
+    Return the geocoder used by a Greengraph when none is given.
+
+    Returns:
+        object: A geopy GoogleV3 geocoder.
+    """
+    # geopy is only imported when the default geocoder is needed, as it is slow to import
+    import geopy.geocoders
+    return geopy.geocoders.GoogleV3(domain = "maps.google.co.uk")
+
+def count_location(location) -> int:
+    """
+    Fetch the map centred on a location and count its green pixels.
+
+    The encoded image is dropped as soon as it is decoded, and the decoded pixels as
+    soon as they are counted, so that only the count outlives the call.
+
+    Args:
+        location: A (latitude, longitude) pair.
+
+    Returns:
+        int: The number of green pixels in the map image.
+    """
+    my_map = Map(*location, keep_image = False)
+    try:
+        return my_map.count_green()
+    finally:
+        my_map.release()
+
+def count_locations(locations:Iterable[tuple], workers:int = 1, processes:int = 0,
+                    max_in_flight:Optional[int] = None, return_exceptions:bool = False) -> Iterator[tuple]:
+    """
+    Count the green pixels around several indexed locations, yielding each as it finishes.
+
+    Locations are taken from the iterable only as fast as they are counted: at most
+    max_in_flight map images are being fetched or waiting to be read at any time, so
+    memory stays flat however many locations there are, and a slow reader holds back
+    the fetching instead of letting results pile up.
+
+    Args:
+        locations (Iterable[tuple]): (index, (latitude, longitude)) pairs.
+        workers (int): The maximum number of map images fetched at once. Default is 1.
+        processes (int): The number of processes decoding and classifying the images. Default is 0,
+            meaning the fetching threads also decode and classify.
+        max_in_flight (int): The maximum number of locations submitted but not yet yielded.
+            Defaults to IN_FLIGHT_PER_WORKER times the number of workers.
+        return_exceptions (bool): Whether to yield a FetchError in place of the count of a
+            location that failed, instead of raising it. Default is False.
+
+    Yields:
+        tuple: An (index, latitude, longitude, green pixel count) tuple for each location.
+
+    Raises:
+        FetchError: If a map image cannot be fetched or decoded, unless return_exceptions is set.
+    """
+    if processes:
+        yield from parallel.count_locations(locations, workers, processes = processes,
+                                            return_exceptions = return_exceptions)
+        return
+
+    def result(index, location, count) -> tuple:
+        if isinstance(count, FetchError):
+            if not return_exceptions:
+                raise count
+            return (index, float(location[0]), float(location[1]), count)
+        return (index, float(location[0]), float(location[1]), int(count))
+
+    if workers <= 1:
+        for index, location in locations:
+            try:
+                count = count_location(location)
+            except FetchError as error:
+                count = error
+            yield result(index, location, count)
+        return
+
+    max_in_flight = max(workers, max_in_flight or IN_FLIGHT_PER_WORKER * workers)
+    locations = iter(locations)
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        futures = {}
+        try:
+            while True:
+                # Only submit more locations once earlier results have been read
+                for index, location in itertools.islice(locations, max_in_flight - len(futures)):
+                    futures[executor.submit(count_location, location)] = (index, location)
+                if not futures:
+                    return
+
+                done, _ = wait(futures, return_when = FIRST_COMPLETED)
+                for future in done:
+                    index, location = futures.pop(future)
+                    try:
+                        count = future.result()
+                    except FetchError as error:
+                        count = error
+                    yield result(index, location, count)
+        finally:
+            # Do not wait for the remaining images if the caller stops early
+            for future in futures:
+                future.cancel()
+
+def read_checkpoint(checkpoint:str, header:dict) -> dict:
+    """
+    Read the results recorded in a checkpoint file for a route.
+
+    Args:
+        checkpoint (str): The JSON lines checkpoint file.
+        header (dict): The start, end, steps and sampling of the route being resumed.
+
+    Returns:
+        dict: The recorded (index, latitude, longitude, green pixel count) tuples keyed by index.
+            The dictionary is empty if the file is missing, belongs to a different route or has
+            a corrupt header.
+    """
+    if not os.path.exists(checkpoint):
+        return {}
+
+    with open(checkpoint) as record:
+        lines = [line for line in record if line.strip()]
+    try:
+        if not lines or json.loads(lines[0]) != header:
+            return {}
+    except ValueError:
+        # A corrupt header starts the route over
+        return {}
+
+    recorded = {}
+    for line in lines[1:]:
+        try:
+            index, lat, long, green_count = json.loads(line)
+            recorded[int(index)] = (int(index), float(lat), float(long), int(green_count))
+        except (ValueError, TypeError):
+            # Partially written or corrupt lines are fetched again
+            continue
+    return recorded
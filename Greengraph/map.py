@@ -9,23 +9,55 @@ The Map class provides methods to:
 - Count the total number of green pixels in the image.
 - Generate a new image highlighting the green pixels.
 
+Map objects only fetch their image when it is first needed. The prefetch function
+fetches the images of many maps at once, sending one request per distinct image.
+
+Images are fetched through the MapSession assigned to Map.session, or the shared default
+session, which pools connections, retries transient failures and can limit the request
+rate. A request that fails, or returns an invalid image, raises FetchError.
+
+Downloaded images are stored in the tile cache assigned to Map.cache, if any, so that
+identical requests are only sent to the API once. The default cache is configured by
+the GREENGRAPH_CACHE_DIR environment variable.
+
+When an Archive is assigned to Map.archive, images are recorded to it as they are
+fetched, or replayed from it without any network I/O.
+
+Images are decoded to uint8 RGB arrays by the decode module rather than matplotlib,
+and the raw image bytes are only kept when requested.
+
+The green_index method builds, and optionally persists, a summed-area table of the
+green mask, from which the count of any window of the image is read in constant time.
+
+Counts can be approximated from a sample of the pixels, with a reported error bound,
+by estimate_green, or by count_green for every Map when Map.approximate is set.
+
 Dependencies:
 - numpy
 - requests
-- matplotlib
+- Pillow (optional, used for decoding when installed)
 """
 
+import os
+import threading
 import numpy as np
-from io import BytesIO
-from matplotlib import image as img
-import requests
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from Greengraph.session import FetchError, default_session
+from Greengraph.decode import decode_image, encode_png
+from Greengraph.cache import TileCache
+from Greengraph.classify import GreenIndex, GreenKernel, RATIO_EDGES, estimate_green, green_mask, ratio_histogram
+from Greengraph import profiling
+from typing import Iterable, Optional, Tuple
 
 class Map(object):
     """
     The Map class interacts with the Google Maps API to fetch satellite imagery
     for a given location, process that imagery, and analyze green pixels.
 
+    A Map is a lazy handle: constructing it only builds the request, and the image is
+    fetched and decoded when its pixels are first needed. Use the prefetch function to
+    fetch many maps at once, merging identical requests.
+
     Attributes:
         lat (float): Latitude of the location.
         long (float): Longitude of the location.
@@ -33,10 +65,27 @@ class Map(object):
         zoom (int): Zoom level for the map image. Defaults to 10.
         size (Tuple[int, int]): The dimensions of the map image. Defaults to (400, 400).
         sensor (bool): Whether the map is sensor-based. Defaults to False.
+        base (str): The URL of the static map API, shared by every Map unless set on an instance.
+        params (dict): The query parameters of the image request.
+        image (bytes): The encoded image, or None if it was not kept.
+        pixels (np.ndarray): The decoded image as a uint8 RGB array.
+        cache (TileCache): The tile cache shared by every Map. Defaults to None, meaning no caching.
+        session (MapSession): The session through which every Map fetches. Defaults to None, meaning the shared default session.
+        archive (Archive): The archive recording or replaying the images of every Map. Defaults to None.
+        approximate (float): The error tolerance, as a fraction of the pixels of an image, of the approximate
+            counts returned by count_green for every Map. Defaults to None, meaning exact counts.
     """
-    def __init__(self, lat: float, long: float, satellite: bool = True, zoom: int = 10, size: Tuple[int, int] = (400, 400), sensor: bool = False):
+
+    base = "http://maps.googleapis.com/maps/api/staticmap?"
+    cache = TileCache.from_environment()
+    session = None
+    archive = None
+    approximate = None
+
+    def __init__(self, lat: float, long: float, satellite: bool = True, zoom: int = 10, size: Tuple[int, int] = (400, 400), sensor: bool = False, keep_image: bool = True):
         """
         Initialize a Map object with the provided latitude, longitude, and other optional parameters.
+        No request is made until the image is needed.
         
         Args:
             lat (float): Latitude of the location.
@@ -45,11 +94,17 @@ class Map(object):
             zoom (int): Zoom level of the map. Default is 10.
             size (Tuple[int, int]): Size of the map image in pixels. Default is (400, 400).
             sensor (bool): Whether the map is based on a sensor. Default is False.
+            keep_image (bool): Whether to keep the encoded image bytes after decoding. Default is True.
         """
-
-        base = "http://maps.googleapis.com/maps/api/staticmap?"
+        self.lat = lat
+        self.long = long
+        self.satellite = satellite
+        self.zoom = zoom
+        self.size = size
+        self.sensor = sensor
+        self.keep_image = keep_image
         
-        params = dict(
+        self.params = dict(
               sensor = str(sensor).lower(),
               zoom = zoom, 
               size = "x".join(map(str, size)),
@@ -57,15 +112,130 @@ class Map(object):
               style = "feature:all|element:labels|visibility:off"
               )
         if satellite:
-            params["maptype"] = "satellite"
-        
-        # Fetch the image data as binary and handle potential invalid image formats
-        self.image = requests.get(base, params = params).content
-        try:
-            self.pixels = img.imread(BytesIO(self.image)) if self.image else np.random.rand(400, 400, 3).astype(np.float32) 
-        except Exception:
-            # Return a random image if the image data is invalid
-            self.pixels = np.random.rand(400, 400, 3).astype(np.float32)
+            self.params["maptype"] = "satellite"
+
+        self._image = None
+        self._pixels = None
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def request_key(self) -> str:
+        """
+        str: The content address of the image request. Maps with equal keys fetch the same image.
+        """
+        return TileCache.key(self.base, self.params)
+
+    @property
+    def loaded(self) -> bool:
+        """
+        bool: Whether the image has been fetched and decoded.
+        """
+        return self._pixels is not None
+
+    @property
+    def image(self) -> bytes:
+        """
+        bytes: The encoded image, fetched on first access, or None if it was not kept.
+        """
+        if not self.loaded:
+            self.load()
+        return self._image
+
+    @image.setter
+    def image(self, image: bytes) -> None:
+        self._image = image
+
+    @property
+    def pixels(self) -> np.ndarray:
+        """
+        np.ndarray: The decoded image, fetched and decoded on first access.
+        """
+        if not self.loaded:
+            self.load()
+        return self._pixels
+
+    @pixels.setter
+    def pixels(self, pixels: np.ndarray) -> None:
+        self._pixels = pixels
+        self._indexes = {}
+
+    def load(self, image: Optional[bytes] = None) -> None:
+        """
+        Fetch and decode the image, unless this has already happened.
+
+        Args:
+            image (bytes): Optional encoded image already fetched for the same request. Default is None.
+
+        Raises:
+            FetchError: If the image cannot be fetched or is not a valid image.
+        """
+        with self._lock:
+            if self.loaded:
+                return
+
+            cached = image is not None
+            if image is None:
+                image, cached = self.fetch()
+
+            # An invalid image is an error, never replaced by made-up pixels
+            try:
+                with profiling.stage('decode'):
+                    self._pixels = decode_image(image)
+            except ValueError as error:
+                raise FetchError(f"Invalid image for center {self.params['center']}: {error}") from error
+
+            # Only valid images are stored in the cache
+            if self.cache and not cached:
+                self.cache.put(self.base, self.params, image)
+
+            # The decoded pixels are all that is needed for counting
+            self._image = image if self.keep_image else None
+
+    def fetch(self) -> Tuple[bytes, bool]:
+        """
+        Fetch the encoded image from the archive, the tile cache or the API, without decoding it.
+
+        Returns:
+            Tuple[bytes, bool]: The encoded image and whether it came from the tile cache or the archive.
+
+        Raises:
+            FetchError: If the image cannot be fetched, or is missing from an archive being replayed.
+        """
+        # Serve the image from the archive, and never from the network when replaying
+        if self.archive is not None:
+            image = self.archive.tile(self.request_key)
+            if image is not None:
+                profiling.count('tile.archive_hits')
+                return image, True
+            if not self.archive.recording:
+                raise FetchError(f"No archived image for center {self.params['center']}")
+
+        # Reuse the cached image for a previously made request
+        image, cached = None, False
+        if self.cache:
+            image = self.cache.get(self.base, self.params)
+            cached = image is not None
+            profiling.count('tile.cache_hits' if cached else 'tile.cache_misses')
+
+        # Fetch the image data as binary
+        if image is None:
+            session = self.session or default_session()
+            with profiling.stage('fetch'):
+                image = session.get(self.base, self.params)
+
+        if self.archive is not None:
+            self.archive.put_tile(self.request_key, image)
+        return image, cached
+
+    def release(self) -> None:
+        """
+        Drop the encoded image, decoded pixels and green indexes. They are fetched again if needed.
+        """
+        with self._lock:
+            self._image = None
+            self._pixels = None
+            self._indexes = {}
             
     def green(self, threshold: float) -> np.ndarray:
         """
@@ -77,23 +247,108 @@ class Map(object):
         Returns:
             np.ndarray: A 2D array of boolean values indicating whether each pixel is green.
         """
-        greener_than_red = self.pixels[:, :, 1] > threshold * self.pixels[:, :, 0]
-        greener_than_blue = self.pixels[:, :, 1] > threshold * self.pixels[:, :, 2]
-        green = np.logical_and(greener_than_red, greener_than_blue)
-        return green
+        pixels = self.pixels
+        with profiling.stage('classify'):
+            return green_mask(pixels, threshold)
     
-    def count_green(self, threshold:float = 1.1) -> int:
+    def count_green(self, threshold:float = 1.1, approximate:Optional[float] = None) -> int:
         """
         Count the number of green pixels in the image based on the threshold value.
 
         Args:
             threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+            approximate (float): Optional error tolerance, as a fraction of the pixels, for an
+                approximate count as made by estimate_green. Defaults to Map.approximate, and
+                0 requests an exact count.
+
+        Returns:
+            int: Total number of green pixels, exact or estimated.
+        """
+        approximate = self.approximate if approximate is None else approximate
+        if approximate:
+            return self.estimate_green(threshold, approximate)[0]
+        return np.count_nonzero(self.green(threshold))
+
+    def estimate_green(self, threshold:float = 1.1, tolerance:float = 0.02) -> Tuple[int, int]:
+        """
+        Estimate the number of green pixels from a sample of the pixels, stopping once the
+        error bound is within the tolerance.
+
+        Args:
+            threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+            tolerance (float): The largest acceptable error bound, as a fraction of the pixels. Default is 0.02.
 
         Returns:
-            int: Total number of green pixels.
+            Tuple[int, int]: The estimated number of green pixels, and the 95% bound on its error in pixels.
         """
-        return np.sum(self.green(threshold))
+        pixels = self.pixels
+        with profiling.stage('classify'):
+            return estimate_green(pixels, threshold, tolerance)
     
+    def green_sweep(self, thresholds) -> np.ndarray:
+        """
+        Count the green pixels of the image for several thresholds in one pass.
+
+        Args:
+            thresholds: A sequence of thresholds.
+
+        Returns:
+            np.ndarray: The number of green pixels for each threshold.
+        """
+        pixels = self.pixels
+        with profiling.stage('classify'):
+            return GreenKernel(pixels.shape[:2]).counts(pixels, np.asarray(thresholds, dtype = np.float64))
+
+    def ratio_histogram(self, edges: np.ndarray = RATIO_EDGES) -> np.ndarray:
+        """
+        Count the pixels of the image in each bin of greenness ratio.
+
+        Args:
+            edges (np.ndarray): The increasing bin edges. Default is 60 bins from 0 to 3.
+
+        Returns:
+            np.ndarray: The number of pixels in each bin, as for classify.ratio_histogram.
+        """
+        pixels = self.pixels
+        with profiling.stage('classify'):
+            return ratio_histogram(pixels, edges)
+
+    def green_index(self, threshold:float = 1.1, path:Optional[str] = None) -> GreenIndex:
+        """
+        Return the summed-area table of the green mask, from which the number of green
+        pixels in any window of the image is read in constant time.
+
+        The index is built once per threshold, and only the index of the last threshold asked
+        for is kept with the map, bounding its memory to one table. When a path is given, an index saved there
+        for the same threshold and image request is loaded instead of fetching the image.
+        Otherwise the index is built and saved there, replacing any index for another
+        threshold or image.
+
+        Args:
+            threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+            path (str): Optional .npz file in which the index is persisted. Default is None.
+
+        Returns:
+            GreenIndex: The index of the green pixels of the image.
+        """
+        index = self._indexes.get(threshold)
+        if index is None:
+            if path and os.path.exists(path):
+                index = GreenIndex.load(path)
+                # An index saved for another threshold or image is rebuilt
+                if index.threshold != threshold or index.key != self.request_key:
+                    index = None
+            if index is None:
+                pixels = self.pixels
+                with profiling.stage('classify'):
+                    index = GreenIndex.from_pixels(pixels, threshold)
+                index.key = self.request_key
+                if path:
+                    index.save(path)
+            # Keep a single index, as each is four times the size of the image
+            self._indexes = {threshold: index}
+        return index
+
     def show_green(self, threshold:float = 1.1) -> bytes:
         """
         Generate an image where green pixels are highlighted.
@@ -105,8 +360,40 @@ class Map(object):
             bytes: The binary content of the generated image.
         """
         green = self.green(threshold) # return an array of true/false 
-        out = green[:, :, np.newaxis] * np.array([0, 1, 0])[np.newaxis, np.newaxis, :]
-        buffer = BytesIO() # Use BytesIO for binary output
-        img.imsave(buffer, out, format = 'png') # Save the image in PNG format
-        buffer.seek(0) # Ensure the buffer is at the start
-        return buffer.getvalue()
\ No newline at end of file
+        out = green[:, :, np.newaxis] * np.array([0, 255, 0], dtype = np.uint8)[np.newaxis, np.newaxis, :]
+        return encode_png(out) # Save the image in PNG format
+
+def prefetch(maps: Iterable[Map], workers: int = 8) -> int:
+    """
+    Fetch and decode the images of many maps at once.
+
+    Maps with identical requests are merged, so that each distinct image is fetched and
+    decoded once and shared by every map that requested it. Maps that are already
+    loaded are skipped.
+
+    Args:
+        maps (Iterable[Map]): The maps to load.
+        workers (int): The maximum number of images fetched at once. Default is 8.
+
+    Returns:
+        int: The number of distinct images fetched.
+    """
+    groups = {}
+    for pending in maps:
+        if not pending.loaded:
+            groups.setdefault(pending.request_key, []).append(pending)
+
+    def load_group(group: list) -> None:
+        # Load through a map that keeps its encoded image, if any does
+        group.sort(key = lambda pending: not pending.keep_image)
+        first = group[0]
+        first.load()
+        for duplicate in group[1:]:
+            duplicate.pixels = first.pixels
+            duplicate.image = first._image if duplicate.keep_image else None
+
+    with ThreadPoolExecutor(max_workers = max(1, workers)) as executor:
+        # Consume the results so that any exception is raised here
+        list(executor.map(load_group, groups.values()))
+
+    return len(groups)
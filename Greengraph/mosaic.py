@@ -0,0 +1,279 @@
+"""
+This module defines the Mosaic class, which fetches the map images covering a route
+once, on a fixed Web Mercator grid, and derives the green pixel count of every step
+from windows of the stitched result.
+
+Fetching one image centred on every step downloads the same ground many times over
+when the steps are closer together than an image is wide. A Mosaic instead divides the
+world into a grid of cells the size of one map image, fetches the image of each cell
+touched by a step exactly once, and keeps them in a memory-mapped array. The count of a
+step is then taken from the window of the mosaic that the step's own image would have
+covered, which spans at most four cells, so the bandwidth used grows with the area
+covered rather than with the number of steps. The windows are counted from a summed-area
+table of the green mask of each cell, so once the mosaic is built, counting a route at
+any step density is nearly free.
+
+Only the cells touched by a step are stored, never the whole bounding box of the route,
+so a long diagonal route needs disk in proportion to its length. The summed-area tables,
+four times the size of the cells they index, are built when a count needs them, and only
+the INDEX_CELLS most recently used are kept in memory, whatever the number of cells or
+thresholds counted.
+
+Grid images are ordinary Map requests, so they are shared through the tile cache
+between routes that cross the same cells.
+"""
+
+import os
+import tempfile
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from Greengraph.map import Map
+from Greengraph.session import FetchError
+from Greengraph.classify import GreenIndex
+from Greengraph import geo, profiling
+from typing import Optional, Tuple
+
+# Number of summed-area tables of cells, for any thresholds, kept in memory by a Mosaic
+INDEX_CELLS = 16
+
+def window_origin(location: tuple, zoom: int, size: Tuple[int, int]) -> Tuple[int, int]:
+    """
+    Return the global pixel coordinates of the top-left corner of the map image centred on a location.
+
+    Args:
+        location (tuple): The (latitude, longitude) of the image centre.
+        zoom (int): The zoom level.
+        size (Tuple[int, int]): The (width, height) of the image in pixels.
+
+    Returns:
+        Tuple[int, int]: The x and y pixel coordinates of the corner.
+    """
+    x, y = geo.to_pixels(location[0], location[1], zoom)
+    return int(round(float(x) - size[0] / 2)), int(round(float(y) - size[1] / 2))
+
+def grid_cells(locations, zoom: int = 10, size: Tuple[int, int] = (400, 400)) -> list:
+    """
+    Return the grid cells covered by the map images centred on some locations.
+
+    Args:
+        locations: A sequence of (latitude, longitude) pairs.
+        zoom (int): The zoom level. Default is 10.
+        size (Tuple[int, int]): The (width, height) of the images and of the grid cells. Default is (400, 400).
+
+    Returns:
+        list: The sorted (column, row) pairs of every cell overlapped by at least one image.
+    """
+    cells = set()
+    for location in locations:
+        left, top = window_origin(location, zoom, size)
+        # An image the size of a cell overlaps at most two columns and two rows
+        for column in range(left // size[0], (left + size[0] - 1) // size[0] + 1):
+            for row in range(top // size[1], (top + size[1] - 1) // size[1] + 1):
+                cells.add((column, row))
+    return sorted(cells)
+
+class Mosaic(object):
+    """
+    A memory-mapped mosaic of the fixed grid images covering a set of locations.
+
+    Only the cells needed by the locations are stored, one after another. Windows over
+    cells that were not fetched read as black. The summed-area tables of the cells are
+    built on demand, and at most INDEX_CELLS of them are kept.
+
+    Attributes:
+        zoom (int): The zoom level of the images.
+        size (Tuple[int, int]): The (width, height) of each grid image in pixels.
+        satellite (bool): Whether to use satellite imagery.
+        cells (list): The (column, row) pairs of the grid cells to fetch.
+        path (str): The file backing the mosaic.
+        pixels (np.memmap): The image of each cell, in the order of cells, as a uint8 array
+            of shape (cells, height, width, 3).
+    """
+
+    def __init__(self, locations, zoom: int = 10, size: Tuple[int, int] = (400, 400), satellite: bool = True,
+                 path: Optional[str] = None):
+        """
+        Initialize an empty Mosaic covering the map images centred on some locations.
+
+        Args:
+            locations: A sequence of (latitude, longitude) pairs.
+            zoom (int): The zoom level. Default is 10, as for Map.
+            size (Tuple[int, int]): The (width, height) of each grid image in pixels. Default is (400, 400).
+            satellite (bool): Whether to use satellite imagery. Default is True.
+            path (str): Optional file backing the mosaic. Defaults to a temporary file removed on close.
+        """
+        self.zoom = zoom
+        self.size = tuple(size)
+        self.satellite = satellite
+        self.cells = grid_cells(locations, zoom, size)
+        self._slots = {cell: slot for slot, cell in enumerate(self.cells)}
+
+        self._temporary = path is None
+        if path is None:
+            handle, path = tempfile.mkstemp(suffix = '.mosaic')
+            os.close(handle)
+        self.path = path
+        # A memory map cannot be empty, so a mosaic without cells keeps one unused cell
+        shape = (max(1, len(self.cells)), self.size[1], self.size[0], 3)
+        self.pixels = np.memmap(path, dtype = np.uint8, mode = 'w+', shape = shape)
+        self._indexes = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def fetch(self, workers: int = 8) -> int:
+        """
+        Fetch the image of every grid cell and copy it into the mosaic.
+
+        Args:
+            workers (int): The maximum number of images fetched at once. Default is 8.
+
+        Returns:
+            int: The number of images fetched.
+
+        Raises:
+            FetchError: If an image cannot be fetched, or is not the size of a grid cell.
+        """
+        def fetch_cell(cell: tuple) -> None:
+            lat, long = geo.from_pixels((cell[0] + 0.5) * self.size[0], (cell[1] + 0.5) * self.size[1], self.zoom)
+            tile = Map(float(lat), float(long), satellite = self.satellite, zoom = self.zoom, size = self.size,
+                       keep_image = False)
+            pixels = tile.pixels
+            if pixels.shape[:2] != (self.size[1], self.size[0]):
+                raise FetchError(f"Grid image for center {tile.params['center']} has shape {pixels.shape}")
+
+            self.pixels[self._slots[cell]] = pixels
+            tile.release()
+
+        # Any index built before fetching is out of date
+        self._indexes.clear()
+        with ThreadPoolExecutor(max_workers = max(1, workers)) as executor:
+            # Consume the results so that any exception is raised here
+            list(executor.map(fetch_cell, self.cells))
+        return len(self.cells)
+
+    def window(self, location: tuple) -> np.ndarray:
+        """
+        Return the part of the mosaic covered by the map image centred on a location.
+
+        Args:
+            location (tuple): The (latitude, longitude) of the image centre.
+
+        Returns:
+            np.ndarray: A copy of the window, the size of one map image, assembled from the cells it overlaps.
+        """
+        width, height = self.size
+        left, top = window_origin(location, self.zoom, self.size)
+        window = np.zeros((height, width, 3), dtype = np.uint8)
+        for _, slots, cells, x0, x1, y0, y1 in self._pieces([(left, top)]):
+            # Place the part of the cell at its offset from the corner of the window
+            x = int(cells[0, 0] * width + x0[0] - left)
+            y = int(cells[0, 1] * height + y0[0] - top)
+            window[y:y + y1[0] - y0[0], x:x + x1[0] - x0[0]] = self.pixels[slots[0], y0[0]:y1[0], x0[0]:x1[0]]
+        return window
+
+    def green_index(self, threshold: float = 1.1) -> list:
+        """
+        Return the summed-area tables of the green mask of every cell.
+
+        The returned list holds every table, while the mosaic itself keeps only the
+        INDEX_CELLS most recently used.
+
+        Args:
+            threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+
+        Returns:
+            list: The GreenIndex of each cell, in the order of cells.
+        """
+        return [self._index(slot, threshold) for slot in range(len(self.cells))]
+
+    def count_green(self, location: tuple, threshold: float = 1.1) -> int:
+        """
+        Count the green pixels of the map image centred on a location.
+
+        Args:
+            location (tuple): The (latitude, longitude) of the image centre.
+            threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+
+        Returns:
+            int: The number of green pixels in the window.
+        """
+        return self.counts([location], threshold)[0]
+
+    def counts(self, locations, threshold: float = 1.1) -> list:
+        """
+        Count the green pixels of the map images centred on many locations.
+
+        The summed-area table of each cell is looked up or built once per call, so that
+        counting is not slowed down by the bound on the tables kept.
+
+        Args:
+            locations: A sequence of (latitude, longitude) pairs.
+            threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+
+        Returns:
+            list: The number of green pixels in the window of each location.
+        """
+        corners = [window_origin(location, self.zoom, self.size) for location in locations]
+        if not corners:
+            return []
+
+        counts = np.zeros(len(corners), dtype = np.int64)
+        pieces = list(self._pieces(corners))
+        if pieces:
+            windows, slots, _, x0, x1, y0, y1 = (np.concatenate(values) for values in zip(*pieces))
+            for slot in np.unique(slots):
+                # Each window overlaps a cell at most once, so its parts of one cell have distinct windows
+                part = slots == slot
+                table = self._index(int(slot), threshold).table
+                # Only the four corners of each part are read from the table, and summed in int64
+                corners = [table[y[part], x[part]].astype(np.int64) for y, x in ((y1, x1), (y0, x1), (y1, x0), (y0, x0))]
+                counts[windows[part]] += corners[0] - corners[1] - corners[2] + corners[3]
+        return [int(count) for count in counts]
+
+    def close(self) -> None:
+        """
+        Release the mosaic, removing its file if it was temporary.
+        """
+        if self.pixels is None:
+            return
+        self.pixels.flush()
+        # The mapping itself is closed once no window of it remains in use
+        self.pixels = None
+        self._indexes.clear()
+        if self._temporary:
+            os.remove(self.path)
+
+    def _index(self, slot: int, threshold: float) -> GreenIndex:
+        # The summed-area table of one cell, kept in a least-recently-used cache of INDEX_CELLS tables
+        key = (slot, threshold)
+        if key in self._indexes:
+            self._indexes.move_to_end(key)
+            return self._indexes[key]
+
+        with profiling.stage('classify'):
+            index = GreenIndex.from_pixels(self.pixels[slot], threshold)
+        self._indexes[key] = index
+        while len(self._indexes) > INDEX_CELLS:
+            self._indexes.popitem(last = False)
+        return index
+
+    def _pieces(self, corners: list):
+        # A window overlaps at most two columns and two rows of cells. For each of the four
+        # candidates, yield the windows overlapping a fetched cell, the slot and (column, row)
+        # of that cell, and the bounds of the overlap in the cell's own pixel coordinates.
+        size = np.array(self.size, dtype = np.int64)
+        corners = np.asarray(corners, dtype = np.int64).reshape(-1, 2)
+        for offset in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            cells = corners // size + offset
+            low = np.clip(corners - cells * size, 0, size)
+            high = np.clip(corners + size - cells * size, 0, size)
+            slots = np.array([self._slots.get((int(column), int(row)), -1) for column, row in cells], dtype = np.int64)
+            windows = np.flatnonzero((slots >= 0) & np.all(high > low, axis = 1))
+            if len(windows):
+                yield (windows, slots[windows], cells[windows], low[windows, 0], high[windows, 0],
+                       low[windows, 1], high[windows, 1])
@@ -0,0 +1,248 @@
+"""
+This module fans the decoding and classification of map images out to a pool of
+processes, so that large batches use every core rather than the caller's thread.
+
+Map images are still fetched by threads in the calling process, which is where the
+network waits happen. Each chunk of encoded images is then copied into one block of
+shared memory, and a worker process decodes and classifies the images straight from
+that block. Only the name of the block, the offsets of the images and the resulting
+counts cross the process boundary, so no image is ever pickled. While a chunk is being
+classified the next chunk is fetched, and the results are yielded in order.
+
+Example:
+    with ClassifyPool(processes = 4) as pool:
+        for index, lat, long, count in count_locations(enumerate(locations), pool = pool):
+            ...
+"""
+
+import os
+import itertools
+import collections
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from Greengraph.map import Map
+from Greengraph.session import FetchError
+from Greengraph.decode import decode_image
+from Greengraph.classify import GreenKernel, estimate_green
+from Greengraph import profiling
+from typing import Iterable, Iterator, Optional
+
+# Number of images fetched and classified together
+CHUNK_SIZE = 64
+
+class ClassifyPool(object):
+    """
+    A pool of processes counting the green pixels of encoded map images.
+
+    Attributes:
+        processes (int): The number of worker processes.
+    """
+
+    def __init__(self, processes: Optional[int] = None):
+        """
+        Start a ClassifyPool.
+
+        Args:
+            processes (int): The number of worker processes. Defaults to the number of CPUs.
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self._executor = ProcessPoolExecutor(max_workers = self.processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, images: list, threshold: float = 1.1, approximate: Optional[float] = None):
+        """
+        Start counting the green pixels of some encoded images.
+
+        The images are split between the worker processes, each of which reads its share
+        from one shared memory block.
+
+        Args:
+            images (list): The encoded images, as bytes.
+            threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+            approximate (float): Optional error tolerance, as a fraction of the pixels, for approximate
+                counts as made by estimate_green. Default is None, meaning exact counts.
+
+        Returns:
+            ChunkResult: The pending counts, in the order of the images.
+        """
+        offsets = np.cumsum([0] + [len(image) for image in images]).tolist()
+        block = shared_memory.SharedMemory(create = True, size = max(1, offsets[-1]))
+        for image, start in zip(images, offsets):
+            block.buf[start:start + len(image)] = image
+
+        # One share per process, so that each process attaches to the block once
+        shares = np.array_split(np.arange(len(images)), min(self.processes, max(1, len(images))))
+        futures = [self._executor.submit(_count_block, block.name, offsets[share[0]:share[-1] + 2], threshold,
+                                         approximate)
+                   for share in shares if len(share)]
+        return ChunkResult(block, futures)
+
+    def count(self, images: list, threshold: float = 1.1) -> list:
+        """
+        Count the green pixels of some encoded images.
+
+        Args:
+            images (list): The encoded images, as bytes.
+            threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+
+        Returns:
+            list: The number of green pixels of each image, or a FetchError for an image
+                that could not be decoded.
+        """
+        return self.submit(images, threshold).result()
+
+    def close(self) -> None:
+        """
+        Stop the worker processes.
+        """
+        self._executor.shutdown()
+
+class ChunkResult(object):
+    """
+    The pending counts of a chunk of images submitted to a ClassifyPool.
+    """
+
+    def __init__(self, block, futures: list):
+        self._block = block
+        self._futures = futures
+        self._released = False
+
+    def result(self) -> list:
+        """
+        Wait for the counts and release the shared memory block.
+
+        Returns:
+            list: The number of green pixels of each image, or a FetchError for an image
+                that could not be decoded.
+        """
+        try:
+            counts = []
+            for future in self._futures:
+                counts += [FetchError(f"Invalid image: {count}") if isinstance(count, str) else count
+                           for count in future.result()]
+            return counts
+        finally:
+            self.release()
+
+    def release(self) -> None:
+        """
+        Cancel any counts not yet started and release the shared memory block.
+        """
+        if self._released:
+            return
+        self._released = True
+        for future in self._futures:
+            future.cancel()
+        self._block.close()
+        self._block.unlink()
+
+def count_locations(locations: Iterable[tuple], workers: int = 8, pool: Optional[ClassifyPool] = None,
+                    processes: Optional[int] = None, threshold: float = 1.1,
+                    return_exceptions: bool = False, approximate: Optional[float] = None) -> Iterator[tuple]:
+    """
+    Count the green pixels around several indexed locations, classifying in a process pool.
+
+    Args:
+        locations (Iterable[tuple]): (index, (latitude, longitude)) pairs.
+        workers (int): The maximum number of map images fetched at once. Default is 8.
+        pool (ClassifyPool): The pool to classify in. Defaults to a new pool, closed when done.
+        processes (int): The number of processes of a new pool. Defaults to the number of CPUs.
+        threshold (float): Threshold to determine greenness of a pixel. Default is 1.1.
+        return_exceptions (bool): Whether to yield a FetchError in place of the count of a
+            location that failed, instead of raising it. Default is False.
+        approximate (float): Optional error tolerance, as a fraction of the pixels, for approximate
+            counts as made by estimate_green. Defaults to Map.approximate.
+
+    Yields:
+        tuple: An (index, latitude, longitude, green pixel count) tuple for each location, in order.
+
+    Raises:
+        FetchError: If a map image cannot be fetched or decoded, unless return_exceptions is set.
+    """
+    # Chunks are taken from the locations only as they are needed, so at most two are held at once
+    locations = iter(locations)
+    chunks = iter(lambda: list(itertools.islice(locations, CHUNK_SIZE)), [])
+    first = next(chunks, None)
+    if first is None:
+        return
+
+    owned = pool is None
+    approximate = Map.approximate if approximate is None else approximate
+    pool = pool or ClassifyPool(processes)
+
+    def fetch(location) -> tuple:
+        tile = Map(*location, keep_image = False)
+        try:
+            return (tile,) + tile.fetch()
+        except FetchError as error:
+            return tile, error, False
+
+    def submit(chunk: list) -> tuple:
+        fetched = list(fetcher.map(fetch, [location for _, location in chunk]))
+        images = [image for _, image, _ in fetched if not isinstance(image, FetchError)]
+        return chunk, fetched, pool.submit(images, threshold, approximate)
+
+    submitted = collections.deque()
+    try:
+        with ThreadPoolExecutor(max_workers = max(1, workers)) as fetcher:
+            submitted.append(submit(first))
+            while submitted:
+                # Fetch the next chunk while this one is being classified
+                following = next(chunks, None)
+                if following is not None:
+                    submitted.append(submit(following))
+                chunk, fetched, result = submitted[0]
+
+                # Time spent waiting for the worker processes is reported as classification
+                with profiling.stage('classify'):
+                    counts = iter(result.result())
+
+                for (index, location), (tile, image, cached) in zip(chunk, fetched):
+                    count = image if isinstance(image, FetchError) else next(counts)
+                    if isinstance(count, FetchError):
+                        if not return_exceptions:
+                            raise count
+                    elif tile.cache and not cached:
+                        # Only valid images are stored in the cache
+                        tile.cache.put(tile.base, tile.params, image)
+                    yield (index, float(location[0]), float(location[1]), count)
+
+                # Free the shared memory and encoded images of the chunk once it has been read
+                submitted.popleft()
+                result.release()
+    finally:
+        # Release the shared memory of any chunk left unread when the caller stops early
+        for _, _, result in submitted:
+            result.release()
+        if owned:
+            pool.close()
+
+def _count_block(name: str, offsets: list, threshold: float, approximate: Optional[float] = None) -> list:
+    # Runs in a worker process: decode and classify each image of the block in turn.
+    # Workers share the resource tracker of the parent, which removes the block once.
+    block = shared_memory.SharedMemory(name = name)
+    kernels = {}
+    counts = []
+    try:
+        for start, end in zip(offsets, offsets[1:]):
+            try:
+                pixels = decode_image(bytes(block.buf[start:end]))
+            except ValueError as error:
+                counts.append(str(error))
+                continue
+            if approximate:
+                counts.append(estimate_green(pixels, threshold, approximate)[0])
+                continue
+            shape = pixels.shape[:2]
+            if shape not in kernels:
+                kernels[shape] = GreenKernel(shape)
+            counts.append(kernels[shape].count(pixels, threshold))
+    finally:
+        block.close()
+    return counts
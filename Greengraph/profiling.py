@@ -0,0 +1,173 @@
+"""
+This module provides the instrumentation hooks used across the Greengraph pipeline.
+
+The geolocate, fetch, decode and classify stages report their timings, and the caches
+and HTTP session report counters such as bytes transferred, cache hits and retries, to
+the active Profiler. Instrumentation is disabled unless a profiler is enabled, in which
+case each hook costs a single global lookup.
+
+Example:
+    profiler = profiling.enable()
+    graph.green_between(10)
+    profiling.disable()
+    print(profiler.format())
+"""
+
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+# The context manager returned by stage() while instrumentation is disabled
+_DISABLED = nullcontext()
+
+class Profiler(object):
+    """
+    Collects per-stage timers and named counters from every thread.
+
+    Stage times are summed over all calls, so with concurrent workers the total time
+    of a stage can exceed the wall-clock time of the run.
+
+    Attributes:
+        started (float): The time at which the profiler was created, from time.perf_counter.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty Profiler object.
+        """
+        self.started = time.perf_counter()
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time the enclosed block as one call of a stage.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                calls, total = self._stages.get(name, (0, 0.0))
+                self._stages[name] = (calls + 1, total + elapsed)
+
+    def count(self, name: str, amount: float = 1) -> None:
+        """
+        Add an amount to a named counter.
+
+        Args:
+            name (str): The name of the counter.
+            amount (float): The amount to add. Default is 1.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def report(self) -> dict:
+        """
+        Summarize the collected measurements.
+
+        Returns:
+            dict: The wall-clock 'elapsed' seconds, the 'stages' with their calls, total
+                and mean seconds, the raw 'counters', and the 'hit_rates' of each cache.
+        """
+        with self._lock:
+            stages = dict(self._stages)
+            counters = dict(self._counters)
+
+        hit_rates = {}
+        for name in counters:
+            if name.endswith('.cache_hits'):
+                prefix = name[:-len('.cache_hits')]
+                lookups = counters[name] + counters.get(prefix + '.cache_misses', 0)
+                hit_rates[prefix] = counters[name] / lookups if lookups else 0.0
+
+        return dict(
+            elapsed = time.perf_counter() - self.started,
+            stages = {name: dict(calls = calls, seconds = total, mean = total / calls)
+                      for name, (calls, total) in stages.items()},
+            counters = counters,
+            hit_rates = hit_rates)
+
+    def format(self) -> str:
+        """
+        Format the report as a human-readable table.
+
+        Returns:
+            str: The per-stage breakdown, counters and cache hit rates.
+        """
+        report = self.report()
+        lines = [f"Elapsed {report['elapsed']:.3f} s", "",
+                 f"{'Stage':<12}{'Calls':>8}{'Total (s)':>12}{'Mean (ms)':>12}"]
+        for name, stage in sorted(report['stages'].items(), key = lambda item: -item[1]['seconds']):
+            lines.append(f"{name:<12}{stage['calls']:>8}{stage['seconds']:>12.3f}{stage['mean'] * 1000:>12.3f}")
+
+        if report['counters']:
+            lines += ["", f"{'Counter':<28}{'Value':>12}"]
+            lines += [f"{name:<28}{value:>12g}" for name, value in sorted(report['counters'].items())]
+        if report['hit_rates']:
+            lines += ["", f"{'Cache':<28}{'Hit rate':>12}"]
+            lines += [f"{name:<28}{rate:>12.1%}" for name, rate in sorted(report['hit_rates'].items())]
+        return "\n".join(lines)
+
+_active = None
+
+def enable(profiler: Profiler = None) -> Profiler:
+    """
+    Start sending measurements to a profiler.
+
+    Args:
+        profiler (Profiler): The profiler to use. Defaults to a new Profiler.
+
+    Returns:
+        Profiler: The active profiler.
+    """
+    global _active
+    _active = profiler or Profiler()
+    return _active
+
+def disable() -> None:
+    """
+    Stop collecting measurements.
+    """
+    global _active
+    _active = None
+
+def active() -> Profiler:
+    """
+    Return the active profiler.
+
+    Returns:
+        Profiler: The active profiler, or None if instrumentation is disabled.
+    """
+    return _active
+
+def stage(name: str):
+    """
+    Return a context manager timing the enclosed block as one call of a stage.
+
+    Args:
+        name (str): The name of the stage.
+
+    Returns:
+        A context manager, which does nothing while instrumentation is disabled.
+    """
+    profiler = _active
+    return profiler.stage(name) if profiler is not None else _DISABLED
+
+def count(name: str, amount: float = 1) -> None:
+    """
+    Add an amount to a named counter of the active profiler, if any.
+
+    Args:
+        name (str): The name of the counter.
+        amount (float): The amount to add. Default is 1.
+    """
+    profiler = _active
+    if profiler is not None:
+        profiler.count(name, amount)
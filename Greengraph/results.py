@@ -0,0 +1,243 @@
+"""
+This module defines the ResultStore class, a compact binary store of the per-step
+results of route runs.
+
+Each step result is one fixed-size record of typed fields: route number, step index,
+latitude, longitude, zoom, threshold and green pixel count. Records are appended to a
+single file after a short header, so a store grows as results arrive and survives an
+interrupted run, and the whole file is read back as a memory-mapped numpy record array
+without parsing. The routes themselves, with their names and settings, are kept in a
+small JSON table beside the store and referred to from the records by number.
+
+Example:
+    store = ResultStore('runs.ggr')
+    route = store.add_route(route_key('London', 'Cambridge', 10), start = 'London', end = 'Cambridge', steps = 10)
+    store.append(route, graph.iter_green_between(10))
+    store.query(route = route)['green']
+"""
+
+import os
+import json
+import tempfile
+import numpy as np
+from typing import Iterable, Optional
+
+# The first bytes of every result store
+MAGIC = b'GGRESULT'
+
+# The layout of one step result, little-endian and without padding
+RECORD = np.dtype([
+    ('route', '<u4'),
+    ('step', '<u4'),
+    ('lat', '<f8'),
+    ('long', '<f8'),
+    ('zoom', '<u1'),
+    ('threshold', '<f4'),
+    ('green', '<i8'),
+])
+
+# The header holds the magic bytes, the format version and the record size
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u2'), ('record_size', '<u2'), ('reserved', 'V4')])
+VERSION = 1
+
+def route_key(start: str, end: str, steps: int, sampling: str = 'linear') -> str:
+    """
+    Return the key under which the results of a route run are stored.
+
+    Args:
+        start (str): The starting location.
+        end (str): The ending location.
+        steps (int): The number of intervals of the run.
+        sampling (str): How the intervals were placed. Default is 'linear'.
+
+    Returns:
+        str: A key identifying runs with the same route and intervals.
+    """
+    return f"{start} -> {end}, {steps} steps, {sampling}"
+
+class ResultStore(object):
+    """
+    An appendable, memory-mappable file of step results, with a table of the routes they belong to.
+
+    Attributes:
+        path (str): The file holding the records.
+        routes (list): A dictionary for each route, with its 'key' and any other metadata,
+            indexed by route number.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open a ResultStore, creating an empty store if the file does not exist.
+
+        Args:
+            path (str): The file holding the records. The route table is kept in the same file name with a .routes.json suffix.
+
+        Raises:
+            ValueError: If the file exists but is not a result store of this version.
+        """
+        self.path = path
+        self.routes = []
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            header = np.zeros((), dtype = HEADER)
+            header['magic'], header['version'], header['record_size'] = MAGIC, VERSION, RECORD.itemsize
+            with open(path, 'wb') as store:
+                store.write(header.tobytes())
+        else:
+            with open(path, 'rb') as store:
+                header = np.frombuffer(store.read(HEADER.itemsize), dtype = HEADER)
+            if (len(header) != 1 or header['magic'][0] != MAGIC or header['version'][0] != VERSION
+                    or header['record_size'][0] != RECORD.itemsize):
+                raise ValueError(f"{path} is not a version {VERSION} result store")
+
+            # Drop a partially written last record left by an interrupted run
+            size = os.path.getsize(path) - HEADER.itemsize
+            if size % RECORD.itemsize:
+                with open(path, 'r+b') as store:
+                    store.truncate(HEADER.itemsize + size - size % RECORD.itemsize)
+
+        if os.path.exists(self.routes_path):
+            with open(self.routes_path) as table:
+                self.routes = json.load(table)
+
+    @property
+    def routes_path(self) -> str:
+        """
+        str: The JSON file holding the route table.
+        """
+        return self.path + '.routes.json'
+
+    def __len__(self) -> int:
+        return (os.path.getsize(self.path) - HEADER.itemsize) // RECORD.itemsize
+
+    def add_route(self, key: str, **metadata) -> int:
+        """
+        Return the number of a route, adding it to the route table if it is new.
+
+        Args:
+            key (str): The unique name of the route.
+            **metadata: Further JSON-serializable details of the route, such as its start, end and steps.
+                They are only recorded when the route is added.
+
+        Returns:
+            int: The route number used in the records.
+        """
+        number = self.route_number(key)
+        if number is not None:
+            return number
+
+        self.routes.append(dict(metadata, key = key))
+
+        # Replace the table atomically, so that readers never see a partial file
+        directory = os.path.dirname(os.path.abspath(self.routes_path))
+        handle, temporary = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+        with os.fdopen(handle, 'w') as table:
+            json.dump(self.routes, table)
+        os.replace(temporary, self.routes_path)
+        return len(self.routes) - 1
+
+    def route_number(self, key: str) -> Optional[int]:
+        """
+        Return the number of a route.
+
+        Args:
+            key (str): The unique name of the route.
+
+        Returns:
+            int: The route number, or None if the route is not in the store.
+        """
+        for number, route in enumerate(self.routes):
+            if route['key'] == key:
+                return number
+        return None
+
+    def append(self, route: int, results: Iterable[tuple], zoom: int = 10, threshold: float = 1.1) -> int:
+        """
+        Append step results to the store.
+
+        Args:
+            route (int): The route number, as returned by add_route.
+            results (Iterable[tuple]): (index, latitude, longitude, green pixel count) tuples,
+                as yielded by Greengraph.iter_green_between.
+            zoom (int): The zoom level of the map images. Default is 10.
+            threshold (float): The greenness threshold of the counts. Default is 1.1.
+
+        Returns:
+            int: The number of records appended.
+        """
+        results = list(results)
+        records = np.zeros(len(results), dtype = RECORD)
+        if results:
+            steps, lats, longs, greens = zip(*results)
+            records['route'] = route
+            records['step'], records['lat'], records['long'], records['green'] = steps, lats, longs, greens
+            records['zoom'], records['threshold'] = zoom, threshold
+
+        with open(self.path, 'ab') as store:
+            store.write(records.tobytes())
+        return len(records)
+
+    def records(self) -> np.ndarray:
+        """
+        Return every record of the store, memory-mapped rather than read.
+
+        Returns:
+            np.ndarray: A read-only record array with the fields of RECORD.
+        """
+        count = len(self)
+        if not count:
+            return np.zeros(0, dtype = RECORD)
+        return np.memmap(self.path, dtype = RECORD, mode = 'r', offset = HEADER.itemsize, shape = (count,))
+
+    def query(self, route = None, steps = None, bounds = None, zoom: Optional[int] = None,
+              threshold: Optional[float] = None) -> np.ndarray:
+        """
+        Load the records matching every given condition.
+
+        Args:
+            route: A route number or key, or a sequence of them. Default is None, meaning every route.
+            steps: A range or sequence of step indices. Default is None, meaning every step.
+            bounds (tuple): A (south, west, north, east) box the records must lie in. Default is None.
+            zoom (int): The zoom level of the records. Default is None, meaning any zoom.
+            threshold (float): The greenness threshold of the records. Default is None, meaning any threshold.
+
+        Returns:
+            np.ndarray: A record array of the matching records, in the order they were appended.
+        """
+        records = self.records()
+        keep = np.ones(len(records), dtype = bool)
+
+        if route is not None:
+            routes = [route] if isinstance(route, (int, str, np.integer)) else list(route)
+            numbers = [self.route_number(number) if isinstance(number, str) else number for number in routes]
+            keep &= np.isin(records['route'], [number for number in numbers if number is not None])
+        if steps is not None:
+            keep &= np.isin(records['step'], np.asarray(list(steps), dtype = np.int64))
+        if bounds is not None:
+            south, west, north, east = bounds
+            keep &= (records['lat'] >= south) & (records['lat'] <= north)
+            keep &= (records['long'] >= west) & (records['long'] <= east)
+        if zoom is not None:
+            keep &= records['zoom'] == zoom
+        if threshold is not None:
+            keep &= np.isclose(records['threshold'], threshold)
+
+        return np.array(records[keep])
+
+    def green_between(self, route) -> np.ndarray:
+        """
+        Return the green pixel counts of a route in step order, as green_between would.
+
+        When a step was recorded more than once, the last record is used.
+
+        Args:
+            route: The route number or key.
+
+        Returns:
+            np.ndarray: The green pixel count of each recorded step.
+        """
+        records = self.query(route = route)
+        # A stable sort by step, keeping the last record of each step
+        records = records[np.argsort(records['step'], kind = 'stable')]
+        last = np.append(records['step'][1:] != records['step'][:-1], True) if len(records) else np.ones(0, dtype = bool)
+        return records['green'][last]
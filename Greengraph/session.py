@@ -0,0 +1,292 @@
+"""
+This module defines the MapSession class, the shared HTTP client through which the
+Map class fetches static map images.
+
+Compared with calling requests.get for every image, a MapSession:
+- Reuses pooled keep-alive connections across requests and threads.
+- Retries 429 and 5xx responses and connection errors with exponential backoff,
+  honouring any Retry-After header up to a limit, beyond which the request fails.
+- Limits the request rate with a token bucket shared by every thread.
+- Applies connect and read timeouts to every request.
+- Raises FetchError for a request that ultimately fails, instead of returning bad data.
+
+The retry, backoff and rate limiting policy is defined by the RetryPolicy class, which
+AsyncMapSession shares, so that both sessions treat a server in the same way.
+"""
+
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from Greengraph import profiling
+from typing import Optional, Tuple
+
+# Response status codes for which a request is retried
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# The longest Retry-After delay in seconds that a request waits for before failing instead
+MAX_RETRY_AFTER = 60.0
+
+class FetchError(Exception):
+    """
+    Raised when a map image cannot be fetched or decoded.
+    """
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket rate limiter.
+
+    Attributes:
+        rate (float): The number of tokens added per second.
+        capacity (float): The maximum number of tokens, which bounds the size of bursts.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Initialize a full TokenBucket object.
+
+        Args:
+            rate (float): The number of tokens added per second.
+            capacity (float): The maximum number of tokens. Defaults to the rate, allowing one second of burst.
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Take one token, waiting until one is available.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self) -> float:
+        """
+        Take one token without waiting, for callers that wait in their own way, such as in an event loop.
+
+        Returns:
+            float: The number of seconds the caller must wait before using the token.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve the token now, so that concurrent callers queue behind each other
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+class RetryPolicy(object):
+    """
+    How requests are retried and rate limited, shared by MapSession and AsyncMapSession.
+
+    429 and 5xx responses and connection errors are retried with exponential backoff,
+    waiting for at least any Retry-After delay up to max_retry_after. Other error
+    statuses, empty responses and longer Retry-After delays fail at once.
+
+    Attributes:
+        retries (int): The number of times a failed request is retried.
+        backoff (float): The delay before the first retry in seconds, doubled for each further retry.
+        limiter (TokenBucket): The rate limiter, or None if requests are not rate limited.
+        max_retry_after (float): The longest Retry-After delay in seconds that is waited for.
+    """
+
+    def __init__(self, retries: int = 3, backoff: float = 0.5, rate: Optional[float] = None,
+                 burst: Optional[float] = None, max_retry_after: float = MAX_RETRY_AFTER):
+        """
+        Initialize a RetryPolicy object.
+
+        Args:
+            retries (int): The number of times a failed request is retried. Default is 3.
+            backoff (float): The delay before the first retry in seconds. Default is 0.5.
+            rate (float): Optional maximum number of requests per second. Default is None, meaning unlimited.
+            burst (float): The number of requests allowed in a burst when rate limited. Defaults to the rate.
+            max_retry_after (float): The longest Retry-After delay in seconds that is waited for. A response
+                asking for a longer delay fails the request. Default is MAX_RETRY_AFTER.
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = TokenBucket(rate, burst) if rate else None
+        self.max_retry_after = max_retry_after
+
+    def check(self, url: str, attempt: int, status: int, content: bytes, headers) -> Tuple[Optional[str], float]:
+        """
+        Decide whether a response is usable, is to be retried, or fails the request.
+
+        Args:
+            url (str): The URL requested.
+            attempt (int): The number of the attempt, from 0.
+            status (int): The status code of the response.
+            content (bytes): The content of the response.
+            headers: The headers of the response.
+
+        Returns:
+            Tuple[Optional[str], float]: None and 0 for a usable response, and otherwise a description
+                of the failure and the delay in seconds before retrying.
+
+        Raises:
+            FetchError: If the response has a non-retryable status, no content, or asks to be
+                retried after more than max_retry_after seconds.
+        """
+        profiling.count('http.bytes', len(content))
+        if status == 200:
+            if not content:
+                raise FetchError(f"Empty response from {url}")
+            return None, 0.0
+
+        failure = f"HTTP status {status}"
+        if status not in RETRY_STATUSES:
+            raise FetchError(f"Request to {url} failed with {failure}")
+        retry_after = _retry_after(headers)
+        if retry_after > self.max_retry_after:
+            raise FetchError(f"Request to {url} failed with {failure}, asking to retry after "
+                             f"{retry_after:g} s, more than the {self.max_retry_after:g} s allowed")
+        return failure, max(self.delay(attempt), retry_after)
+
+    def delay(self, attempt: int) -> float:
+        """
+        Return the backoff delay before retrying an attempt.
+
+        Args:
+            attempt (int): The number of the failed attempt, from 0.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        return self.backoff * 2 ** attempt
+
+    def start(self, attempt: int) -> float:
+        """
+        Count an attempt and take a token from the rate limiter, without waiting for it.
+
+        Args:
+            attempt (int): The number of the attempt, from 0.
+
+        Returns:
+            float: The number of seconds to wait before making the request.
+        """
+        wait = self.limiter.reserve() if self.limiter else 0.0
+        if self.limiter:
+            profiling.count('http.rate_limit_wait', wait)
+        if attempt:
+            profiling.count('http.retries')
+        profiling.count('http.requests')
+        return wait
+
+    def exhausted(self, url: str, failure: str) -> FetchError:
+        """
+        Return the error for a request that failed on every attempt.
+
+        Args:
+            url (str): The URL requested.
+            failure (str): A description of the last failure.
+
+        Returns:
+            FetchError: The error to raise.
+        """
+        return FetchError(f"Request to {url} failed after {self.retries + 1} attempts, last with {failure}")
+
+class MapSession(RetryPolicy):
+    """
+    A pooled HTTP session with retries, backoff, rate limiting and timeouts.
+
+    Attributes:
+        retries (int): The number of times a failed request is retried.
+        backoff (float): The delay before the first retry in seconds, doubled for each further retry.
+        timeout (Tuple[float, float]): The connect and read timeouts of each request in seconds.
+        limiter (TokenBucket): The rate limiter, or None if requests are not rate limited.
+        max_retry_after (float): The longest Retry-After delay in seconds that is waited for.
+    """
+
+    def __init__(self, pool_size: int = 16, retries: int = 3, backoff: float = 0.5, rate: Optional[float] = None,
+                 burst: Optional[float] = None, timeout: Tuple[float, float] = (5.0, 30.0),
+                 max_retry_after: float = MAX_RETRY_AFTER):
+        """
+        Initialize a MapSession object.
+
+        Args:
+            pool_size (int): The number of connections kept alive per host. Default is 16.
+            retries (int): The number of times a failed request is retried. Default is 3.
+            backoff (float): The delay before the first retry in seconds. Default is 0.5.
+            rate (float): Optional maximum number of requests per second. Default is None, meaning unlimited.
+            burst (float): The number of requests allowed in a burst when rate limited. Defaults to the rate.
+            timeout (Tuple[float, float]): The connect and read timeouts in seconds. Default is (5, 30).
+            max_retry_after (float): The longest Retry-After delay in seconds that is waited for. A response
+                asking for a longer delay fails the request. Default is MAX_RETRY_AFTER.
+        """
+        super().__init__(retries, backoff, rate, burst, max_retry_after)
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url: str, params: dict) -> bytes:
+        """
+        Fetch the content of a URL, retrying transient failures.
+
+        Args:
+            url (str): The URL to fetch.
+            params (dict): The query parameters of the request.
+
+        Returns:
+            bytes: The content of the response.
+
+        Raises:
+            FetchError: If the request fails with a non-retryable status, returns no content,
+                asks to be retried after more than max_retry_after seconds, or still fails after every retry.
+        """
+        for attempt in range(self.retries + 1):
+            wait = self.start(attempt)
+            if wait > 0:
+                time.sleep(wait)
+
+            try:
+                response = self.session.get(url, params = params, timeout = self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                failure, delay = f"{type(error).__name__}: {error}", self.delay(attempt)
+            else:
+                failure, delay = self.check(url, attempt, response.status_code, response.content, response.headers)
+                if failure is None:
+                    return response.content
+
+            if attempt < self.retries:
+                time.sleep(delay)
+
+        raise self.exhausted(url, failure)
+
+    def close(self) -> None:
+        """
+        Close the pooled connections.
+        """
+        self.session.close()
+
+_default_session = None
+_default_lock = threading.Lock()
+
+def default_session() -> MapSession:
+    """
+    Return the MapSession shared by every Map that has no session of its own.
+
+    Returns:
+        MapSession: The default session, created on first use.
+    """
+    global _default_session
+    with _default_lock:
+        if _default_session is None:
+            _default_session = MapSession()
+        return _default_session
+
+def _retry_after(headers) -> float:
+    try:
+        return float(headers.get("Retry-After", 0))
+    except ValueError:
+        # Retry-After may also be an HTTP date, in which case the backoff delay is used
+        return 0.0
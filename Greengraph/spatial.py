@@ -0,0 +1,145 @@
+"""
+This module defines the TileIndex class, a spatial index of the map images already
+fetched, so that nearby sample points can share one image and its green pixel count.
+
+A map request is identified by its exact centre, so sample points of different routes
+a few metres apart would otherwise be fetched as distinct images. A TileIndex projects
+each centre to global Web Mercator pixels at the zoom of the images and snaps it to a
+grid whose cells are as wide as the tolerance. A new centre within the tolerance of an
+indexed one, which can only lie in the same or a neighbouring cell, is answered by the
+indexed tile instead of a new request.
+
+Example:
+    index = TileIndex(zoom = 10, tolerance = 2)
+    centre = index.snap((51.5073, -0.1277))
+    index.put(centre, 1200)
+    index.get((51.5074, -0.1278))    # 1200, less than two pixels away
+"""
+
+import math
+import threading
+from Greengraph import geo
+from typing import Optional
+
+class TileIndex(object):
+    """
+    A thread-safe grid index of map image centres and the values known for them.
+
+    Attributes:
+        zoom (int): The zoom level of the map images, which sets the size of a pixel.
+        tolerance (float): The distance in pixels within which two centres share a tile.
+    """
+
+    def __init__(self, zoom: int = 10, tolerance: float = 2.0):
+        """
+        Initialize an empty TileIndex object.
+
+        Args:
+            zoom (int): The zoom level of the map images. Default is 10.
+            tolerance (float): The distance in pixels within which two centres share a tile.
+                Default is 2, which moves a 400x400 image by under one percent of its width.
+
+        Raises:
+            ValueError: If the tolerance is not positive.
+        """
+        if tolerance <= 0:
+            raise ValueError("The tolerance must be positive")
+        self.zoom = zoom
+        self.tolerance = tolerance
+
+        # Each grid cell holds [x, y, centre, value] entries for the centres inside it
+        self._cells = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def nearest(self, location: tuple) -> Optional[tuple]:
+        """
+        Return the indexed centre nearest to a location, if it is within the tolerance.
+
+        Args:
+            location (tuple): The (latitude, longitude) of a map centre.
+
+        Returns:
+            tuple: The indexed (latitude, longitude) centre, or None if there is none within the tolerance.
+        """
+        with self._lock:
+            entry = self._nearest(*self._pixels(location))
+        return entry[2] if entry is not None else None
+
+    def snap(self, location: tuple) -> tuple:
+        """
+        Return the centre of the tile to use for a location, indexing the location if it is new.
+
+        Args:
+            location (tuple): The (latitude, longitude) of a map centre.
+
+        Returns:
+            tuple: The indexed centre within the tolerance of the location, or the location itself.
+        """
+        location = tuple(map(float, location))
+        with self._lock:
+            return self._entry(location)[2]
+
+    def get(self, location: tuple, default = None):
+        """
+        Return the value known for the tile nearest to a location.
+
+        Args:
+            location (tuple): The (latitude, longitude) of a map centre.
+            default: The value returned when no tile within the tolerance has a value. Default is None.
+
+        Returns:
+            The value of the nearest indexed tile, such as its green pixel count, or the default.
+        """
+        with self._lock:
+            entry = self._nearest(*self._pixels(location))
+        if entry is None or entry[3] is None:
+            return default
+        return entry[3]
+
+    def put(self, location: tuple, value) -> tuple:
+        """
+        Record the value of the tile nearest to a location, indexing the location if it is new.
+
+        Args:
+            location (tuple): The (latitude, longitude) of a map centre.
+            value: The value of the tile, such as its green pixel count.
+
+        Returns:
+            tuple: The indexed centre to which the value was given.
+        """
+        location = tuple(map(float, location))
+        with self._lock:
+            entry = self._entry(location)
+            entry[3] = value
+        return entry[2]
+
+    def _pixels(self, location: tuple) -> tuple:
+        x, y = geo.to_pixels(location[0], location[1], self.zoom)
+        return float(x), float(y)
+
+    def _cell(self, x: float, y: float) -> tuple:
+        return math.floor(x / self.tolerance), math.floor(y / self.tolerance)
+
+    def _nearest(self, x: float, y: float) -> Optional[list]:
+        # A centre within the tolerance lies in the same cell or one of its eight neighbours
+        column, row = self._cell(x, y)
+        best, best_distance = None, self.tolerance
+        for neighbour in ((column + i, row + j) for i in (-1, 0, 1) for j in (-1, 0, 1)):
+            for entry in self._cells.get(neighbour, ()):
+                distance = math.hypot(entry[0] - x, entry[1] - y)
+                if distance <= best_distance:
+                    best, best_distance = entry, distance
+        return best
+
+    def _entry(self, location: tuple) -> list:
+        x, y = self._pixels(location)
+        entry = self._nearest(x, y)
+        if entry is None:
+            entry = [x, y, location, None]
+            self._cells.setdefault(self._cell(x, y), []).append(entry)
+            self._size += 1
+        return entry
@@ -0,0 +1,223 @@
+"""
+Unit tests for the AsyncGreengraph class in the aio.py module.
+
+This module includes tests to validate the following functionality:
+- The async green_between gives exactly the counts of the synchronous Greengraph.green_between.
+- Map images are fetched through the async session, at most `concurrency` at once.
+- Without a session, fetching runs in the executor, and failures are raised as FetchError.
+- A session created by AsyncGreengraph is closed after each run, and new geocoding results are saved.
+- AsyncMapSession retries like MapSession: transient statuses are retried after the backoff or
+  Retry-After delay, while non-retryable statuses, empty bodies and too long Retry-After delays fail.
+"""
+
+from Greengraph.aio import AsyncGreengraph, AsyncMapSession
+from Greengraph.graph import Greengraph
+from Greengraph.session import FetchError, MapSession
+from Greengraph.geocode import GeocodeCache
+from Greengraph.decode import encode_png
+
+import asyncio
+import numpy as np
+
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
+
+PLACES = {'London': (51.5, -0.13), 'Cambridge': (52.2, 0.12)}
+
+def render(url: str, params: dict) -> bytes:
+    """
+    Render a 10x10 image whose number of green pixels depends on the longitude of its centre.
+    """
+    long = float(params['center'].split(',')[1])
+    pixels = np.full((100, 3), 120, dtype = np.uint8)
+    pixels[:int(abs(long) * 200) % 100] = [20, 200, 20]
+    return encode_png(pixels.reshape(10, 10, 3))
+
+class FakeSession(object):
+    """
+    An async session rendering images, which records how many requests overlap.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.requests = 0
+
+    async def get(self, url: str, params: dict) -> bytes:
+        self.active += 1
+        self.requests += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.001)
+        self.active -= 1
+        return render(url, params)
+
+class FakeResponse(object):
+    """
+    An aiohttp response with a scripted status, body and headers.
+    """
+
+    def __init__(self, status: int, body: bytes, headers: dict):
+        self.status = status
+        self.body = body
+        self.headers = headers
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def read(self) -> bytes:
+        return self.body
+
+class FakeClientSession(object):
+    """
+    An aiohttp client session answering requests with scripted (status, body, headers) responses,
+    or by rendering the image requested once the script is exhausted. Every session is recorded.
+    """
+
+    responses = []
+    sessions = []
+
+    def __init__(self, **kwargs):
+        self.requests = 0
+        self.closed = False
+        self.sessions.append(self)
+
+    def get(self, url: str, params: dict) -> FakeResponse:
+        self.requests += 1
+        if not self.responses:
+            return FakeResponse(200, render(url, params), {})
+        return FakeResponse(*self.responses.pop(0))
+
+    async def close(self) -> None:
+        self.closed = True
+
+FAKE_AIOHTTP = SimpleNamespace(ClientSession = FakeClientSession, TCPConnector = Mock(), ClientTimeout = Mock(),
+                               ClientError = type('ClientError', (Exception,), {}))
+
+@patch('Greengraph.aio.aiohttp', FAKE_AIOHTTP)
+@patch('Greengraph.aio.asyncio.sleep', new_callable = AsyncMock)
+class TestAsyncMapSession(unittest.TestCase):
+    """
+    Unit tests for the `AsyncMapSession` class. aiohttp and the delays are mocked.
+    """
+
+    def fetch(self, responses, **kwargs):
+        """
+        Fetch a URL through an AsyncMapSession answering with the given responses.
+        """
+        FakeClientSession.responses = list(responses)
+        session = AsyncMapSession(**kwargs)
+        try:
+            return asyncio.run(session.get('http://maps', {}))
+        finally:
+            self.requests = session._session.requests
+
+    def test_retry(self, mock_sleep):
+        """
+        Test that transient statuses are retried after the backoff, or the longer Retry-After delay.
+        """
+        content = self.fetch([(503, b'', {}), (429, b'', {'Retry-After': '5'}), (200, b'image', {})], backoff = 0.5)
+        self.assertEqual(content, b'image')
+        self.assertEqual(self.requests, 3)
+        self.assertEqual([call.args[0] for call in mock_sleep.await_args_list], [0.5, 5.0])
+
+    def test_failures(self, mock_sleep):
+        """
+        Test that non-retryable statuses, empty bodies and too long Retry-After delays fail at once,
+        and that a request failing on every attempt is raised as FetchError.
+        """
+        for response in [(403, b'denied', {}), (200, b'', {}), (503, b'', {'Retry-After': '120'})]:
+            with self.assertRaises(FetchError):
+                self.fetch([response], max_retry_after = 60)
+            self.assertEqual(self.requests, 1)
+        mock_sleep.assert_not_awaited()
+
+        with self.assertRaisesRegex(FetchError, 'after 3 attempts'):
+            self.fetch([(500, b'', {})] * 3, retries = 2)
+        self.assertEqual(self.requests, 3)
+
+    def test_rate_limit(self, mock_sleep):
+        """
+        Test that requests beyond the burst wait for the rate limiter without blocking the loop.
+        """
+        FakeClientSession.responses = [(200, b'image', {})] * 2
+        session = AsyncMapSession(rate = 10, burst = 1)
+        asyncio.run(session.get('http://maps', {}))
+        mock_sleep.assert_not_awaited()
+        asyncio.run(session.get('http://maps', {}))
+        self.assertAlmostEqual(mock_sleep.await_args.args[0], 0.1, places = 2)
+
+class TestAsyncGreengraph(unittest.TestCase):
+    """
+    Unit tests for the `AsyncGreengraph` class. The geocoder and the map images are mocked.
+    """
+
+    def setUp(self):
+        self.geocoder = Mock()
+        self.geocoder.geocode.side_effect = lambda place, exactly_one: (place, PLACES[place]) if place in PLACES else None
+
+    @patch.object(MapSession, 'get', side_effect = render)
+    def test_green_between(self, mock_get):
+        """
+        Test that the async counts through a session match the synchronous API exactly,
+        with no more than `concurrency` images fetched at once.
+        """
+        expected = Greengraph('London', 'Cambridge', self.geocoder).green_between(12, workers = 3)
+        session = FakeSession()
+
+        async def run():
+            async with AsyncGreengraph('London', 'Cambridge', self.geocoder, concurrency = 3, session = session) as graph:
+                return await graph.green_between(12)
+
+        self.assertEqual(asyncio.run(run()), expected)
+        self.assertEqual(session.requests, 12)
+        self.assertLessEqual(session.peak, 3)
+        self.assertGreater(len(set(expected)), 1)
+
+    @patch('Greengraph.aio.aiohttp', FAKE_AIOHTTP)
+    @patch.object(MapSession, 'get', side_effect = render)
+    @patch.object(GeocodeCache, 'save')
+    def test_owned_session(self, mock_save, mock_get):
+        """
+        Test that a plain await of green_between closes the session AsyncGreengraph created for it,
+        and that the geocoding results of the endpoints are saved to the geocode cache.
+        """
+        FakeClientSession.responses, FakeClientSession.sessions = [], []
+        graph = AsyncGreengraph('London', 'Cambridge', self.geocoder, geocache = GeocodeCache(), concurrency = 3)
+
+        counts = asyncio.run(graph.green_between(6))
+        self.assertEqual(counts, Greengraph('London', 'Cambridge', self.geocoder).green_between(6))
+        self.assertEqual([session.requests for session in FakeClientSession.sessions], [6])
+        self.assertTrue(FakeClientSession.sessions[0].closed)
+        self.assertIsNone(graph.session._session)
+        self.assertTrue(mock_save.called)
+
+        # The session is opened again for the next run, and closed after it
+        asyncio.run(graph.green_between(2))
+        self.assertEqual(len(FakeClientSession.sessions), 2)
+        self.assertTrue(FakeClientSession.sessions[1].closed)
+
+    @patch('Greengraph.aio.aiohttp', None)
+    @patch.object(MapSession, 'get')
+    def test_executor_fallback(self, mock_get):
+        """
+        Test that without aiohttp the images are fetched in the executor, that unknown places give
+        no counts, and that a failed image is raised as FetchError.
+        """
+        mock_get.side_effect = render
+        graph = AsyncGreengraph('London', 'Cambridge', self.geocoder, concurrency = 2)
+        self.assertIsNone(graph.session)
+
+        counts = asyncio.run(graph.green_between(5, sampling = 'geodesic'))
+        self.assertEqual(counts, Greengraph('London', 'Cambridge', self.geocoder).green_between(5, sampling = 'geodesic'))
+        self.assertEqual(asyncio.run(AsyncGreengraph('London', 'Atlantis', self.geocoder).green_between(5)), [])
+
+        mock_get.side_effect = lambda url, params: b'not an image'
+        with self.assertRaises(FetchError):
+            asyncio.run(graph.green_between(5))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+Unit tests for the Archive class in the archive.py module.
+
+This module includes tests to validate the following functionality:
+- Map images recorded during a run are replayed without any request, with identical counts.
+- Geocoding results, including places that were not found, are recorded and replayed.
+- Anything missing from an archive being replayed is an error rather than a request.
+- A partially written last record is dropped, and files that are not archives are refused.
+- The command line records a run with --record and reproduces it offline with --replay.
+"""
+
+from Greengraph.archive import Archive, HEADER, RECORD
+from Greengraph.graph import Greengraph
+from Greengraph.map import Map
+from Greengraph.session import FetchError, MapSession
+from Greengraph.decode import encode_png
+from Greengraph.command import parser, green_plotter
+
+import os
+import json
+import numpy as np
+import tempfile
+
+import unittest
+from unittest.mock import Mock, patch
+
+PLACES = {'London': (51.5, -0.13), 'Cambridge': (52.2, 0.12)}
+
+def render(url: str, params: dict) -> bytes:
+    """
+    Render a 10x10 image whose number of green pixels depends on the longitude of its centre.
+    """
+    long = float(params['center'].split(',')[1])
+    pixels = np.full((100, 3), 120, dtype = np.uint8)
+    pixels[:int(abs(long) * 200) % 100] = [20, 200, 20]
+    return encode_png(pixels.reshape(10, 10, 3))
+
+class TestArchive(unittest.TestCase):
+    """
+    Unit tests for the `Archive` class. The map images and the geocoder are mocked.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'run.gga')
+
+        self.geocoder = Mock()
+        self.geocoder.geocode.side_effect = lambda place, exactly_one: (place, PLACES[place]) if place in PLACES else None
+
+        archive = Map.archive
+        self.addCleanup(setattr, Map, 'archive', archive)
+
+    @patch.object(MapSession, 'get', side_effect = render)
+    def test_record_and_replay(self, mock_get):
+        """
+        Test that a replayed run gives the counts of the recorded run without any request.
+        """
+        with Archive(self.path, record = True) as archive:
+            Map.archive = archive
+            recorded = Greengraph('London', 'Cambridge', archive.geocoder(self.geocoder)).green_between(6, workers = 3)
+            self.assertEqual(len(archive), 8)
+        self.assertEqual(mock_get.call_count, 6)
+
+        mock_get.side_effect = FetchError('offline')
+        with Archive(self.path) as archive:
+            Map.archive = archive
+            replayed = Greengraph('London', 'Cambridge', archive.geocoder()).green_between(6, workers = 3)
+
+            self.assertEqual(replayed, recorded)
+            self.assertEqual(mock_get.call_count, 6)
+            with self.assertRaises(FetchError):
+                Greengraph('London', 'Cambridge', archive.geocoder()).green_between(7)
+            with self.assertRaises(FetchError):
+                Greengraph('London', 'Oxford', archive.geocoder()).green_between(6)
+            with self.assertRaises(ValueError):
+                archive.put_tile('key', b'image')
+
+    def test_geocode(self):
+        """
+        Test that geocoding results, including places not found, are recorded once and replayed.
+        """
+        with Archive(self.path, record = True) as archive:
+            geocoder = archive.geocoder(self.geocoder)
+            self.assertEqual(geocoder.geocode('London')[1], (51.5, -0.13))
+            self.assertIsNone(geocoder.geocode('Atlantis'))
+            self.assertEqual(geocoder.geocode('london ')[1], (51.5, -0.13))
+        self.assertEqual(self.geocoder.geocode.call_count, 2)
+
+        with Archive(self.path) as archive:
+            self.assertEqual(archive.geocode('LONDON'), ('London', (51.5, -0.13)))
+            self.assertIsNone(archive.geocode('Atlantis'))
+            with self.assertRaises(KeyError):
+                archive.geocode('Cambridge')
+
+    def test_partial_record(self):
+        """
+        Test that a partially written last record is dropped when recording resumes,
+        and that other files are refused.
+        """
+        with Archive(self.path, record = True) as archive:
+            archive.put_tile('first', b'image one')
+            archive.put_tile('second', b'image two')
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as archive:
+            archive.write(RECORD.pack(b'T', 5, 100) + b'third' + b'partial')
+
+        self.assertEqual(len(Archive(self.path)), 2)
+        with Archive(self.path, record = True) as archive:
+            self.assertEqual(os.path.getsize(self.path), size)
+            archive.put_tile('third', b'image three')
+            self.assertEqual(archive.tile('third'), b'image three')
+            self.assertEqual(archive.tile('first'), b'image one')
+            self.assertIsNone(archive.tile('fourth'))
+        self.assertEqual(os.path.getsize(self.path), HEADER.size + 3 * RECORD.size + 16 + 29)
+
+        other = os.path.join(self.directory.name, 'other.gga')
+        with open(other, 'w') as text:
+            text.write('not an archive at all')
+        with self.assertRaises(ValueError):
+            Archive(other)
+        with self.assertRaises(FileNotFoundError):
+            Archive(os.path.join(self.directory.name, 'missing.gga'))
+
+    @patch('Greengraph.command.default_geocoder')
+    @patch.object(MapSession, 'get', side_effect = render)
+    def test_command_line(self, mock_get, mock_default_geocoder):
+        """
+        Test that a run recorded with --record is reproduced by --replay without network I/O.
+        """
+        mock_default_geocoder.return_value = self.geocoder
+        output = os.path.join(self.directory.name, 'route')
+
+        green_plotter(parser.parse_args(['--steps', '4', '--out', output, '--headless', '--format', 'json',
+                                         '--record', self.path]))
+        with open(output + '.json') as result:
+            recorded = json.load(result)['green']
+        Map.archive.close()
+
+        mock_get.side_effect = FetchError('offline')
+        green_plotter(parser.parse_args(['--steps', '4', '--out', output, '--headless', '--format', 'json',
+                                         '--replay', self.path]))
+        with open(output + '.json') as result:
+            self.assertEqual(json.load(result)['green'], recorded)
+        Map.archive.close()
+
+        self.assertEqual(mock_get.call_count, 4)
+        self.assertEqual(mock_default_geocoder.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
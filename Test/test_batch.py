@@ -0,0 +1,209 @@
+"""
+Unit tests for the batch.py module, which analyses many routes at once.
+
+This module includes tests to validate the following functionality:
+- Reading routes from CSV and JSONL files.
+- Geocoding each distinct place and counting each distinct sample point only once per batch.
+- Streaming one result row per route, in route order, to CSV and JSONL files.
+- Routes whose places cannot be geocoded, or whose lookups fail, are reported with an error.
+- Classifying in worker processes gives the same rows as classifying in threads.
+- Nearby sample points share one tile through a TileIndex, also across batches.
+"""
+
+from Greengraph import batch
+from Greengraph.spatial import TileIndex
+from Greengraph.session import FetchError, MapSession
+from Greengraph.decode import encode_png
+
+import os
+import csv
+import json
+import numpy as np
+import tempfile
+
+import unittest
+from unittest.mock import Mock, patch
+
+PLACES = {'London': (0.0, 0.0), 'Cambridge': (0.0, 3.0), 'Oxford': (0.0, -3.0), 'Cambridge Station': (0.0, 3.0003)}
+
+class TestBatch(unittest.TestCase):
+    """
+    Unit tests for reading, running and writing batches of routes. The geocoder and
+    the map fetching are mocked, and each sample point reports its longitude as its
+    green pixel count.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        self.geocoder = Mock()
+        self.geocoder.geocode.side_effect = lambda place, exactly_one: (place, PLACES[place]) if place in PLACES else None
+
+    def write(self, name: str, content: str) -> str:
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as routes:
+            routes.write(content)
+        return path
+
+    def test_read_routes(self):
+        """
+        Test that CSV and JSONL route files give the same routes, with default ids and steps.
+        """
+        csv_path = self.write('routes.csv', 'from,to,steps\nLondon,Cambridge,4\nLondon,Oxford,\n')
+        jsonl_path = self.write('routes.jsonl', '{"from": "London", "to": "Cambridge", "steps": 4}\n'
+                                                '{"start": "London", "end": "Oxford"}\n')
+
+        expected = [{'id': '0', 'from': 'London', 'to': 'Cambridge', 'steps': 4},
+                    {'id': '1', 'from': 'London', 'to': 'Oxford', 'steps': 10}]
+
+        self.assertEqual(batch.read_routes(csv_path), expected)
+        self.assertEqual(batch.read_routes(jsonl_path), expected)
+
+    @patch('Greengraph.graph.count_location')
+    def test_run_batch_jsonl(self, mock_count_location):
+        """
+        Test that a JSONL batch writes one row per route in order, geocodes each place once,
+        counts each shared sample point once, and reports unknown places as errors.
+        """
+        mock_count_location.side_effect = lambda location: location[1]
+
+        routes = [{'id': 'a', 'from': 'London', 'to': 'Cambridge', 'steps': 4},
+                  {'id': 'b', 'from': 'London', 'to': 'Oxford', 'steps': 4},
+                  {'id': 'c', 'from': 'London', 'to': 'Atlantis', 'steps': 4}]
+        output = os.path.join(self.directory.name, 'results.jsonl')
+
+        rows = batch.run_batch(routes, output, geocoder = self.geocoder, workers = 4)
+
+        with open(output) as results:
+            results = [json.loads(line) for line in results]
+
+        self.assertEqual(rows, 3)
+        self.assertEqual([result['id'] for result in results], ['a', 'b', 'c'])
+        self.assertEqual(results[0]['green'], [0, 1, 2, 3])
+        self.assertEqual(results[1]['green'], [0, -1, -2, -3])
+        self.assertIsNone(results[2]['green'])
+        self.assertEqual(results[2]['error'], "Could not geocode 'Atlantis'")
+        self.assertEqual([result['error'] for result in results[:2]], [None, None])
+
+        # London is shared by every route, and its sample point by the first two
+        self.assertEqual(self.geocoder.geocode.call_count, 4)
+        self.assertEqual(mock_count_location.call_count, 7)
+
+    @patch('Greengraph.graph.count_location')
+    def test_run_batch_csv(self, mock_count_location):
+        """
+        Test that a CSV batch writes a header and the green counts separated by spaces.
+        """
+        mock_count_location.side_effect = lambda location: location[1]
+
+        routes = [{'id': 'a', 'from': 'London', 'to': 'Cambridge', 'steps': 2}]
+        output = os.path.join(self.directory.name, 'results.csv')
+
+        batch.run_batch(routes, output, geocoder = self.geocoder)
+
+        with open(output, newline = '') as results:
+            results = list(csv.DictReader(results))
+
+        self.assertEqual(results, [{'id': 'a', 'from': 'London', 'to': 'Cambridge', 'steps': '2', 'green': '0 3', 'error': ''}])
+
+    @patch('Greengraph.graph.count_location')
+    def test_geocode_error(self, mock_count_location):
+        """
+        Test that a failing geocoder lookup fails only the routes using that place, which are
+        written with the error and kept out of the result store.
+        """
+        mock_count_location.side_effect = lambda location: location[1]
+        def geocode(place, exactly_one):
+            if place == 'Oxford':
+                raise ValueError('service unavailable')
+            return (place, PLACES[place]) if place in PLACES else None
+        self.geocoder.geocode.side_effect = geocode
+
+        routes = [{'id': 'a', 'from': 'London', 'to': 'Oxford', 'steps': 2},
+                  {'id': 'b', 'from': 'London', 'to': 'Cambridge', 'steps': 2},
+                  {'id': 'c', 'from': 'Nowhere', 'to': 'London', 'steps': 3}]
+        output = os.path.join(self.directory.name, 'results.csv')
+        store = Mock()
+
+        self.assertEqual(batch.run_batch(routes, output, geocoder = self.geocoder, store = store), 3)
+        with open(output, newline = '') as results:
+            results = list(csv.DictReader(results))
+
+        self.assertEqual(results[0]['error'], "Could not geocode 'Oxford': ValueError: service unavailable")
+        self.assertEqual(results[1]['green'], '0 3')
+        self.assertEqual(results[2], {'id': 'c', 'from': 'Nowhere', 'to': 'London', 'steps': '3', 'green': '',
+                                      'error': "Could not geocode 'Nowhere'"})
+        self.assertEqual(store.add_route.call_count, 1)
+
+    @patch('Greengraph.graph.count_location')
+    def test_fetch_error(self, mock_count_location):
+        """
+        Test that a route with an image that cannot be fetched is marked with the error,
+        while the other routes are still analysed.
+        """
+        def count_location(location):
+            if location[1] < 0:
+                raise FetchError('HTTP status 403')
+            return location[1]
+        mock_count_location.side_effect = count_location
+
+        routes = [{'id': 'a', 'from': 'London', 'to': 'Oxford', 'steps': 2},
+                  {'id': 'b', 'from': 'London', 'to': 'Cambridge', 'steps': 2}]
+
+        results = list(batch.iter_batch(routes, geocoder = self.geocoder))
+
+        self.assertIsNone(results[0]['green'])
+        self.assertEqual(results[0]['error'], 'HTTP status 403')
+        self.assertEqual(results[1]['green'], [0, 3])
+        self.assertIsNone(results[1]['error'])
+
+    @patch('Greengraph.graph.count_location')
+    def test_tile_index(self, mock_count_location):
+        """
+        Test that sample points within the tolerance of another route's points share their counts,
+        and that a later batch reuses the counts kept in the index without fetching.
+        """
+        mock_count_location.side_effect = lambda location: location[1]
+        routes = [{'id': 'a', 'from': 'London', 'to': 'Cambridge', 'steps': 4},
+                  {'id': 'b', 'from': 'London', 'to': 'Cambridge Station', 'steps': 4}]
+        index = TileIndex(zoom = 10, tolerance = 2)
+
+        results = list(batch.iter_batch(routes, geocoder = self.geocoder, tile_index = index))
+
+        self.assertEqual(results[0]['green'], [0, 1, 2, 3])
+        self.assertEqual(results[1]['green'], [0, 1, 2, 3])
+        self.assertEqual(mock_count_location.call_count, 4)
+
+        results = list(batch.iter_batch(routes[1:], geocoder = self.geocoder, tile_index = index))
+        self.assertEqual(results[0]['green'], [0, 1, 2, 3])
+        self.assertEqual(mock_count_location.call_count, 4)
+
+    @patch.object(MapSession, 'get')
+    def test_processes(self, mock_get):
+        """
+        Test that classifying in worker processes gives the same rows, in the same order, as
+        classifying in threads, including the rows of routes with failed images.
+        """
+        def get(url, params):
+            long = float(params['center'].split(',')[1])
+            if long < 0:
+                raise FetchError('HTTP status 403')
+            pixels = np.full((4, 4, 3), 120, dtype = np.uint8)
+            pixels[0, :int(long)] = [20, 200, 20]
+            return encode_png(pixels)
+        mock_get.side_effect = get
+
+        routes = [{'id': 'a', 'from': 'London', 'to': 'Cambridge', 'steps': 4},
+                  {'id': 'b', 'from': 'London', 'to': 'Oxford', 'steps': 2},
+                  {'id': 'c', 'from': 'Cambridge', 'to': 'London', 'steps': 3}]
+
+        threaded = list(batch.iter_batch(routes, geocoder = self.geocoder))
+        processed = list(batch.iter_batch(routes, geocoder = self.geocoder, processes = 2))
+
+        self.assertEqual(processed, threaded)
+        self.assertEqual(processed[0]['green'], [0, 1, 2, 3])
+        self.assertEqual(processed[1]['error'], 'HTTP status 403')
+
+if __name__ == '__main__':
+    unittest.main()
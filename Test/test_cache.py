@@ -0,0 +1,152 @@
+"""
+Unit tests for the `TileCache` class in the cache.py module.
+
+This module includes tests to validate the following functionality:
+- Storing and retrieving images keyed on normalized request parameters.
+- Persistence of cached images across TileCache instances.
+- Least-recently-used eviction once the cache exceeds its size bound, down to a low-water mark.
+- Removal of stale temporary files left by interrupted writes.
+- Expiry of cached images after their time-to-live.
+- Use of the cache by the `Map` class in place of repeated HTTP requests.
+"""
+
+from Greengraph.cache import TileCache
+from Greengraph.map import Map
+from Greengraph.session import MapSession
+
+import os
+import time
+import tempfile
+import numpy as np
+
+import unittest
+from unittest.mock import patch
+
+URL = "http://maps.googleapis.com/maps/api/staticmap?"
+
+class TestTileCache(unittest.TestCase):
+    """
+    Unit tests for the `TileCache` class. Each test uses its own temporary directory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_key_normalization(self):
+        """
+        Test that requests which are sent identically share a key, regardless of
+        parameter order or value types, while different requests do not.
+        """
+        key = TileCache.key(URL, {'zoom': 10, 'center': '51.5,-0.12'})
+
+        self.assertEqual(key, TileCache.key(URL, {'center': '51.5,-0.12', 'zoom': '10'}))
+        self.assertNotEqual(key, TileCache.key(URL, {'center': '51.5,-0.12', 'zoom': 11}))
+
+    def test_put_and_get(self):
+        """
+        Test that a stored image is returned by the same and by a new cache instance,
+        and that an unknown request is a miss.
+        """
+        cache = TileCache(self.directory.name)
+        cache.put(URL, {'zoom': 10}, b"image")
+
+        self.assertEqual(cache.get(URL, {'zoom': 10}), b"image")
+        self.assertEqual(TileCache(self.directory.name).get(URL, {'zoom': 10}), b"image")
+        self.assertIsNone(cache.get(URL, {'zoom': 11}))
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently used image is evicted when the size bound is exceeded.
+        """
+        cache = TileCache(self.directory.name, max_bytes = 10, memory_items = 2)
+        cache.put(URL, {'zoom': 1}, b"aaaa")
+        cache.put(URL, {'zoom': 2}, b"bbbb")
+
+        # Make the first image the most recently used one
+        path = cache._path(cache.key(URL, {'zoom': 2}))
+        os.utime(path, (time.time() - 100, os.path.getmtime(path)))
+        cache.get(URL, {'zoom': 1})
+
+        cache.put(URL, {'zoom': 3}, b"cccc")
+
+        self.assertEqual(cache.get(URL, {'zoom': 1}), b"aaaa")
+        # The evicted image is dropped from the in-memory layer too
+        self.assertIsNone(cache.get(URL, {'zoom': 2}))
+        self.assertEqual(cache.get(URL, {'zoom': 3}), b"cccc")
+        self.assertEqual(cache._size, 8)
+
+    def test_low_water_eviction(self):
+        """
+        Test that eviction frees space below the size bound, so that the next store does not rescan.
+        """
+        cache = TileCache(self.directory.name, max_bytes = 100, memory_items = 0, low_water = 0.5)
+        for zoom in range(10):
+            cache.put(URL, {'zoom': zoom}, b"x" * 10)
+            path = cache._path(cache.key(URL, {'zoom': zoom}))
+            os.utime(path, (time.time() - 100 + zoom, os.path.getmtime(path)))
+
+        with patch.object(TileCache, '_evict', wraps = cache._evict) as mock_evict:
+            cache.put(URL, {'zoom': 10}, b"x" * 10)
+            self.assertEqual(mock_evict.call_count, 1)
+            self.assertEqual(cache._size, 50)
+            self.assertEqual(len(cache._paths()), 5)
+            self.assertIsNone(cache.get(URL, {'zoom': 5}))
+            self.assertEqual(cache.get(URL, {'zoom': 6}), b"x" * 10)
+
+            for zoom in range(11, 16):
+                cache.put(URL, {'zoom': zoom}, b"x" * 10)
+            self.assertEqual(mock_evict.call_count, 1)
+
+    def test_stale_temporaries(self):
+        """
+        Test that temporary files left by interrupted writes are deleted once stale, but recent ones are kept.
+        """
+        stale, recent = (os.path.join(self.directory.name, name) for name in ("stale.tmp", "recent.tmp"))
+        for path in (stale, recent):
+            with open(path, "wb") as temporary:
+                temporary.write(b"partial")
+        os.utime(stale, (time.time() - 7200, time.time() - 7200))
+
+        cache = TileCache(self.directory.name)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(recent))
+
+        with patch('os.replace', side_effect = OSError):
+            with self.assertRaises(OSError):
+                cache.put(URL, {'zoom': 10}, b"image")
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["recent.tmp"])
+
+    def test_ttl_expiry(self):
+        """
+        Test that an image older than the time-to-live is no longer returned.
+        """
+        cache = TileCache(self.directory.name, ttl = 60, memory_items = 0)
+        cache.put(URL, {'zoom': 10}, b"image")
+        self.assertEqual(cache.get(URL, {'zoom': 10}), b"image")
+
+        path = cache._path(cache.key(URL, {'zoom': 10}))
+        os.utime(path, (time.time(), time.time() - 120))
+
+        self.assertIsNone(cache.get(URL, {'zoom': 10}))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(cache._size, 0)
+
+    @patch.object(MapSession, 'get')
+    @patch('Greengraph.map.decode_image')
+    def test_map_uses_cache(self, mock_decode_image, mock_get):
+        """
+        Test that a second Map with identical parameters is served from the cache
+        without another HTTP request.
+        """
+        mock_decode_image.return_value = np.random.randint(0, 256, (400, 400, 3), dtype = np.uint8)
+        mock_get.return_value = b"mock_image_data"
+
+        with patch.object(Map, 'cache', TileCache(self.directory.name)):
+            Map(51.50, -0.12).load()
+            Map(51.50, -0.12).load()
+
+        self.assertEqual(mock_get.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
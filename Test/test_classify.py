@@ -0,0 +1,190 @@
+"""
+Unit tests for the classification kernels in the classify.py module.
+
+This module includes tests to validate the following functionality:
+- The kernels classify float and uint8 images exactly as the reference comparison does.
+- Stacks of images are counted in one call.
+- A sweep over several thresholds matches counting each threshold separately.
+- Pixels with zero red or blue channels are handled for every threshold.
+- The summed-area index counts any window exactly, and survives saving and loading.
+- The ratio histogram counts every pixel, and gives the green count at its bin edges.
+- Approximate counts lie within their error bound, and become exact when every pixel is sampled.
+"""
+
+from Greengraph import classify
+from Greengraph.classify import GreenKernel, GreenIndex, green_mask, count_green_batch, ratio_histogram, estimate_green
+
+import os
+import tempfile
+
+import numpy as np
+import unittest
+
+def reference_mask(pixels, threshold):
+    """
+    The original Map.green comparison, used as the expected result.
+    """
+    return np.logical_and(pixels[:, :, 1] > threshold * pixels[:, :, 0],
+                          pixels[:, :, 1] > threshold * pixels[:, :, 2])
+
+class TestClassify(unittest.TestCase):
+    """
+    Unit tests for the green pixel classification kernels, using seeded random images.
+    """
+
+    def setUp(self):
+        random = np.random.default_rng(2015)
+        self.uint8_images = random.integers(0, 256, size = (3, 40, 50, 3), dtype = np.uint8)
+        self.float_images = random.random((3, 40, 50, 3), dtype = np.float32)
+
+    def test_green_mask_float(self):
+        """
+        Test that float images give exactly the reference mask.
+        """
+        for threshold in (1.1, 0.5, 1.5, -1):
+            for pixels in self.float_images:
+                np.testing.assert_array_equal(green_mask(pixels, threshold), reference_mask(pixels, threshold))
+
+    def test_green_mask_uint8(self):
+        """
+        Test that the lookup path for uint8 images gives exactly the reference mask,
+        computed here without overflow in float64.
+        """
+        for threshold in (1.1, 1.0, 0.75, 2):
+            for pixels in self.uint8_images:
+                expected = reference_mask(pixels.astype(np.float64), threshold)
+                np.testing.assert_array_equal(green_mask(pixels, threshold), expected)
+
+    def test_green_mask_boundary(self):
+        """
+        Test that integer images agree with the float comparison for every pair of channel
+        values, including thresholds just below a simple fraction of two channel values.
+        """
+        pixel = np.array([[[10, 11, 0]]], dtype = np.uint8)
+        self.assertTrue(green_mask(pixel, 1.0999999)[0, 0])
+        self.assertFalse(green_mask(pixel, 1.1)[0, 0])
+
+        values = np.arange(256)
+        green, red = np.meshgrid(values, values)
+        pairs = np.stack([red, green, np.zeros_like(red)], axis = 2)
+        for dtype in (np.uint8, np.uint16):
+            for threshold in (1.0999999, 1.1, 1 / 3, 0.999999999, 2.5000001, -0.5):
+                expected = reference_mask(pairs.astype(np.float64), threshold)
+                np.testing.assert_array_equal(green_mask(pairs.astype(dtype), threshold), expected)
+
+    def test_count_green_batch(self):
+        """
+        Test that a stack of images gives one count per image, for stacks and sequences.
+        """
+        expected = [np.count_nonzero(reference_mask(pixels, 1.1)) for pixels in self.float_images]
+
+        np.testing.assert_array_equal(count_green_batch(self.float_images), expected)
+        np.testing.assert_array_equal(count_green_batch(list(self.float_images), 1.1), expected)
+        self.assertEqual(count_green_batch([]).shape, (0,))
+
+    def test_threshold_sweep(self):
+        """
+        Test that a sweep over several thresholds matches counting each one separately,
+        including thresholds such as 1.15 and 0.95 on which the rounded ratios of some
+        pairs of channel values lie.
+        """
+        thresholds = [0.8, 0.95, 1.0, 1.1, 1.15, 1.25, 2.0]
+
+        values = np.arange(256)
+        green, red = np.meshgrid(values, values)
+        pairs = np.stack([red, green, np.zeros_like(red)], axis = 2).astype(np.uint8)
+        self.assertEqual(count_green_batch([pairs], [1.15])[0, 0], np.count_nonzero(reference_mask(pairs.astype(np.float64), 1.15)))
+
+        for images in (self.uint8_images, self.float_images, [pairs]):
+            sweep = count_green_batch(images, thresholds)
+            self.assertEqual(sweep.shape, (len(images), 7))
+            for column, threshold in enumerate(thresholds):
+                np.testing.assert_array_equal(sweep[:, column], count_green_batch(images, threshold))
+
+    def test_zero_channels(self):
+        """
+        Test that black pixels are never green and that pixels with only a green channel
+        are green, for positive and negative thresholds alike.
+        """
+        pixels = np.array([[[0, 0, 0], [0, 10, 0], [5, 10, 0]]], dtype = np.uint8)
+        kernel = GreenKernel(pixels.shape[:2])
+
+        for threshold in (-1.0, 1.1):
+            expected = np.count_nonzero(reference_mask(pixels.astype(np.float64), threshold))
+            self.assertEqual(kernel.count(pixels, threshold), expected)
+            self.assertEqual(kernel.counts(pixels, np.array([threshold]))[0], expected)
+
+    def test_green_index(self):
+        """
+        Test that the index counts windows exactly as the mask does, including windows
+        reaching past the edges, when built a few rows at a time.
+        """
+        pixels = self.uint8_images[0]
+        mask = reference_mask(pixels.astype(np.float64), 1.1)
+
+        original, classify.INDEX_ROWS = classify.INDEX_ROWS, 7
+        try:
+            index = GreenIndex.from_pixels(pixels, 1.1)
+        finally:
+            classify.INDEX_ROWS = original
+
+        self.assertEqual(index.shape, (40, 50))
+        self.assertEqual(index.total, np.count_nonzero(mask))
+        for top, left, height, width in ((0, 0, 40, 50), (3, 5, 10, 20), (35, 45, 10, 10), (-5, -5, 10, 10), (50, 0, 5, 5)):
+            expected = np.count_nonzero(mask[max(0, top):max(0, top + height), max(0, left):max(0, left + width)])
+            self.assertEqual(index.count(top, left, height, width), expected)
+            self.assertEqual(index.counts([top], [left], height, width)[0], expected)
+
+        np.testing.assert_array_equal(GreenIndex.from_mask(mask).table, index.table)
+
+    def test_ratio_histogram(self):
+        """
+        Test that every pixel is counted, and that the bins above an edge hold the green
+        pixels for that threshold when no ratio lies exactly on the edge.
+        """
+        pixels = self.float_images[0]
+        edges = np.linspace(0.05, 2.95, 30)
+        histogram = ratio_histogram(pixels, edges)
+
+        self.assertEqual(histogram.sum(), 40 * 50)
+        for position in (5, 10, 20):
+            expected = np.count_nonzero(reference_mask(pixels, edges[position]))
+            self.assertEqual(histogram[position:].sum(), expected)
+
+    def test_estimate_green(self):
+        """
+        Test that approximate counts are within their error bound of the exact count, sample
+        fewer pixels for uniform images, and are exact when the tolerance needs every pixel.
+        """
+        random = np.random.default_rng(2015)
+        mixed = random.integers(0, 256, size = (400, 400, 3), dtype = np.uint8)
+        field = np.tile(np.array([30, 180, 30], dtype = np.uint8), (401, 399, 1))
+
+        for pixels in (mixed, field, self.float_images[0]):
+            exact = int(np.count_nonzero(reference_mask(pixels, 1.1)))
+            estimate, error = estimate_green(pixels, 1.1)
+            self.assertLessEqual(abs(estimate - exact), error)
+            self.assertLessEqual(error, 0.02 * pixels.shape[0] * pixels.shape[1])
+
+            self.assertEqual(estimate_green(pixels, 1.1, tolerance = 0), (exact, 0))
+
+        self.assertLess(estimate_green(field, 1.1)[1], estimate_green(mixed, 1.1)[1])
+
+    def test_green_index_save(self):
+        """
+        Test that a saved index loads with the same table, threshold and request key.
+        """
+        index = GreenIndex.from_pixels(self.uint8_images[1], 1.3)
+        index.key = 'request'
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.npz')
+            index.save(path)
+            loaded = GreenIndex.load(path)
+
+        np.testing.assert_array_equal(loaded.table, index.table)
+        self.assertEqual(loaded.threshold, 1.3)
+        self.assertEqual(loaded.key, 'request')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ Unit tests for the command-line interface (CLI) functionality of the Greengraph
 This module tests the following aspects of the Greengraph CLI:
 - Argument parsing: Ensures that the argument parser correctly processes and assigns command-line arguments.
 - Plotting functionality: Verifies that the green space plot is generated and saved correctly based on user input.
+- Numeric output: Verifies that headless runs write CSV and JSON without plotting.
 - Overall process: Ensures that the process function, which ties together argument parsing and plotting, works as expected.
 
 The tests use the `unittest.mock` library to mock external dependencies, including:
@@ -14,9 +15,15 @@ The tests use the `unittest.mock` library to mock external dependencies, includi
 These tests validate the correctness of the CLI without requiring actual input from the command line or generating real files.
 """
 
+import io
+import os
+import json
+import tempfile
+import numpy as np
 import unittest
-from unittest.mock import patch
-from Greengraph.command import parser, green_plotter, process
+from unittest.mock import Mock, patch
+from Greengraph import profiling
+from Greengraph.command import parser, green_plotter, stream_plotter, batch_processor, process
 
 class TestCommand(unittest.TestCase):
     """
@@ -31,15 +38,22 @@ class TestCommand(unittest.TestCase):
         This test ensures that the parser processes and assigns the correct values 
         to the first_location, second_location, steps, and output arguments.
         """
-        arguments = parser.parse_args(['--from','London','--to','Cambridge','--steps', '4','--out','my_file'])
+        arguments = parser.parse_args(['--from','London','--to','Cambridge','--steps', '4','--out','my_file','--workers','8'])
         
         # Validate that the parsed arguments are correctly assigned
         self.assertEqual( arguments.first_location, 'London')
         self.assertEqual( arguments.second_location, 'Cambridge')
         self.assertEqual( arguments.steps, 4)
         self.assertEqual( arguments.output, 'my_file')
+        self.assertEqual( arguments.workers, 8)
+        self.assertIsNone( arguments.approximate)
+        self.assertEqual( parser.parse_args(['--approximate']).approximate, 0.02)
 
-    @patch('Greengraph.command.plt.show')
+        # Recording and replaying an archive are mutually exclusive
+        with patch('sys.stderr', new_callable=io.StringIO), self.assertRaises(SystemExit):
+            parser.parse_args(['--record', 'run.archive', '--replay', 'run.archive'])
+
+    @patch('matplotlib.pyplot.show')
     @patch('Greengraph.command.Greengraph')
     @patch('matplotlib.pyplot.savefig')
     @patch('matplotlib.pyplot.plot')
@@ -55,6 +69,7 @@ class TestCommand(unittest.TestCase):
         # Mock green pixel counts returned by the green_between function
         mock_graph_instance = mock_Greengraph.return_value
         mock_graph_instance.green_between.return_value = [100, 200, 300, 400]  # Mock green pixel counts for test
+        mock_graph_instance.sample_locations.return_value = np.array([[0.0, 0.0], [0.0, 1.0], [0.0, 2.0], [0.0, 3.0]])
 
         # Simulate arguments parsed from the command line
         args = parser.parse_args(['--from', 'London', '--to', 'Cambridge', '--steps', '4', '--out', 'test_output'])
@@ -63,16 +78,101 @@ class TestCommand(unittest.TestCase):
         green_plotter(args)
         
         # Check if Greengraph was initialized correctly with the expected arguments
-        mock_Greengraph.assert_called_with('London', 'Cambridge')
+        mock_Greengraph.assert_called_with('London', 'Cambridge', geocoder=None, geocache=None)
 
         # Check if green_between was called with the correct number of steps
-        mock_graph_instance.green_between.assert_called_with(4)
+        mock_graph_instance.green_between.assert_called_with(4, workers=1, sampling='linear', processes=0)
 
-        # Verify that plot was called with the correct green pixel data
-        mock_plot.assert_called_with([100, 200, 300, 400])
+        # Verify that plot was called with the correct green pixel data, against the distance along the route
+        distances, green_count = mock_plot.call_args[0]
+        np.testing.assert_allclose(distances, [0, 111.195, 222.39, 333.585], rtol = 1e-5)
+        self.assertEqual(green_count, [100, 200, 300, 400])
 
         # Ensure the plot was saved to the correct output file
         mock_savefig.assert_called_with('test_output.png')
+
+    @patch('Greengraph.command.pyplot')
+    @patch('Greengraph.command.Greengraph')
+    def test_green_plotter_mosaic(self, mock_Greengraph, mock_pyplot):
+        """
+        Test that counts from a mosaic are plotted even when a progressive plot is requested,
+        and that process() rejects that combination of options.
+        """
+        mock_graph_instance = mock_Greengraph.return_value
+        mock_graph_instance.green_between_mosaic.return_value = [100, 200]
+        mock_graph_instance.sample_locations.return_value = np.array([[0.0, 0.0], [1.0, 0.0]])
+
+        green_plotter(parser.parse_args(['--steps', '2', '--out', 'route', '--mosaic', '--progressive', '--headless']))
+
+        plt = mock_pyplot.return_value
+        self.assertEqual(plt.plot.call_args[0][1], [100, 200])
+        plt.savefig.assert_called_with('route.png')
+
+        for option in (['--mosaic'], ['--thresholds', '1.1', '1.2']):
+            with patch('sys.argv', ['graph', '--progressive'] + option), patch('sys.stderr', new_callable=io.StringIO):
+                with self.assertRaises(SystemExit):
+                    process()
+        self.assertFalse(mock_Greengraph.return_value.green_sweep.called)
+
+    @patch('Greengraph.command.pyplot')
+    @patch('Greengraph.command.Greengraph')
+    def test_green_plotter_headless(self, mock_Greengraph, mock_pyplot):
+        """
+        Test that a headless run writes the location and counts of each step as CSV and JSON
+        without importing pyplot, with a column per threshold and empty values for missing counts.
+        """
+        mock_graph_instance = mock_Greengraph.return_value
+        mock_graph_instance.green_between.return_value = [100, float('nan'), 300]
+        mock_graph_instance.sample_locations.return_value = np.array([[0.0, 0.0], [0.5, 0.0], [1.0, 0.0]])
+        mock_graph_instance.green_sweep.return_value = np.array([[10, 5], [20, 8], [30, 9]])
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'route')
+            args = parser.parse_args(['--steps', '4', '--out', output, '--headless', '--format', 'csv', 'json',
+                                      '--sampling', 'tile'])
+            green_plotter(args)
+
+            with open(output + '.csv') as result:
+                self.assertEqual(result.read().splitlines(), ['step,latitude,longitude,distance_km,green',
+                                                              '0,0.0,0.0,0.0,100', '1,0.5,0.0,55.598,',
+                                                              '2,1.0,0.0,111.195,300'])
+            with open(output + '.json') as result:
+                document = json.load(result)
+            self.assertEqual(document['green'], [100, None, 300])
+            self.assertEqual(document['locations'], [[0.0, 0.0], [0.5, 0.0], [1.0, 0.0]])
+            self.assertEqual(document['distance_km'], [0.0, 55.598, 111.195])
+            self.assertEqual((document['steps'], document['sampled']), (4, 3))
+            self.assertEqual(document['sampling'], 'tile')
+            self.assertFalse(os.path.exists(output + '.png'))
+
+            args = parser.parse_args(['--steps', '3', '--out', output, '--headless', '--format', 'csv',
+                                      '--thresholds', '1.1', '1.5'])
+            green_plotter(args)
+
+            with open(output + '.csv') as result:
+                self.assertEqual(result.readline().strip(), 'step,latitude,longitude,distance_km,green_1.1,green_1.5')
+
+        self.assertFalse(mock_pyplot.called)
+
+    @patch('Greengraph.command.plt')
+    def test_stream_plotter(self, mock_plt):
+        """
+        Test that the stream_plotter function places results arriving out of order at their
+        step, updates the plot for each one, and passes the checkpoint file to the graph.
+        """
+        mock_line = Mock()
+        mock_plt.plot.return_value = [mock_line]
+        mock_graph = Mock()
+        mock_graph.iter_green_between.return_value = iter([(1, 0.5, 0.5, 200), (0, 0.0, 0.0, 100)])
+
+        args = parser.parse_args(['--steps', '2', '--checkpoint', 'run.jsonl', '--progressive'])
+        green_count = stream_plotter(mock_graph, args, [0.0, 10.0])
+
+        self.assertEqual(green_count, [100, 200])
+        mock_graph.iter_green_between.assert_called_with(2, workers=1, checkpoint='run.jsonl', sampling='linear', processes=0)
+        self.assertEqual(mock_plt.pause.call_count, 2)
+        self.assertEqual(mock_plt.plot.call_args[0][0], [0.0, 10.0])
+        mock_line.set_ydata.assert_called_with([100, 200])
         
     @patch('Greengraph.command.parser.parse_args')
     @patch('Greengraph.command.green_plotter')
@@ -84,6 +184,11 @@ class TestCommand(unittest.TestCase):
         This test validates that process() correctly calls the necessary functions 
         to parse arguments and generate the green space plot.
         """
+        # The innermost patch is passed first, so mock_green_plotter stands in for parse_args here
+        mock_green_plotter.return_value.batch = None
+        mock_green_plotter.return_value.profile = None
+        mock_green_plotter.return_value.progressive = False
+
         # Call the process function, which should invoke both the parser and green_plotter
         process()
 
@@ -93,5 +198,50 @@ class TestCommand(unittest.TestCase):
         # Verify that the green_plotter function was called
         self.assertTrue(mock_green_plotter.called)
 
+    @patch('Greengraph.command.batch_processor')
+    @patch('Greengraph.command.green_plotter')
+    def test_process_batch(self, mock_green_plotter, mock_batch_processor):
+        """
+        Test that process() hands a batch of routes to the batch_processor function
+        instead of plotting a single route.
+        """
+        with patch('sys.argv', ['graph', '--batch', 'routes.csv', '--out', 'results.csv']):
+            process()
+
+        self.assertFalse(mock_green_plotter.called)
+        arguments = mock_batch_processor.call_args[0][0]
+        self.assertEqual(arguments.batch, 'routes.csv')
+        self.assertEqual(arguments.output, 'results.csv')
+
+    @patch('Greengraph.command.green_plotter')
+    def test_process_profile(self, mock_green_plotter):
+        """
+        Test that process() collects a profile during the run and prints it as JSON
+        when requested, leaving instrumentation disabled afterwards.
+        """
+        mock_green_plotter.side_effect = lambda arguments: profiling.count('http.requests', 4)
+
+        with patch('sys.argv', ['graph', '--profile', 'json']), patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            process()
+
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report['counters'], {'http.requests': 4})
+        self.assertIsNone(profiling.active())
+
+    @patch('Greengraph.command.batch')
+    def test_batch_processor(self, mock_batch):
+        """
+        Test that the batch_processor function reads the routes and writes the results,
+        adding a .jsonl extension to an output name without one.
+        """
+        args = parser.parse_args(['--batch', 'routes.csv', '--steps', '4', '--out', 'results', '--workers', '8'])
+
+        batch_processor(args)
+
+        mock_batch.read_routes.assert_called_with('routes.csv', 4)
+        mock_batch.run_batch.assert_called_with(mock_batch.read_routes.return_value, 'results.jsonl',
+                                                geocoder=None, geocache=None, workers=8, sampling='linear', processes=0,
+                                                store=None, tile_index=None)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
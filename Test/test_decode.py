@@ -0,0 +1,120 @@
+"""
+Unit tests for the decode.py module, which decodes and encodes images without matplotlib.
+
+This module includes tests to validate the following functionality:
+- Round trips through the built-in PNG writer and decoders.
+- The built-in PNG decoder against Pillow for every PNG filter and colour type it supports.
+- Rejection of invalid image data.
+- Dropping the encoded image bytes from a `Map` when they are not kept.
+"""
+
+from Greengraph import decode
+from Greengraph.map import Map
+from Greengraph.session import MapSession
+
+import zlib
+import struct
+import numpy as np
+from io import BytesIO
+
+import unittest
+from unittest.mock import patch
+
+class TestDecode(unittest.TestCase):
+    """
+    Unit tests for the image decoding and encoding functions.
+    """
+
+    def setUp(self):
+        # A smooth image with noise, so that encoders choose a mixture of PNG filters
+        y, x = np.mgrid[0:64, 0:48]
+        noise = np.random.default_rng(2015).integers(0, 16, size = (64, 48, 3))
+        self.pixels = (np.stack([x * 5, y * 4, (x + y) * 2], axis = 2) + noise).astype(np.uint8)
+
+    def test_round_trip(self):
+        """
+        Test that an encoded image decodes back to the same uint8 RGB pixels with
+        both the default and the built-in decoder.
+        """
+        data = decode.encode_png(self.pixels)
+
+        for decoded in (decode.decode_image(data), decode.decode_png(data)):
+            self.assertEqual(decoded.dtype, np.uint8)
+            np.testing.assert_array_equal(decoded, self.pixels)
+
+    @unittest.skipIf(decode.Image is None, 'Pillow is not installed')
+    def test_png_decoder_matches_pillow(self):
+        """
+        Test that the built-in decoder matches Pillow for filtered RGB, RGBA, greyscale
+        and palette images.
+        """
+        image = decode.Image.fromarray(self.pixels)
+
+        for mode in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            converted = image.convert(mode)
+            for optimize in (False, True):
+                buffer = BytesIO()
+                converted.save(buffer, format = 'png', optimize = optimize)
+                expected = np.asarray(converted.convert('RGB'))
+
+                np.testing.assert_array_equal(decode.decode_png(buffer.getvalue()), expected)
+
+    def test_average_and_paeth_filters(self):
+        """
+        Test the byte-by-byte reconstruction of rows using the Average and Paeth filters,
+        which encoders rarely choose for small images.
+        """
+        pixels = self.pixels[:8, :6]
+        raw = pixels.reshape(8, -1).astype(int)
+        rows = b""
+        for y in range(8):
+            kind = 3 if y % 2 else 4
+            filtered = bytearray([kind])
+            for i in range(raw.shape[1]):
+                left = raw[y, i - 3] if i >= 3 else 0
+                up = raw[y - 1, i] if y else 0
+                upper_left = raw[y - 1, i - 3] if y and i >= 3 else 0
+                if kind == 3:
+                    predictor = (left + up) // 2
+                else:
+                    estimate = left + up - upper_left
+                    predictor = min((abs(estimate - left), 0, left), (abs(estimate - up), 1, up),
+                                    (abs(estimate - upper_left), 2, upper_left))[2]
+                filtered.append((raw[y, i] - predictor) % 256)
+            rows += bytes(filtered)
+
+        def chunk(kind, body):
+            return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+        data = (decode.PNG_SIGNATURE + chunk(b"IHDR", struct.pack(">IIBBBBB", 6, 8, 8, 2, 0, 0, 0))
+                + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+        np.testing.assert_array_equal(decode.decode_png(data), pixels)
+
+    def test_invalid_data(self):
+        """
+        Test that data which is not an image raises a ValueError.
+        """
+        for data in (b"", b"mock_image_data", decode.encode_png(self.pixels)[:60]):
+            with self.assertRaises(ValueError):
+                decode.decode_png(data)
+            with self.assertRaises(ValueError):
+                decode.decode_image(data)
+
+    @patch.object(MapSession, 'get')
+    def test_map_keep_image(self, mock_get):
+        """
+        Test that a Map decodes its image to uint8 pixels and only keeps the encoded
+        bytes when asked to.
+        """
+        mock_get.return_value = decode.encode_png(self.pixels)
+
+        kept = Map(51.50, -0.12)
+        dropped = Map(51.50, -0.12, keep_image = False)
+
+        self.assertEqual(kept.image, mock_get.return_value)
+        self.assertIsNone(dropped.image)
+        np.testing.assert_array_equal(dropped.pixels, self.pixels)
+
+if __name__ == '__main__':
+    unittest.main()
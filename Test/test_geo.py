@@ -0,0 +1,94 @@
+"""
+Unit tests for the geographic calculations in the geo.py module.
+
+This module includes tests to validate the following functionality:
+- Great-circle distances and interpolation.
+- Web Mercator projection and the ground footprint and overlap of map images.
+- Sampling routes by image footprint, and the ground distance along a route of samples.
+"""
+
+from Greengraph import geo
+
+import numpy as np
+
+import unittest
+
+LONDON = (51.5073509, -0.1277583)
+CAMBRIDGE = (52.205337, 0.121817)
+NEW_YORK = (40.7127753, -74.0059728)
+
+class TestGeo(unittest.TestCase):
+    """
+    Unit tests for the functions of the geo module.
+    """
+
+    def test_haversine(self):
+        """
+        Test the great-circle distance between two known pairs of places.
+        """
+        self.assertAlmostEqual(geo.haversine(LONDON, CAMBRIDGE) / 1000, 79.4, delta = 0.5)
+        self.assertAlmostEqual(geo.haversine(LONDON, NEW_YORK) / 1000, 5570, delta = 10)
+        self.assertEqual(geo.haversine(LONDON, LONDON), 0)
+
+    def test_geodesic_sequence(self):
+        """
+        Test that geodesic samples keep both ends and are evenly spaced on the ground,
+        and that they bend north of the straight line in latitude and longitude on a
+        long westward route.
+        """
+        sequence = geo.geodesic_sequence(LONDON, NEW_YORK, 11)
+
+        np.testing.assert_allclose(sequence[0], LONDON)
+        np.testing.assert_allclose(sequence[-1], NEW_YORK)
+        spacings = [geo.haversine(first, second) for first, second in zip(sequence, sequence[1:])]
+        self.assertAlmostEqual(min(spacings), max(spacings), delta = 1)
+        self.assertGreater(sequence[5][0], (LONDON[0] + NEW_YORK[0]) / 2)
+
+    def test_route_distances(self):
+        """
+        Test that the distance along a route accumulates the distance between its samples.
+        """
+        sequence = geo.geodesic_sequence(LONDON, CAMBRIDGE, 5)
+        distances = geo.route_distances(sequence)
+
+        self.assertEqual(distances[0], 0)
+        self.assertAlmostEqual(distances[-1], geo.haversine(LONDON, CAMBRIDGE), delta = 1e-3)
+        self.assertAlmostEqual(distances[2], distances[-1] / 2, delta = 1e-3)
+        self.assertEqual(len(geo.route_distances(np.empty((0, 2)))), 0)
+
+    def test_pixels_round_trip(self):
+        """
+        Test that projecting to Web Mercator pixels and back returns the coordinates.
+        """
+        x, y = geo.to_pixels(LONDON[0], LONDON[1], 10)
+        lat, long = geo.from_pixels(x, y, 10)
+
+        self.assertAlmostEqual(float(lat), LONDON[0])
+        self.assertAlmostEqual(float(long), LONDON[1])
+        self.assertEqual(geo.to_pixels(0.0, -180.0, 0), (0.0, 128.0))
+
+    def test_overlap(self):
+        """
+        Test the overlap of images a known number of pixels apart.
+        """
+        x, y = geo.to_pixels(LONDON[0], LONDON[1], 10)
+        lat, long = geo.from_pixels(x + 100, y, 10)
+
+        self.assertEqual(geo.overlap(LONDON, LONDON), 1.0)
+        self.assertAlmostEqual(geo.overlap(LONDON, (float(lat), float(long))), 0.75)
+        self.assertEqual(geo.overlap(LONDON, CAMBRIDGE), 0.0)
+
+    def test_tile_sequence(self):
+        """
+        Test that samples placed by image footprint are one footprint apart, so that the
+        images just meet.
+        """
+        sequence = geo.tile_sequence(LONDON, CAMBRIDGE, zoom = 12)
+        spacing = min(geo.footprint(LONDON[0], 12))
+
+        np.testing.assert_allclose(sequence[-1], CAMBRIDGE)
+        self.assertAlmostEqual(geo.haversine(sequence[0], sequence[1]), spacing, delta = 1)
+        self.assertEqual(len(sequence), int(np.ceil(geo.haversine(LONDON, CAMBRIDGE) / spacing)) + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+"""
+Unit tests for the `GeocodeCache` class in the geocode.py module and its use by
+`Greengraph.geolocate`.
+
+This module includes tests to validate the following functionality:
+- Normalization of place names.
+- Persistence of geocoding results across cache instances, written once per save.
+- Shorter expiry of places that could not be found.
+- Pre-seeding from CSV and JSON gazetteers.
+- Memoization of geocoder calls in `Greengraph.geolocate`.
+- Coalescing of concurrent lookups of the same place by `BulkGeocoder` and `Greengraph.geolocate_many`.
+"""
+
+from Greengraph.geocode import GeocodeCache, BulkGeocoder
+from Greengraph.graph import Greengraph
+
+import os
+import json
+import time
+import tempfile
+import threading
+
+import unittest
+from unittest.mock import Mock, patch
+
+class TestGeocodeCache(unittest.TestCase):
+    """
+    Unit tests for the `GeocodeCache` class. Each test uses its own temporary directory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'geocache.json')
+
+    def test_normalize(self):
+        """
+        Test that spacing and capitalization do not affect the normalized name.
+        """
+        self.assertEqual(GeocodeCache.normalize('  New   York '), 'new york')
+        self.assertEqual(GeocodeCache.normalize('LONDON'), GeocodeCache.normalize('london'))
+
+    def test_persistence(self):
+        """
+        Test that stored results, including places that were not found, are available
+        to a new cache instance using the same file.
+        """
+        cache = GeocodeCache(self.path)
+        cache['London'] = (51.5073509, -0.1277583)
+        cache['Atlantis'] = None
+        cache.save()
+
+        reloaded = GeocodeCache(self.path)
+        self.assertEqual(reloaded['london'], (51.5073509, -0.1277583))
+        self.assertIsNone(reloaded['Atlantis'])
+        self.assertNotIn('Cambridge', reloaded)
+
+    def test_deferred_save(self):
+        """
+        Test that stored entries are written once, when the cache is saved, merging in
+        entries saved by another cache using the same file in the meantime.
+        """
+        cache = GeocodeCache(self.path)
+        other = GeocodeCache(self.path)
+        with patch('Greengraph.geocode.os.replace', wraps = os.replace) as mock_replace:
+            for number in range(50):
+                cache[f'Place {number}'] = (number, number)
+            self.assertFalse(os.path.exists(self.path))
+            self.assertTrue(cache.dirty)
+
+            other['London'] = (51.5073509, -0.1277583)
+            other.close()
+            cache.save()
+            cache.save()
+        self.assertEqual(mock_replace.call_count, 2)
+        self.assertFalse(cache.dirty)
+
+        reloaded = GeocodeCache(self.path)
+        self.assertEqual(reloaded['place 49'], (49, 49))
+        self.assertEqual(reloaded['London'], (51.5073509, -0.1277583))
+        self.assertEqual(cache['London'], (51.5073509, -0.1277583))
+
+    def test_negative_ttl(self):
+        """
+        Test that places which were not found expire after the negative time-to-live,
+        while found places are kept.
+        """
+        cache = GeocodeCache(ttl = 3600, negative_ttl = 60)
+        cache['London'] = (51.5073509, -0.1277583)
+        cache['Atlantis'] = None
+
+        for entry in cache._entries.values():
+            entry['stored'] = time.time() - 120
+
+        self.assertIn('London', cache)
+        self.assertNotIn('Atlantis', cache)
+
+    def test_seed(self):
+        """
+        Test that CSV and JSON gazetteers add permanent entries to the cache.
+        """
+        csv_path = os.path.join(self.directory.name, 'places.csv')
+        with open(csv_path, 'w') as gazetteer:
+            gazetteer.write('Name,Latitude,Longitude\nLondon,51.5073509,-0.1277583\n')
+
+        json_path = os.path.join(self.directory.name, 'places.json')
+        with open(json_path, 'w') as gazetteer:
+            json.dump({'Cambridge': [52.205337, 0.121817]}, gazetteer)
+
+        cache = GeocodeCache(self.path, ttl = 0)
+        self.assertEqual(cache.seed(csv_path), 1)
+        self.assertEqual(cache.seed(json_path), 1)
+
+        self.assertEqual(cache['London'], (51.5073509, -0.1277583))
+        self.assertEqual(cache['Cambridge'], (52.205337, 0.121817))
+
+    def test_geolocate_memoization(self):
+        """
+        Test that Greengraph.geolocate only calls the geocoder once per place, and not at
+        all for places in the gazetteer.
+        """
+        geocoder = Mock()
+        geocoder.geocode.return_value = ('Cambridge', (52.205337, 0.121817))
+
+        cache = GeocodeCache(self.path)
+        cache.store({'London': (51.5073509, -0.1277583)}, permanent = True)
+        mygraph = Greengraph('London', 'Cambridge', geocoder, geocache = cache)
+
+        self.assertEqual(mygraph.geolocate('London'), (51.5073509, -0.1277583))
+        self.assertEqual(mygraph.geolocate('Cambridge'), (52.205337, 0.121817))
+        self.assertEqual(mygraph.geolocate('cambridge '), (52.205337, 0.121817))
+
+        geocoder.geocode.assert_called_once_with('Cambridge', exactly_one=True)
+
+        with patch.object(cache, 'save', wraps = cache.save) as mock_save:
+            mygraph.geolocate_many(['Oxford', 'Bath', 'London'], workers = 3)
+        mock_save.assert_called_once_with()
+        self.assertIn('Bath', GeocodeCache(self.path))
+
+class TestBulkGeocoder(unittest.TestCase):
+    """
+    Unit tests for the `BulkGeocoder` class and `Greengraph.geolocate_many`.
+    """
+
+    def test_coalescing(self):
+        """
+        Test that lookups of a place already in flight wait for it instead of calling the geocoder,
+        and that every spelling of a place gets the result.
+        """
+        release = threading.Event()
+        geocoder = Mock()
+        def geocode(place, exactly_one):
+            release.wait(5)
+            return (place, {'london': (51.5, -0.13), 'cambridge': (52.2, 0.12)}[place.strip().lower()])
+        geocoder.geocode.side_effect = geocode
+
+        bulk = BulkGeocoder(geocoder, workers = 4)
+        results = []
+        waiting = [threading.Thread(target = lambda place: results.append(bulk.geocode(place)), args = (place,))
+                   for place in ('London', 'london ', 'LONDON')]
+        for thread in waiting:
+            thread.start()
+        # Release the first lookup only once the others are waiting for it
+        while geocoder.geocode.call_count == 0:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        release.set()
+        for thread in waiting:
+            thread.join()
+
+        self.assertEqual(geocoder.geocode.call_count, 1)
+        self.assertEqual([result[1] for result in results], [(51.5, -0.13)] * 3)
+        self.assertEqual(bulk._in_flight, {})
+
+        results = bulk.geocode_many(['London', 'Cambridge', 'london ', 'LONDON'])
+        self.assertEqual(results['london '][1], (51.5, -0.13))
+        self.assertEqual(results['Cambridge'][1], (52.2, 0.12))
+        self.assertEqual(geocoder.geocode.call_count, 3)
+
+    def test_errors_and_rate(self):
+        """
+        Test that a failed lookup is raised to every caller, and that lookups are rate limited.
+        """
+        geocoder = Mock()
+        geocoder.geocode.side_effect = ValueError('quota exceeded')
+        with self.assertRaises(ValueError):
+            BulkGeocoder(geocoder).geocode_many(['London', 'Cambridge'])
+
+        geocoder.geocode.side_effect = lambda place, exactly_one: (place, (0.0, 0.0))
+        bulk = BulkGeocoder(geocoder, rate = 20, burst = 1)
+        started = time.monotonic()
+        bulk.geocode_many(['A', 'B', 'C'])
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_geolocate_many(self):
+        """
+        Test that Greengraph.geolocate_many geolocates each normalized place once, through the cache.
+        """
+        geocoder = Mock()
+        geocoder.geocode.side_effect = lambda place, exactly_one: (place, (52.2, 0.12)) if place != 'Atlantis' else None
+        cache = GeocodeCache()
+        cache.store({'London': (51.5, -0.13)}, permanent = True)
+        mygraph = Greengraph('London', 'Cambridge', geocoder, geocache = cache)
+
+        coordinates = mygraph.geolocate_many(['London', 'Cambridge', 'cambridge', 'Atlantis'])
+
+        self.assertEqual(coordinates, {'London': (51.5, -0.13), 'Cambridge': (52.2, 0.12),
+                                       'cambridge': (52.2, 0.12), 'Atlantis': None})
+        self.assertEqual(geocoder.geocode.call_count, 2)
+        self.assertEqual(mygraph.endpoints(), ((51.5, -0.13), (52.2, 0.12)))
+
+if __name__ == '__main__':
+    unittest.main()
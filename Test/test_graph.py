@@ -3,13 +3,19 @@ This module contains unit tests for the Greengraph class in the graph.py module.
 It tests geolocation, location sequence generation, and green space analysis functionality.
 """
 
-from Greengraph.graph import Greengraph
+from Greengraph.graph import Greengraph, MAX_OVERLAP, count_locations, read_checkpoint
 from Greengraph.map import Map
+from Greengraph.session import MapSession, FetchError
+from Greengraph.decode import encode_png
+from Greengraph import geo
 
 import os
+import json
+import numpy as np
 import yaml
+import tempfile
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 from yaml.constructor import ConstructorError
 
 # Adding constructor for tuples in YAML
@@ -118,8 +124,8 @@ class TestGreengraph(unittest.TestCase):
         from the YAML file to verify the expected results.
         """
         
-        # Mock the geocode method to return fixed coordinates (latitude, longitude)
-        mock_geocode.return_value = [(51.5074, -0.1278)]  # Mocked coordinates for London
+        # Mock the geocode method to return a single (address, (latitude, longitude)) match
+        mock_geocode.return_value = ('London', (51.5074, -0.1278))  # Mocked coordinates for London
         
         # Pass the mock geocoder to Greengraph
         mygraph = Greengraph('London', 'Cambridge', mock_GoogleV3)
@@ -143,5 +149,220 @@ class TestGreengraph(unittest.TestCase):
             # Assert that the results match the expected values
             self.assertEqual(actual_return, count_green_values)
 
+    @patch('Greengraph.graph.Map')
+    @patch.object(Greengraph, 'geolocate')
+    def test_green_between_concurrent(self, mock_geolocate, mock_Map):
+        """
+        Test the green_between method with several workers.
+
+        This test ensures that fetching the map images through a thread pool still returns
+        the green pixel counts in route order. Each mocked map reports its own latitude as
+        its green pixel count so that the order of the results can be checked.
+        """
+        mock_geolocate.side_effect = lambda place: {'London': (0.0, 0.0), 'Cambridge': (9.0, 0.0)}[place]
+        mock_Map.side_effect = lambda lat, long, **options: Mock(count_green = Mock(return_value = lat))
+
+        mygraph = Greengraph('London', 'Cambridge', Mock())
+        actual_return = mygraph.green_between(10, workers=4)
+
+        self.assertEqual(actual_return, [float(lat) for lat in range(10)])
+        self.assertEqual(mock_Map.call_count, 10)
+
+    @patch('Greengraph.graph.Map')
+    @patch.object(Greengraph, 'geolocate')
+    def test_iter_green_between_checkpoint(self, mock_geolocate, mock_Map):
+        """
+        Test the iter_green_between method with a checkpoint file.
+
+        This test interrupts a run after two intervals and resumes it from the checkpoint.
+        The resumed run must yield the recorded intervals without fetching them again, and
+        then yield the remaining intervals in route order.
+        """
+        mock_geolocate.side_effect = lambda place: {'London': (0.0, 0.0), 'Cambridge': (3.0, 0.0)}[place]
+        mock_Map.side_effect = lambda lat, long, **options: Mock(count_green = Mock(return_value = lat))
+
+        mygraph = Greengraph('London', 'Cambridge', Mock())
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'checkpoint.jsonl')
+
+            first_run = mygraph.iter_green_between(4, checkpoint=checkpoint)
+            self.assertEqual(next(first_run), (0, 0.0, 0.0, 0))
+            self.assertEqual(next(first_run), (1, 1.0, 0.0, 1))
+            first_run.close()
+
+            resumed = list(mygraph.iter_green_between(4, checkpoint=checkpoint))
+
+        self.assertEqual(resumed, [(0, 0.0, 0.0, 0), (1, 1.0, 0.0, 1), (2, 2.0, 0.0, 2), (3, 3.0, 0.0, 3)])
+        self.assertEqual(mock_Map.call_count, 4)
+
+    @patch('Greengraph.graph.Map')
+    @patch.object(Greengraph, 'geolocate')
+    def test_checkpoint_corruption(self, mock_geolocate, mock_Map):
+        """
+        Test that an interruption while the checkpoint is rewritten keeps the recorded results,
+        that corrupt record lines are fetched again, and that a corrupt header starts over.
+        """
+        mock_geolocate.side_effect = lambda place: {'London': (0.0, 0.0), 'Cambridge': (3.0, 0.0)}[place]
+        mock_Map.side_effect = lambda lat, long, **options: Mock(count_green = Mock(return_value = lat))
+        mygraph = Greengraph('London', 'Cambridge', Mock())
+        header = dict(start = 'London', end = 'Cambridge', steps = 4, sampling = 'linear')
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'checkpoint.jsonl')
+            with open(checkpoint, 'w') as record:
+                record.write(json.dumps(header) + '\n[0, 0.0, 0.0, 0]\n5\n{"index": 1}\n[2, "x", 0.0, 2]\n[1, 1.0')
+
+            with patch('Greengraph.graph.os.replace', side_effect = KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    list(mygraph.iter_green_between(4, checkpoint = checkpoint))
+            self.assertEqual(read_checkpoint(checkpoint, header), {0: (0, 0.0, 0.0, 0)})
+            self.assertEqual(os.listdir(directory), ['checkpoint.jsonl'])
+
+            self.assertEqual(len(list(mygraph.iter_green_between(4, checkpoint = checkpoint))), 4)
+            self.assertEqual(mock_Map.call_count, 3)
+
+            with open(checkpoint, 'w') as record:
+                record.write(json.dumps(header)[:20])
+            self.assertEqual(read_checkpoint(checkpoint, header), {})
+
+    @patch('Greengraph.graph.Map')
+    @patch.object(Greengraph, 'geolocate')
+    def test_green_between_adaptive(self, mock_geolocate, mock_Map):
+        """
+        Test the green_between_adaptive method on a route with one sharp change in green space.
+
+        The coarse pass must match green_between, and the refinement must only bisect the
+        segment containing the change, closing in on it until the tile budget is spent.
+        """
+        mock_geolocate.side_effect = lambda place: {'London': (0.0, 0.0), 'Cambridge': (0.0, 1.0)}[place]
+        mock_Map.side_effect = lambda lat, long, **options: Mock(count_green = Mock(return_value = 1000 if long > 0.37 else 0))
+
+        mygraph = Greengraph('London', 'Cambridge', Mock())
+        coarse = mygraph.green_between_adaptive(5, tolerance = 5000, max_tiles = 20, workers = 2)
+        self.assertEqual([count for _, _, _, count in coarse], mygraph.green_between(5))
+
+        samples = mygraph.green_between_adaptive(5, tolerance = 100, max_tiles = 12, workers = 2)
+        positions = [position for position, _, _, _ in samples]
+        counts = [count for _, _, _, count in samples]
+
+        self.assertEqual(len(samples), 12)
+        self.assertEqual(positions, sorted(positions))
+        self.assertEqual(counts, sorted(counts))
+        change = counts.index(1000)
+        self.assertTrue(positions[change - 1] <= 0.37 < positions[change])
+        self.assertLess(positions[change] - positions[change - 1], 0.25 / 2 ** 6)
+        self.assertAlmostEqual(samples[change][2], positions[change])
+
+        with self.assertRaises(ValueError):
+            mygraph.green_between_adaptive(5, tolerance = 100, max_tiles = 12, sampling = 'tile')
+
+    @patch('Greengraph.graph.count_location')
+    def test_count_locations_bounded(self, mock_count_location):
+        """
+        Test that count_locations only takes locations from its iterable as results are read,
+        and that a failed location is yielded in place of its count when requested.
+        """
+        def count_location(location):
+            if location[1] == 5:
+                raise FetchError('HTTP status 403')
+            return location[1]
+        mock_count_location.side_effect = count_location
+
+        taken = []
+        def locations():
+            for index in range(100):
+                taken.append(index)
+                yield (index, (0.0, float(index)))
+
+        results = count_locations(locations(), workers = 2, max_in_flight = 3, return_exceptions = True)
+        first = next(results)
+        self.assertEqual(len(taken), 3)
+
+        results = sorted([first] + list(results), key = lambda result: result[0])
+        self.assertEqual(len(taken), 100)
+        self.assertIsInstance(results[5][3], FetchError)
+        self.assertEqual([result[3] for result in results if result[0] != 5], [index for index in range(100) if index != 5])
+
+        with self.assertRaises(FetchError):
+            list(count_locations(enumerate([(0.0, 4.0), (0.0, 5.0)]), workers = 2))
+
+    @patch.object(MapSession, 'get')
+    @patch.object(Greengraph, 'geolocate')
+    def test_green_sweep(self, mock_geolocate, mock_get):
+        """
+        Test the green_sweep, ratio_histograms and show_green methods.
+
+        This test ensures that a threshold sweep matches counting each threshold separately and
+        green_between, also for thresholds such as 1.15 on which the ratios of some pixels lie,
+        and that the maps are fetched once and retained for every later call.
+        """
+        # Images holding shuffled pairs of green and red values, which include pixels on every threshold
+        random = np.random.default_rng(2015)
+        green, red = np.meshgrid(np.arange(0, 256, 2), np.arange(0, 256, 2))
+        pairs = np.stack([red, green, np.zeros_like(red)], axis = 2).astype(np.uint8).reshape(-1, 3)
+        mock_get.side_effect = lambda url, params: encode_png(random.permutation(pairs).reshape(128, 128, 3))
+        mock_geolocate.side_effect = lambda place: {'London': (51.5, -0.13), 'Cambridge': (52.2, 0.12)}[place]
+
+        mygraph = Greengraph('London', 'Cambridge', Mock())
+        thresholds = [1.0, 1.1, 1.15, 1.5]
+        sweep = mygraph.green_sweep(5, thresholds, workers = 2)
+
+        self.assertEqual(sweep.shape, (5, 4))
+        for column, threshold in enumerate(thresholds):
+            np.testing.assert_array_equal(sweep[:, column], [my_map.count_green(threshold)
+                                                             for my_map in mygraph.retained_maps(5)])
+
+        histograms = mygraph.ratio_histograms(5)
+        self.assertEqual(histograms.shape, (5, 60))
+        np.testing.assert_array_equal(histograms.sum(axis = 1), 128 * 128)
+        self.assertEqual(len(mygraph.show_green(5)), 5)
+        self.assertEqual(mock_get.call_count, 5)
+        np.testing.assert_array_equal(sweep[:, 1], mygraph.green_between(5))
+
+    def test_location_sequence_sampling(self):
+        """
+        Test the geodesic and tile samplings of the location_sequence method.
+
+        Geodesic sampling must keep both ends and the number of steps, while tile sampling
+        of a dense route must keep both ends with images overlapping by at most MAX_OVERLAP,
+        and fall back to geodesic sampling when fewer steps are requested than images needed.
+        """
+        mygraph = Greengraph('London', 'Cambridge', Mock())
+        start, end = (51.5073509, -0.1277583), (52.205337, 0.121817)
+
+        geodesic = mygraph.location_sequence(start, end, 50, 'geodesic')
+        self.assertEqual(geodesic.shape, (50, 2))
+        self.assertAlmostEqual(geodesic[0][0], start[0])
+        self.assertAlmostEqual(geodesic[-1][1], end[1])
+
+        tiles = mygraph.location_sequence(start, end, 50, 'tile')
+        self.assertLess(len(tiles), 10)
+        self.assertAlmostEqual(tiles[-1][0], end[0])
+        for first, second in zip(tiles[:-2], tiles[1:-1]):
+            self.assertLessEqual(geo.overlap(first, second), MAX_OVERLAP)
+            self.assertGreater(geo.overlap(first, second), 0.4)
+
+        np.testing.assert_allclose(mygraph.location_sequence(start, end, 3, 'tile'),
+                                   mygraph.location_sequence(start, end, 3, 'geodesic'))
+
+        with self.assertRaises(ValueError):
+            mygraph.location_sequence(start, end, 50, 'spiral')
+
+    @patch.object(Greengraph, 'geolocate')
+    def test_sample_locations(self, mock_geolocate):
+        """
+        Test that sample_locations gives one location per count, geocoding the route only once.
+        """
+        mock_geolocate.side_effect = lambda place: {'London': (51.5073509, -0.1277583), 'Cambridge': (52.205337, 0.121817),
+                                                    'Atlantis': None}[place]
+        mygraph = Greengraph('London', 'Cambridge', Mock())
+
+        locations = mygraph.sample_locations(50, 'tile')
+        np.testing.assert_allclose(locations, mygraph.location_sequence(*mygraph.endpoints(), 50, 'tile'))
+        self.assertEqual(mock_geolocate.call_count, 2)
+
+        self.assertEqual(Greengraph('London', 'Atlantis', Mock()).sample_locations(5).shape, (0, 2))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
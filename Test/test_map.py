@@ -12,13 +12,15 @@ core functionality of the `Map` class operates as expected.
 """
 
 from Greengraph.graph import Greengraph
-from Greengraph.map import Map
+from Greengraph.map import Map, prefetch
+from Greengraph.session import MapSession
+from Greengraph.classify import GreenKernel
 
-import requests
 import numpy as np
 import matplotlib
 
 import os
+import tempfile
 import yaml
 
 import unittest
@@ -34,9 +36,9 @@ class TestMap(unittest.TestCase):
     Mocks external dependencies like `requests` and `matplotlib` to focus on internal logic.
     """
 
-    @patch.object(requests, 'get')
-    @patch('matplotlib.image.imread')
-    def test_build_default_params(self, mock_imread, mock_get):    
+    @patch.object(MapSession, 'get')
+    @patch('Greengraph.map.decode_image')
+    def test_build_default_params(self, mock_decode_image, mock_get):    
         """
         Test URL parameter construction for the `Map` class.
 
@@ -44,8 +46,8 @@ class TestMap(unittest.TestCase):
         options correctly build the expected URL parameters for the Google Maps API.
         """
         # Mock the image response to be a valid 400x400x3 NumPy array
-        mock_imread.return_value = np.random.rand(400, 400, 3).astype(np.float32)
-        mock_get.return_value.content = b"mock_image_data"
+        mock_decode_image.return_value = np.random.randint(0, 256, (400, 400, 3), dtype = np.uint8)
+        mock_get.return_value = b"mock_image_data"
 
         with open(os.path.join(os.path.dirname(__file__),'data','map_data.yaml')) as dataset:
             map_data = yaml.safe_load(dataset)['test_map'] # Use SafeLoader for YAML
@@ -68,12 +70,17 @@ class TestMap(unittest.TestCase):
                     actual_map = Map(latitude,longitude,size=(300,300))
                 elif (test == 'sensor_true'): 
                     actual_map = Map(latitude,longitude,sensor=True)
+
+                # The request is built on construction but only sent when the pixels are needed
+                self.assertEqual(actual_map.params, params)
+                mock_get.reset_mock()
+                actual_map.pixels
                 
-                mock_get.assert_called_with(url,params=params)
+                mock_get.assert_called_with(url, params)
 
-    @patch.object(requests, 'get')
-    @patch('matplotlib.image.imread')
-    def test_green(self, mock_imread, mock_get):
+    @patch.object(MapSession, 'get')
+    @patch('Greengraph.map.decode_image')
+    def test_green(self, mock_decode_image, mock_get):
         """
         Test the `green` method to verify correct identification of green pixels.
 
@@ -81,8 +88,8 @@ class TestMap(unittest.TestCase):
         values correspond to pixels classified as green based on the input threshold.
         """
         # Mock the image response to be a valid 400x400x3 NumPy array
-        mock_imread.return_value = np.random.rand(400, 400, 3).astype(np.float32)
-        mock_get.return_value.content = b"mock_image_data"
+        mock_decode_image.return_value = np.random.randint(0, 256, (400, 400, 3), dtype = np.uint8)
+        mock_get.return_value = b"mock_image_data"
 
         my_map = Map(51.50, -0.12)
         
@@ -100,8 +107,8 @@ class TestMap(unittest.TestCase):
             np.testing.assert_array_equal(expected_return, actual_return)
 
     @patch.object(Map, 'green')
-    @patch('matplotlib.image.imread')
-    def test_count_green(self, mock_imread, mock_green):
+    @patch('Greengraph.map.decode_image')
+    def test_count_green(self, mock_decode_image, mock_green):
         """
         Test the `count_green` method to verify correct counting of green pixels.
 
@@ -109,7 +116,7 @@ class TestMap(unittest.TestCase):
         when provided with a mocked green pixel matrix.
         """
         # Mock image and green pixel data
-        mock_imread.return_value = np.random.rand(400, 400, 3).astype(np.float32)
+        mock_decode_image.return_value = np.random.randint(0, 256, (400, 400, 3), dtype = np.uint8)
         mock_green.return_value = np.array([[True, False], [True, True]])
 
         my_map = Map(51.50, -0.12)
@@ -117,5 +124,136 @@ class TestMap(unittest.TestCase):
 
         self.assertEqual(result, 3)
 
+    @patch.object(MapSession, 'get')
+    @patch('Greengraph.map.decode_image')
+    def test_lazy_fetch(self, mock_decode_image, mock_get):
+        """
+        Test that a Map makes no request until its pixels are needed, and only one request
+        however often they are used.
+        """
+        mock_decode_image.return_value = np.random.randint(0, 256, (400, 400, 3), dtype = np.uint8)
+        mock_get.return_value = b"mock_image_data"
+
+        my_map = Map(51.50, -0.12)
+        self.assertFalse(my_map.loaded)
+        mock_get.assert_not_called()
+
+        my_map.count_green()
+        my_map.count_green(1.5)
+
+        self.assertTrue(my_map.loaded)
+        self.assertEqual(my_map.image, b"mock_image_data")
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch.object(MapSession, 'get')
+    @patch('Greengraph.map.decode_image')
+    def test_prefetch(self, mock_decode_image, mock_get):
+        """
+        Test that prefetch sends one request per distinct image, shares it between maps
+        with identical requests, and skips maps that are already loaded.
+        """
+        mock_decode_image.return_value = np.random.randint(0, 256, (400, 400, 3), dtype = np.uint8)
+        mock_get.return_value = b"mock_image_data"
+
+        maps = [Map(51.50, -0.12), Map(51.50, -0.12), Map(52.20, 0.12), Map(52.20, 0.12, zoom=12)]
+
+        self.assertEqual(prefetch(maps, workers=2), 3)
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertTrue(all(my_map.loaded for my_map in maps))
+        self.assertIs(maps[0].pixels, maps[1].pixels)
+
+        self.assertEqual(prefetch(maps), 0)
+        self.assertEqual(mock_get.call_count, 3)
+
+    def test_green_sweep(self):
+        """
+        Test that a threshold sweep and the ratio histogram agree with count_green, without fetching again,
+        for every pair of green and red values, and for thresholds on which some of their ratios lie.
+        """
+        my_map = Map(51.50, -0.12)
+        green, red = np.meshgrid(np.arange(256), np.arange(256))
+        my_map.pixels = np.stack([red, green, np.zeros_like(red)], axis = 2).astype(np.uint8)
+        thresholds = [0.9, 0.95, 1.1, 1.15, 1.3]
+
+        np.testing.assert_array_equal(my_map.green_sweep(thresholds),
+                                      [my_map.count_green(threshold) for threshold in thresholds])
+        self.assertEqual(my_map.ratio_histogram().sum(), 256 * 256)
+
+    def test_approximate(self):
+        """
+        Test that approximate counts are selected per call or for every map, that they stop
+        before classifying every pixel, and that 0 selects exact counts.
+        """
+        my_map = Map(51.50, -0.12)
+        my_map.pixels = np.random.default_rng(2024).integers(0, 256, (400, 400, 3), dtype = np.uint8)
+        exact = my_map.count_green()
+        with patch.object(GreenKernel, 'count', autospec = True, side_effect = GreenKernel.count) as mock_count:
+            estimate, error = my_map.estimate_green(tolerance = 0.01)
+
+        # Each call classifies one of the 16 interleaved sub-grids of the image
+        self.assertLess(mock_count.call_count, 16)
+        self.assertGreater(error, 0)
+        self.assertLessEqual(abs(estimate - exact), error)
+        self.assertEqual(my_map.count_green(approximate = 0.01), estimate)
+
+        with patch.object(Map, 'approximate', 0.01):
+            self.assertEqual(my_map.count_green(), estimate)
+            self.assertEqual(my_map.count_green(approximate = 0), exact)
+
+    @patch.object(MapSession, 'get')
+    @patch('Greengraph.map.decode_image')
+    def test_green_index(self, mock_decode_image, mock_get):
+        """
+        Test that the green index of a map agrees with count_green, and that a persisted
+        index is loaded without fetching the image.
+        """
+        mock_decode_image.return_value = np.random.randint(0, 256, (400, 400, 3), dtype = np.uint8)
+        mock_get.return_value = b"mock_image_data"
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.npz')
+            index = Map(51.50, -0.12).green_index(path = path)
+            self.assertEqual(index.total, Map(51.50, -0.12).count_green())
+            self.assertEqual(mock_get.call_count, 2)
+
+            reloaded = Map(51.50, -0.12).green_index(path = path)
+            self.assertEqual(mock_get.call_count, 2)
+
+        np.testing.assert_array_equal(reloaded.table, index.table)
+
+    @patch.object(MapSession, 'get')
+    @patch('Greengraph.map.decode_image')
+    def test_green_index_mismatch(self, mock_decode_image, mock_get):
+        """
+        Test that an index persisted for another threshold or map is rebuilt and replaced,
+        and that a map keeps the index of its last threshold only.
+        """
+        mock_decode_image.return_value = np.random.default_rng(14).integers(0, 256, (400, 400, 3), dtype = np.uint8)
+        mock_get.return_value = b"mock_image_data"
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.npz')
+            Map(51.50, -0.12).green_index(1.1, path = path)
+
+            index = Map(51.50, -0.12).green_index(2.0, path = path)
+            self.assertEqual(index.threshold, 2.0)
+            self.assertEqual(index.total, Map(51.50, -0.12).count_green(2.0))
+            self.assertEqual(mock_get.call_count, 3)
+
+            other = Map(51.60, -0.12).green_index(2.0, path = path)
+            self.assertEqual(other.key, Map(51.60, -0.12).request_key)
+            self.assertEqual(mock_get.call_count, 4)
+
+            reloaded = Map(51.60, -0.12).green_index(2.0, path = path)
+            self.assertEqual(mock_get.call_count, 4)
+
+        self.assertEqual(reloaded.total, other.total)
+
+        my_map = Map(51.50, -0.12)
+        first = my_map.green_index(1.1)
+        self.assertIs(my_map.green_index(1.1), first)
+        my_map.green_index(2.0)
+        self.assertEqual(list(my_map._indexes), [2.0])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
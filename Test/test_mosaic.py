@@ -0,0 +1,128 @@
+"""
+Unit tests for the Mosaic class in the mosaic.py module.
+
+The map API is replaced by a synthetic world, rendering the image requested for any
+centre, zoom and size from a fixed pattern of green and grey stripes in global pixel
+coordinates. This module includes tests to validate the following functionality:
+- The grid cells covered by the images centred on a set of locations.
+- Counting each location from the mosaic gives the same result as fetching its own image.
+- The mosaic fetches each grid image once, however dense the locations.
+- Only the cells touched by a route are stored and indexed, not its bounding box.
+- At most INDEX_CELLS summed-area tables are kept, whatever the number of cells and thresholds.
+"""
+
+from Greengraph import mosaic as mosaic_module
+from Greengraph.mosaic import Mosaic, grid_cells, window_origin
+from Greengraph.graph import Greengraph
+from Greengraph.map import Map
+from Greengraph.session import MapSession
+from Greengraph.decode import encode_png
+
+import numpy as np
+
+import unittest
+from unittest.mock import patch
+
+def render(url: str, params: dict) -> bytes:
+    """
+    Render the image of the synthetic world requested by a map.
+    """
+    lat, long = map(float, params['center'].split(','))
+    width, height = map(int, params['size'].split('x'))
+    left, top = window_origin((lat, long), params['zoom'], (width, height))
+
+    columns = np.arange(left, left + width)[np.newaxis, :]
+    rows = np.arange(top, top + height)[:, np.newaxis]
+    green = (columns // 50 + rows // 30) % 3 == 0
+    pixels = np.where(green[:, :, np.newaxis], np.uint8([20, 200, 20]), np.uint8([120, 120, 120]))
+    return encode_png(pixels.astype(np.uint8))
+
+class TestMosaic(unittest.TestCase):
+    """
+    Unit tests for the `Mosaic` class and the grid functions.
+    """
+
+    def setUp(self):
+        self.locations = np.vstack([np.linspace(51.5, 51.7, 25), np.linspace(-0.13, 0.12, 25)]).transpose()
+
+    def test_grid_cells(self):
+        """
+        Test that an image covers at most four cells, and exactly one when it is aligned with the grid.
+        """
+        self.assertLessEqual(len(grid_cells([(51.5, -0.13)])), 4)
+
+        aligned = Mosaic([(0.0, 0.0)], zoom = 2, size = (256, 256))
+        # The centre of the world is a corner of four cells at this size
+        self.assertEqual(len(aligned.cells), 4)
+        aligned.close()
+
+    @patch.object(MapSession, 'get', side_effect = render)
+    def test_counts_match_maps(self, mock_get):
+        """
+        Test that the count of each location taken from the mosaic matches the count of its own image,
+        and that the mosaic needs fewer requests than there are locations.
+        """
+        with Mosaic(self.locations) as mosaic:
+            fetched = mosaic.fetch(workers = 4)
+            counts = [mosaic.count_green(location) for location in self.locations]
+
+        self.assertEqual(fetched, mock_get.call_count)
+        self.assertLess(fetched, len(self.locations))
+
+        expected = [Map(*location).count_green() for location in self.locations]
+        self.assertEqual(counts, expected)
+        self.assertGreater(min(counts), 0)
+
+    @patch.object(MapSession, 'get', side_effect = render)
+    def test_cells_only(self, mock_get):
+        """
+        Test that a diagonal route stores only the cells it touches rather than its bounding box,
+        and that windows spanning several cells are assembled from them.
+        """
+        locations = np.vstack([np.linspace(51.5, 53.5, 40), np.linspace(-2.0, 1.0, 40)]).transpose()
+        with Mosaic(locations) as mosaic:
+            mosaic.fetch(workers = 4)
+            columns = {column for column, _ in mosaic.cells}
+            rows = {row for _, row in mosaic.cells}
+            self.assertEqual(mosaic.pixels.shape, (len(mosaic.cells), 400, 400, 3))
+            self.assertLess(len(mosaic.cells), len(columns) * len(rows) / 2)
+
+            for location in locations[::13]:
+                np.testing.assert_array_equal(mosaic.window(location), Map(*location).pixels)
+            self.assertEqual(mosaic.counts(locations[::13]), [Map(*location).count_green() for location in locations[::13]])
+            self.assertEqual(mosaic.count_green((0.0, 0.0)), 0)
+
+    @patch.object(MapSession, 'get', side_effect = render)
+    def test_index_bound(self, mock_get):
+        """
+        Test that the mosaic keeps at most INDEX_CELLS summed-area tables, for any number of cells
+        and thresholds, while still counting every window as its own image does.
+        """
+        locations = np.vstack([np.linspace(51.5, 53.5, 40), np.linspace(-2.0, 1.0, 40)]).transpose()
+        with patch.object(mosaic_module, 'INDEX_CELLS', 3), Mosaic(locations) as mosaic:
+            mosaic.fetch(workers = 4)
+            self.assertGreater(len(mosaic.cells), 3)
+            for threshold in (1.1, 1.3):
+                expected = [Map(*location).count_green(threshold) for location in locations[::7]]
+                self.assertEqual(mosaic.counts(locations[::7], threshold), expected)
+                self.assertLessEqual(len(mosaic._indexes), 3)
+            self.assertEqual(len(mosaic.green_index(1.2)), len(mosaic.cells))
+            self.assertLessEqual(len(mosaic._indexes), 3)
+
+    @patch.object(MapSession, 'get', side_effect = render)
+    @patch.object(Greengraph, 'geolocate')
+    def test_green_between_mosaic(self, mock_geolocate, mock_get):
+        """
+        Test that green_between_mosaic returns the same counts as green_between.
+        """
+        mock_geolocate.side_effect = [(51.5, -0.13), (51.7, 0.12)] * 2
+        mygraph = Greengraph('London', 'Cambridge', object())
+
+        mosaic_counts = mygraph.green_between_mosaic(25, workers = 4)
+        requests = mock_get.call_count
+
+        self.assertEqual(mosaic_counts, mygraph.green_between(25))
+        self.assertLess(requests, 25)
+
+if __name__ == '__main__':
+    unittest.main()
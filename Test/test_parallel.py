@@ -0,0 +1,103 @@
+"""
+Unit tests for the process pool classification in the parallel.py module.
+
+This module includes tests to validate the following functionality:
+- A ClassifyPool counts encoded images exactly as the in-process kernels do.
+- Invalid images are reported in place of their count rather than stopping the pool.
+- count_locations yields every location in order, across several chunks, and matches
+  the thread pool path of the graph module.
+"""
+
+from Greengraph import parallel, graph, classify
+from Greengraph.parallel import ClassifyPool
+from Greengraph.session import FetchError, MapSession
+from Greengraph.classify import count_green_batch
+from Greengraph.decode import encode_png
+
+import numpy as np
+
+import unittest
+from unittest.mock import patch
+
+def render(url: str, params: dict) -> bytes:
+    """
+    Render a 10x10 image whose number of green pixels is the longitude of its centre plus 50.
+    """
+    long = float(params['center'].split(',')[1])
+    pixels = np.full((100, 3), 120, dtype = np.uint8)
+    pixels[:int(long) + 50] = [20, 200, 20]
+    return encode_png(pixels.reshape(10, 10, 3))
+
+class TestParallel(unittest.TestCase):
+    """
+    Unit tests for the `ClassifyPool` class and the count_locations function.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = ClassifyPool(processes = 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_count(self):
+        """
+        Test that the pool counts images of several shapes as count_green_batch does, in order.
+        """
+        random = np.random.default_rng(2015)
+        images = [random.integers(0, 256, size = (height, 30, 3), dtype = np.uint8) for height in (20, 40, 20, 10, 40)]
+
+        counts = self.pool.count([encode_png(pixels) for pixels in images], 1.1)
+
+        self.assertEqual(counts, [int(count_green_batch([pixels])[0]) for pixels in images])
+        self.assertEqual(self.pool.count([]), [])
+
+        approximate = self.pool.submit([encode_png(pixels) for pixels in images], 1.1, approximate = 0.05).result()
+        self.assertEqual(approximate, [classify.estimate_green(pixels, 1.1, 0.05)[0] for pixels in images])
+
+    def test_invalid_image(self):
+        """
+        Test that an invalid image gives a FetchError in its place.
+        """
+        counts = self.pool.count([encode_png(np.zeros((4, 4, 3), dtype = np.uint8)), b'not an image'])
+
+        self.assertEqual(counts[0], 0)
+        self.assertIsInstance(counts[1], FetchError)
+
+    @patch.object(parallel, 'CHUNK_SIZE', 4)
+    @patch.object(MapSession, 'get', side_effect = render)
+    def test_count_locations(self, mock_get):
+        """
+        Test that count_locations yields every location in order over several chunks,
+        matching the thread pool path.
+        """
+        locations = [(index, (0.0, float(index - 20))) for index in range(10)]
+
+        results = list(parallel.count_locations(locations, workers = 3, pool = self.pool))
+
+        self.assertEqual([index for index, _, _, _ in results], list(range(10)))
+        self.assertEqual([count for _, _, _, count in results], [index + 30 for index in range(10)])
+        self.assertEqual(results, sorted(graph.count_locations(locations, workers = 3)))
+
+    @patch.object(MapSession, 'get')
+    def test_fetch_error(self, mock_get):
+        """
+        Test that a failed fetch is raised, or yielded in place of the count when requested.
+        """
+        def get(url, params):
+            if params['center'] != '0.0,0.0':
+                raise FetchError('HTTP status 403')
+            return render(url, params)
+        mock_get.side_effect = get
+        locations = [(0, (0.0, 0.0)), (1, (0.0, 1.0))]
+
+        results = list(parallel.count_locations(locations, pool = self.pool, return_exceptions = True))
+        self.assertEqual(results[0], (0, 0.0, 0.0, 50))
+        self.assertIsInstance(results[1][3], FetchError)
+
+        with self.assertRaises(FetchError):
+            list(parallel.count_locations(locations, pool = self.pool))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Unit tests for the instrumentation hooks in the profiling.py module.
+
+This module includes tests to validate the following functionality:
+- Hooks do nothing while instrumentation is disabled.
+- Stage timers and counters are collected while a profiler is enabled.
+- Cache hit rates are derived from the hit and miss counters.
+- The fetch, decode, classify and geolocate stages of the pipeline report to the profiler.
+"""
+
+from Greengraph import profiling
+from Greengraph.graph import Greengraph
+from Greengraph.map import Map
+from Greengraph.session import MapSession
+from Greengraph.decode import encode_png
+
+import json
+import numpy as np
+
+import unittest
+from unittest.mock import Mock, patch
+
+class TestProfiling(unittest.TestCase):
+    """
+    Unit tests for the `Profiler` class and the module-level hooks.
+    """
+
+    def tearDown(self):
+        profiling.disable()
+
+    def test_disabled(self):
+        """
+        Test that hooks record nothing and share one no-op context manager while disabled.
+        """
+        self.assertIsNone(profiling.active())
+        self.assertIs(profiling.stage('fetch'), profiling.stage('decode'))
+
+        with profiling.stage('fetch'):
+            profiling.count('http.requests')
+
+    def test_report(self):
+        """
+        Test that stage calls, counters and cache hit rates are reported.
+        """
+        profiler = profiling.enable()
+        for _ in range(3):
+            with profiling.stage('fetch'):
+                pass
+        profiling.count('tile.cache_hits', 3)
+        profiling.count('tile.cache_misses')
+        profiling.count('http.bytes', 1024)
+
+        report = profiler.report()
+
+        self.assertEqual(report['stages']['fetch']['calls'], 3)
+        self.assertEqual(report['counters']['http.bytes'], 1024)
+        self.assertEqual(report['hit_rates'], {'tile': 0.75})
+        json.dumps(report)
+        self.assertIn('fetch', profiler.format())
+
+    @patch.object(MapSession, 'get')
+    def test_pipeline_stages(self, mock_get):
+        """
+        Test that geolocating and counting a map report the geolocate, fetch, decode and
+        classify stages.
+        """
+        mock_get.return_value = encode_png(np.zeros((4, 4, 3), dtype = np.uint8))
+        geocoder = Mock()
+        geocoder.geocode.return_value = ('London', (51.5073509, -0.1277583))
+
+        profiler = profiling.enable()
+        Greengraph('London', 'Cambridge', geocoder).geolocate('London')
+        Map(51.50, -0.12).count_green()
+
+        stages = profiler.report()['stages']
+        for stage in ('geolocate', 'fetch', 'decode', 'classify'):
+            self.assertEqual(stages[stage]['calls'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
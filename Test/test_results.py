@@ -0,0 +1,117 @@
+"""
+Unit tests for the ResultStore class in the results.py module.
+
+This module includes tests to validate the following functionality:
+- Results appended over several sessions are read back as typed, memory-mapped records.
+- Routes are numbered once by key, and their metadata is kept in the route table.
+- Queries select records by route, step, bounding box, zoom and threshold.
+- A partially written last record is dropped, and files that are not stores are refused.
+"""
+
+from Greengraph.results import ResultStore, RECORD, HEADER, route_key
+from Greengraph import batch
+
+import os
+import numpy as np
+import tempfile
+
+import unittest
+from unittest.mock import Mock, patch
+
+class TestResultStore(unittest.TestCase):
+    """
+    Unit tests for the `ResultStore` class.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'runs.ggr')
+
+    def fill(self) -> ResultStore:
+        store = ResultStore(self.path)
+        first = store.add_route(route_key('London', 'Cambridge', 3), start = 'London', end = 'Cambridge', steps = 3)
+        second = store.add_route(route_key('London', 'Oxford', 2), start = 'London', end = 'Oxford', steps = 2)
+        store.append(first, [(0, 51.5, -0.1, 10), (1, 51.8, 0.0, 20), (2, 52.2, 0.1, 30)])
+        store.append(second, [(0, 51.5, -0.1, 10), (1, 51.7, -1.2, 5)], zoom = 12, threshold = 1.3)
+        return store
+
+    def test_append_and_reopen(self):
+        """
+        Test that records and routes persist across sessions, with their typed fields.
+        """
+        self.fill()
+        store = ResultStore(self.path)
+
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.add_route(route_key('London', 'Oxford', 2)), 1)
+        self.assertEqual(store.routes[0]['end'], 'Cambridge')
+
+        records = store.records()
+        self.assertIsInstance(records, np.memmap)
+        self.assertEqual(records.dtype, RECORD)
+        np.testing.assert_array_equal(records['green'], [10, 20, 30, 10, 5])
+        np.testing.assert_array_equal(records['zoom'], [10, 10, 10, 12, 12])
+        self.assertEqual(os.path.getsize(self.path), HEADER.itemsize + 5 * RECORD.itemsize)
+
+    def test_query(self):
+        """
+        Test selecting records by route number or key, steps, bounds, zoom and threshold.
+        """
+        store = self.fill()
+        oxford = route_key('London', 'Oxford', 2)
+
+        self.assertEqual(len(store.query(route = 0)), 3)
+        np.testing.assert_array_equal(store.query(route = oxford)['green'], [10, 5])
+        np.testing.assert_array_equal(store.query(route = [0, oxford], steps = range(1, 3))['green'], [20, 30, 5])
+        np.testing.assert_array_equal(store.query(bounds = (51.6, -0.5, 52.0, 0.5))['green'], [20])
+        self.assertEqual(len(store.query(zoom = 12, threshold = 1.3)), 2)
+        self.assertEqual(len(store.query(route = 'Atlantis')), 0)
+
+    def test_green_between(self):
+        """
+        Test that the counts of a route are returned in step order, using the last record of a repeated step.
+        """
+        store = self.fill()
+        store.append(0, [(1, 51.8, 0.0, 25)])
+
+        np.testing.assert_array_equal(store.green_between(0), [10, 25, 30])
+        self.assertEqual(len(ResultStore(os.path.join(self.directory.name, 'empty.ggr')).green_between(0)), 0)
+
+    def test_partial_record(self):
+        """
+        Test that a partially written last record is dropped, and that other files are refused.
+        """
+        self.fill()
+        with open(self.path, 'ab') as store:
+            store.write(b'\x01\x02\x03')
+
+        self.assertEqual(len(ResultStore(self.path)), 5)
+        self.assertEqual(os.path.getsize(self.path), HEADER.itemsize + 5 * RECORD.itemsize)
+
+        other = os.path.join(self.directory.name, 'other.ggr')
+        with open(other, 'w') as text:
+            text.write('not a result store')
+        with self.assertRaises(ValueError):
+            ResultStore(other)
+
+    @patch('Greengraph.graph.count_location')
+    def test_run_batch(self, mock_count_location):
+        """
+        Test that a batch appends the coordinates and count of every step of each route.
+        """
+        mock_count_location.side_effect = lambda location: location[1]
+        geocoder = Mock()
+        geocoder.geocode.side_effect = lambda place, exactly_one: (place, {'London': (0.0, 0.0), 'Cambridge': (0.0, 3.0)}[place])
+
+        store = ResultStore(self.path)
+        routes = [{'id': 'a', 'from': 'London', 'to': 'Cambridge', 'steps': 4}]
+        batch.run_batch(routes, os.path.join(self.directory.name, 'results.jsonl'), geocoder = geocoder, store = store)
+
+        records = store.query(route = route_key('London', 'Cambridge', 4))
+        np.testing.assert_array_equal(records['long'], [0, 1, 2, 3])
+        np.testing.assert_array_equal(records['green'], [0, 1, 2, 3])
+        self.assertEqual(store.routes[0]['id'], 'a')
+
+if __name__ == '__main__':
+    unittest.main()
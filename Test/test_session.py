@@ -0,0 +1,173 @@
+"""
+Unit tests for the `MapSession` and `TokenBucket` classes in the session.py module.
+
+The session is exercised against a stub HTTP server running on localhost, which answers
+each request with the next status code from a scripted list. This module tests:
+- Successful requests and connection reuse.
+- Retries with backoff for 429 and 5xx responses, waiting for a Retry-After delay only up to a limit.
+- Immediate failure for other error statuses and for empty responses.
+- Read timeouts.
+- Rate limiting with the token bucket.
+- That a Map raises FetchError instead of inventing pixels for an invalid image.
+"""
+
+from Greengraph.session import FetchError, MapSession, TokenBucket
+from Greengraph.map import Map
+
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import unittest
+from unittest.mock import patch
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers each request with the next scripted (status, body, delay) response, optionally
+    followed by a dictionary of headers.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.client_address[1]))
+        status, body, delay, *headers = server.responses.pop(0) if server.responses else (200, b"image", 0)
+        time.sleep(delay)
+        self.send_response(status)
+        for name, value in (headers[0] if headers else {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestMapSession(unittest.TestCase):
+    """
+    Unit tests for the `MapSession` class against a local stub server.
+    """
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.responses = []
+        self.server.requests = []
+        thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/staticmap"
+        self.session = MapSession(backoff = 0.01, timeout = (1.0, 0.5))
+        self.addCleanup(self.session.close)
+
+    def test_get_reuses_connection(self):
+        """
+        Test that content is returned, parameters are sent, and consecutive requests
+        share one keep-alive connection.
+        """
+        self.assertEqual(self.session.get(self.url, {'zoom': 10}), b"image")
+        self.assertEqual(self.session.get(self.url, {'zoom': 11}), b"image")
+
+        (first_path, first_port), (second_path, second_port) = self.server.requests
+        self.assertTrue(first_path.endswith("zoom=10"))
+        self.assertEqual(first_port, second_port)
+
+    def test_retry_transient_statuses(self):
+        """
+        Test that 429 and 5xx responses are retried until the request succeeds.
+        """
+        self.server.responses = [(429, b"", 0), (503, b"", 0), (200, b"image", 0)]
+
+        self.assertEqual(self.session.get(self.url, {}), b"image")
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_retry_after(self):
+        """
+        Test that a Retry-After delay is waited for up to max_retry_after, and that a
+        longer delay fails the request at once.
+        """
+        self.session.max_retry_after = 1.0
+        self.server.responses = [(429, b"", 0, {"Retry-After": "0.2"}), (200, b"image", 0),
+                                 (429, b"", 0, {"Retry-After": "3600"})]
+
+        started = time.monotonic()
+        self.assertEqual(self.session.get(self.url, {}), b"image")
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+        started = time.monotonic()
+        with self.assertRaisesRegex(FetchError, "retry after 3600"):
+            self.session.get(self.url, {})
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_retries_exhausted(self):
+        """
+        Test that a request failing on every attempt raises FetchError after the retries.
+        """
+        self.server.responses = [(500, b"", 0)] * 4
+
+        with self.assertRaises(FetchError):
+            self.session.get(self.url, {})
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_no_retry_for_client_errors(self):
+        """
+        Test that other error statuses and empty responses fail without retrying.
+        """
+        self.server.responses = [(403, b"denied", 0), (200, b"", 0)]
+
+        with self.assertRaises(FetchError):
+            self.session.get(self.url, {})
+        with self.assertRaises(FetchError):
+            self.session.get(self.url, {})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_timeout(self):
+        """
+        Test that a response slower than the read timeout is retried, and fails once the
+        retries are exhausted.
+        """
+        session = MapSession(retries = 1, backoff = 0.01, timeout = (1.0, 0.1))
+        self.addCleanup(session.close)
+        self.server.responses = [(200, b"image", 0.3)] * 2
+
+        with self.assertRaises(FetchError):
+            session.get(self.url, {})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_map_fetches_through_session(self):
+        """
+        Test that a Map fetches through Map.session and raises FetchError, rather than
+        inventing random pixels, when the response is not a valid image.
+        """
+        my_map = Map(51.50, -0.12)
+        my_map.base = self.url
+
+        with patch.object(Map, 'session', self.session):
+            with self.assertRaises(FetchError):
+                my_map.pixels
+
+        self.assertEqual(len(self.server.requests), 1)
+
+class TestTokenBucket(unittest.TestCase):
+    """
+    Unit tests for the `TokenBucket` rate limiter.
+    """
+
+    def test_rate_limit(self):
+        """
+        Test that the bucket allows a burst up to its capacity and then spaces requests
+        at its rate.
+        """
+        bucket = TokenBucket(rate = 50, capacity = 2)
+
+        start = time.monotonic()
+        waits = [bucket.acquire() for _ in range(7)]
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertGreaterEqual(elapsed, 0.09)
+
+if __name__ == '__main__':
+    unittest.main()
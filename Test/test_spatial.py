@@ -0,0 +1,64 @@
+"""
+Unit tests for the TileIndex class in the spatial.py module.
+
+This module includes tests to validate the following functionality:
+- Centres within the tolerance snap to the first indexed centre, even across grid cells.
+- Centres beyond the tolerance, or at another zoom, are indexed as new tiles.
+- Values such as green pixel counts are shared by every centre of a tile.
+"""
+
+from Greengraph.spatial import TileIndex
+from Greengraph import geo
+
+import unittest
+
+class TestTileIndex(unittest.TestCase):
+    """
+    Unit tests for the `TileIndex` class.
+    """
+
+    def test_snap(self):
+        """
+        Test that nearby centres share the first indexed centre, and distant ones do not.
+        """
+        index = TileIndex(zoom = 10, tolerance = 2)
+        london = (51.5073509, -0.1277583)
+
+        self.assertEqual(index.snap(london), london)
+        self.assertEqual(index.snap((51.5074, -0.1278)), london)
+        self.assertEqual(index.snap((51.5073509, -0.1177583)), (51.5073509, -0.1177583))
+        self.assertEqual(len(index), 2)
+        self.assertIsNone(index.nearest((52.205337, 0.121817)))
+
+        with self.assertRaises(ValueError):
+            TileIndex(tolerance = 0)
+
+    def test_neighbouring_cells(self):
+        """
+        Test that a centre just across a grid cell boundary from an indexed centre is found.
+        """
+        index = TileIndex(zoom = 10, tolerance = 2)
+        x, y = geo.to_pixels(0.0, 0.0, 10)
+        boundary = (x // 2 + 1) * 2
+        before = tuple(map(float, geo.from_pixels(boundary - 0.5, y, 10)))
+        after = tuple(map(float, geo.from_pixels(boundary + 0.5, y, 10)))
+
+        index.snap(before)
+        self.assertEqual(index.nearest(after), before)
+        self.assertIsNone(TileIndex(zoom = 12, tolerance = 2).nearest(after))
+
+    def test_values(self):
+        """
+        Test that a value put for one centre is returned for every centre of its tile.
+        """
+        index = TileIndex(tolerance = 2)
+        self.assertEqual(index.get((10.0, 10.0), 'missing'), 'missing')
+
+        index.snap((10.0, 10.0))
+        self.assertIsNone(index.get((10.0, 10.0)))
+        self.assertEqual(index.put((10.0001, 10.0001), 250), (10.0, 10.0))
+        self.assertEqual(index.get((9.9999, 10.0)), 250)
+        self.assertEqual(len(index), 1)
+
+if __name__ == '__main__':
+    unittest.main()
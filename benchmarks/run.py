@@ -0,0 +1,174 @@
+"""
+Benchmark suite for the Greengraph fetch, decode and classify pipeline.
+
+Run from the repository root with:
+
+    python -m benchmarks.run --output bench_output.json
+
+The suite times:
+- Map.green and Map.count_green, and count_green_batch, over representative image sizes.
+- Decoding a PNG tile with each available decoder.
+- Greengraph.location_sequence at large step counts.
+- Greengraph.green_between end to end against a local fake tile server with configurable latency.
+
+Results are written as JSON, together with the package, Python and numpy versions, so
+that runs of different versions can be compared to track regressions.
+"""
+
+import sys
+import json
+import time
+import platform
+import statistics
+import numpy as np
+from argparse import ArgumentParser
+
+from Greengraph.graph import Greengraph
+from Greengraph.map import Map
+from Greengraph.session import MapSession
+from Greengraph.classify import count_green_batch
+from Greengraph import decode
+from benchmarks.tileserver import TileServer, synthetic_tile
+
+class StaticGeocoder(object):
+    """
+    A geocoder returning fixed coordinates, so that benchmarks make no geocoding requests.
+    """
+    places = {'start': (51.5073509, -0.1277583), 'end': (52.205337, 0.121817)}
+
+    def geocode(self, place, exactly_one = True):
+        return (place, self.places[place])
+
+def bench(name: str, function, repeats: int, **params) -> dict:
+    """
+    Time repeated calls of a function.
+
+    Args:
+        name (str): The name of the benchmark.
+        function: The function to call without arguments.
+        repeats (int): The number of timed calls, after one untimed warm-up call.
+        **params: Parameters of the benchmark recorded with the result.
+
+    Returns:
+        dict: The name, parameters and the minimum, median and mean time in seconds.
+    """
+    function()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    result = dict(name = name, params = params, repeats = repeats,
+                  min = min(timings), median = statistics.median(timings), mean = statistics.mean(timings))
+    print(f"{name:<28} {json.dumps(params):<40} median {result['median'] * 1000:10.3f} ms", file = sys.stderr)
+    return result
+
+def classify_benchmarks(sizes: list, repeats: int) -> list:
+    results = []
+    for size in sizes:
+        pixels = synthetic_tile(size, size)
+        my_map = Map(0.0, 0.0, size = (size, size))
+        my_map.pixels = pixels
+        results.append(bench('green', lambda: my_map.green(1.1), repeats, size = size))
+        results.append(bench('count_green', lambda: my_map.count_green(), repeats, size = size))
+
+        # The float32 images formerly returned by matplotlib, for comparison
+        float_map = Map(0.0, 0.0, size = (size, size))
+        float_map.pixels = pixels.astype(np.float32) / 255
+        results.append(bench('count_green_float32', lambda: float_map.count_green(), repeats, size = size))
+
+        stack = np.stack([pixels] * 16)
+        results.append(bench('count_green_batch', lambda: count_green_batch(stack), repeats, size = size, images = 16))
+        results.append(bench('count_green_batch_sweep', lambda: count_green_batch(stack, np.linspace(0.9, 1.5, 13)),
+                             repeats, size = size, images = 16, thresholds = 13))
+    return results
+
+def decode_benchmarks(sizes: list, repeats: int) -> list:
+    results = []
+    for size in sizes:
+        data = decode.encode_png(synthetic_tile(size, size))
+        results.append(bench('decode_image', lambda: decode.decode_image(data), repeats, size = size, bytes = len(data)))
+        results.append(bench('decode_png', lambda: decode.decode_png(data), repeats, size = size, bytes = len(data)))
+        try:
+            from io import BytesIO
+            from matplotlib import image as img
+        except ImportError:
+            continue
+        results.append(bench('matplotlib_imread', lambda: img.imread(BytesIO(data)), repeats, size = size, bytes = len(data)))
+    return results
+
+def sequence_benchmarks(step_counts: list, repeats: int) -> list:
+    graph = Greengraph('start', 'end', StaticGeocoder())
+    start, end = StaticGeocoder.places['start'], StaticGeocoder.places['end']
+    return [bench('location_sequence', lambda: graph.location_sequence(start, end, steps), repeats, steps = steps)
+            for steps in step_counts]
+
+def end_to_end_benchmarks(steps: int, worker_counts: list, latency: float, repeats: int) -> list:
+    server = TileServer(latency = latency)
+    base, session, cache = Map.base, Map.session, Map.cache
+    Map.base, Map.session, Map.cache = server.url, MapSession(pool_size = max(worker_counts)), None
+
+    try:
+        graph = Greengraph('start', 'end', StaticGeocoder())
+        return [bench('green_between', lambda: graph.green_between(steps, workers = workers), repeats,
+                      steps = steps, workers = workers, latency = latency)
+                for workers in worker_counts]
+    finally:
+        Map.session.close()
+        Map.base, Map.session, Map.cache = base, session, cache
+        server.close()
+
+def package_version() -> str:
+    try:
+        from importlib.metadata import version
+        return version('Greengraph')
+    except Exception:
+        return 'unknown'
+
+def main(argv = None) -> dict:
+    """
+    Run the benchmark suite and write its results.
+
+    Args:
+        argv (list): Optional command-line arguments. Defaults to sys.argv.
+
+    Returns:
+        dict: The results document written to the output file.
+    """
+    parser = ArgumentParser(description = "Benchmark the Greengraph fetch, decode and classify pipeline.")
+    parser.add_argument('-o', '--output', default='bench_output.json',
+                        help='Enter the JSON file the results are written to. Default set to "bench_output.json".')
+    parser.add_argument('-r', '--repeats', type=int, default=5,
+                        help='Enter the number of timed repeats of each benchmark. Default set to 5.')
+    parser.add_argument('-l', '--latency', type=float, default=0.05,
+                        help='Enter the latency of the fake tile server in seconds. Default set to 0.05.')
+    parser.add_argument('-s', '--steps', type=int, default=40,
+                        help='Enter the number of steps of the end-to-end route. Default set to 40.')
+    parser.add_argument('-q', '--quick', action='store_true',
+                        help='Run a reduced set of sizes and step counts.')
+    arguments = parser.parse_args(argv)
+
+    sizes = [400] if arguments.quick else [200, 400, 640, 1280]
+    step_counts = [1000] if arguments.quick else [1000, 100000, 1000000]
+    worker_counts = [1, 8] if arguments.quick else [1, 4, 16]
+
+    results = (classify_benchmarks(sizes, arguments.repeats)
+               + decode_benchmarks(sizes, arguments.repeats)
+               + sequence_benchmarks(step_counts, arguments.repeats)
+               + end_to_end_benchmarks(arguments.steps, worker_counts, arguments.latency, max(1, arguments.repeats // 2)))
+
+    document = dict(
+        greengraph = package_version(),
+        python = platform.python_version(),
+        numpy = np.__version__,
+        platform = platform.platform(),
+        created = time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        results = results)
+
+    with open(arguments.output, 'w') as output:
+        json.dump(document, output, indent = 2)
+    return document
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+A local fake static map server for benchmarking Greengraph without the Google Maps API.
+
+The server answers every request with a PNG tile of the requested size after a
+configurable latency, so that end-to-end benchmarks measure Greengraph's own overhead
+and concurrency rather than the network.
+"""
+
+import re
+import time
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Greengraph.decode import encode_png
+
+class TileHandler(BaseHTTPRequestHandler):
+    """
+    Serves a PNG tile of the requested size after the server's latency.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        match = re.search(r"size=(\d+)x(\d+)", self.path)
+        size = (int(match.group(1)), int(match.group(2))) if match else (400, 400)
+        body = self.server.tile(size)
+
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.requests += 1
+
+    def log_message(self, *args):
+        pass
+
+class TileServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server returning synthetic satellite-like tiles.
+
+    Attributes:
+        latency (float): The delay before each response in seconds.
+        requests (int): The number of requests answered so far.
+        url (str): The base URL to assign to Map.base.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.05, seed: int = 2015):
+        """
+        Start a TileServer on a free localhost port.
+
+        Args:
+            latency (float): The delay before each response in seconds. Default is 0.05.
+            seed (int): The seed of the synthetic tile content. Default is 2015.
+        """
+        super().__init__(("127.0.0.1", 0), TileHandler)
+        self.latency = latency
+        self.requests = 0
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/maps/api/staticmap?"
+        self._seed = seed
+        self._tiles = {}
+        self._lock = threading.Lock()
+        threading.Thread(target = self.serve_forever, daemon = True).start()
+
+    def tile(self, size: tuple) -> bytes:
+        """
+        Return the encoded tile of a size, generating it on first use.
+
+        Args:
+            size (tuple): The (width, height) of the tile.
+
+        Returns:
+            bytes: The PNG tile.
+        """
+        with self._lock:
+            if size not in self._tiles:
+                self._tiles[size] = encode_png(synthetic_tile(size[1], size[0], self._seed))
+            return self._tiles[size]
+
+    def close(self) -> None:
+        """
+        Stop serving and release the port.
+        """
+        self.shutdown()
+        self.server_close()
+
+def synthetic_tile(height: int, width: int, seed: int = 2015) -> np.ndarray:
+    """
+    Generate a uint8 RGB image with a mixture of green and non-green regions.
+
+    Args:
+        height (int): The image height in pixels.
+        width (int): The image width in pixels.
+        seed (int): The random seed. Default is 2015.
+
+    Returns:
+        np.ndarray: An array of shape (height, width, 3) and dtype uint8.
+    """
+    random = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    fields = (np.sin(x / 23.0) + np.cos(y / 17.0)) > 0
+    pixels = random.integers(40, 120, size = (height, width, 3))
+    pixels[:, :, 1] += np.where(fields, 60, -20)
+    return np.clip(pixels, 0, 255).astype(np.uint8)
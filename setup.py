@@ -18,5 +18,8 @@ setup(
         'numpy',
         'mock'
     ],
-    python_requires='>=3.5' # Specify the required Python version
+    extras_require={
+        'async': ['aiohttp'] # Non-blocking map fetching for Greengraph.aio
+    },
+    python_requires='>=3.8' # Specify the required Python version
 )